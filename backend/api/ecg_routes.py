@@ -10,7 +10,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../.
 
 from signalweaver.ecgs.manager import get_ecg, add_ecg
 from signalweaver.traces.trace_rep import TraceECGSignal
-from api.utils import success_response, error_response, numpy_to_list
+from api.utils import success_response, error_response, array_response
 
 ecg_bp = Blueprint('ecg', __name__)
 
@@ -96,13 +96,15 @@ def get_metadata():
 
 @ecg_bp.route('/ecg/trace', methods=['GET'])
 def get_trace():
-    """Get ECG trace data for current window"""
+    """Get ECG trace data for current window (JSON, or binary arrays - see api.utils)"""
     try:
         ecg = get_ecg()
 
         # Get position and window_length from query params (optional)
         position = request.args.get('position', type=float)
         window_length = request.args.get('window_length', type=float)
+        # Plot width in pixels (optional) - if given, the trace is reduced to about one min/max pair per pixel
+        pixels = request.args.get('pixels', type=int)
 
         # Update window length if provided (directly set, bypassing string lookup)
         if window_length is not None:
@@ -132,36 +134,35 @@ def get_trace():
             ecg.position = position
 
         # Get current window data
-        time = ecg.get_current_time_track()
-        voltage = ecg.get_current_ecg_track()
+        time, voltage = ecg.get_current_window(pixels)
 
         # Get peaks for current window
         normal_pos, normal_vals, first_peak = ecg.get_current_peaks_positions(
             ecg.r_waves_all_pos, ecg.r_waves_all_vals, get_first_peak=True
         )
-        vent_pos, vent_vals, _ = ecg.get_current_peaks_positions(*ecg.get_ventriculars())
-        supra_pos, supra_vals, _ = ecg.get_current_peaks_positions(*ecg.get_supraventriculars())
-        artif_pos, artif_vals, _ = ecg.get_current_peaks_positions(*ecg.get_artifacts())
+        vent_pos, vent_vals, _ = ecg.get_current_peaks_positions(*ecg.get_classified_beats('ventriculars'))
+        supra_pos, supra_vals, _ = ecg.get_current_peaks_positions(*ecg.get_classified_beats('supraventriculars'))
+        artif_pos, artif_vals, _ = ecg.get_current_peaks_positions(*ecg.get_classified_beats('artifacts'))
 
         trace_data = {
-            'time': numpy_to_list(time),
-            'voltage': numpy_to_list(voltage),
+            'time': time,
+            'voltage': voltage,
             'peaks': {
                 'normal': {
-                    'time': numpy_to_list(normal_pos),
-                    'voltage': numpy_to_list(normal_vals)
+                    'time': normal_pos,
+                    'voltage': normal_vals
                 },
                 'ventricular': {
-                    'time': numpy_to_list(vent_pos),
-                    'voltage': numpy_to_list(vent_vals)
+                    'time': vent_pos,
+                    'voltage': vent_vals
                 },
                 'supraventricular': {
-                    'time': numpy_to_list(supra_pos),
-                    'voltage': numpy_to_list(supra_vals)
+                    'time': supra_pos,
+                    'voltage': supra_vals
                 },
                 'artifacts': {
-                    'time': numpy_to_list(artif_pos),
-                    'voltage': numpy_to_list(artif_vals)
+                    'time': artif_pos,
+                    'voltage': artif_vals
                 }
             },
             'position': float(ecg.position),
@@ -173,14 +174,14 @@ def get_trace():
             'first_peak_position': int(first_peak) if first_peak is not None else None
         }
 
-        return success_response(trace_data)
+        return array_response(trace_data)
     except Exception as e:
         return error_response(str(e), 500)
 
 
 @ecg_bp.route('/ecg/poincare', methods=['GET'])
 def get_poincare():
-    """Get Poincaré plot data"""
+    """Get Poincaré plot data (JSON, or binary arrays - see api.utils)"""
     try:
         ecg = get_ecg()
 
@@ -188,15 +189,15 @@ def get_poincare():
             return error_response('Poincaré data not available', 400)
 
         poincare_data = {
-            'xi': numpy_to_list(ecg.RRSignal.poincare.xi),
-            'xii': numpy_to_list(ecg.RRSignal.poincare.xii),
+            'xi': np.asarray(ecg.RRSignal.poincare.xi),
+            'xii': np.asarray(ecg.RRSignal.poincare.xii),
             'range': {
                 'start': float(ecg.poincare_range_start),
                 'end': float(ecg.poincare_range_end)
             }
         }
 
-        return success_response(poincare_data)
+        return array_response(poincare_data)
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -349,17 +350,9 @@ def classify_peak():
         peak_index = np.argmin(np.abs(positions - time_position))
         clicked_at = peak_index + ecg.first_peak_position
 
-        # Update annotation
-        ecg.annotations[clicked_at] = annotation
-
-        # Update derived peak collections
-        ecg.ventriculars_pos, ecg.ventriculars_vals = ecg.get_ventriculars()
-        ecg.supraventriculars_pos, ecg.supraventriculars_vals = ecg.get_supraventriculars()
-        ecg.artifacts_pos, ecg.artifacts_vals = ecg.get_artifacts()
-        ecg.rr_intervals, ecg.rr_annotations = ecg.get_rrs()
-        ecg.update_poincare()
-        ecg.update_results_dict()
-        ecg.change += 1
+        # Update annotation (and everything derived from it, around the beat)
+        ecg.annotate_rr(clicked_at, annotation)
+        ecg.mark_changed()
 
         return success_response({
             'changed': True,
@@ -382,18 +375,11 @@ def insert_peak():
 
         ecg = get_ecg()
 
-        # Use existing insert method
+        # Use existing insert method (it also updates the derived peak collections)
         changed = ecg.insert_new_rr(time_position)
 
         if changed:
-            # Update derived peak collections
-            ecg.ventriculars_pos, ecg.ventriculars_vals = ecg.get_ventriculars()
-            ecg.supraventriculars_pos, ecg.supraventriculars_vals = ecg.get_supraventriculars()
-            ecg.artifacts_pos, ecg.artifacts_vals = ecg.get_artifacts()
-            ecg.rr_intervals, ecg.rr_annotations = ecg.get_rrs()
-            ecg.update_poincare()
-            ecg.update_results_dict()
-            ecg.change += 1
+            ecg.mark_changed()
 
         return success_response({
             'changed': bool(changed),
@@ -415,17 +401,9 @@ def remove_peak():
 
         ecg = get_ecg()
 
-        # Use existing remove method
+        # Use existing remove method (it also updates the derived peak collections)
         ecg.remove_rr(time_position)
-
-        # Update derived peak collections
-        ecg.ventriculars_pos, ecg.ventriculars_vals = ecg.get_ventriculars()
-        ecg.supraventriculars_pos, ecg.supraventriculars_vals = ecg.get_supraventriculars()
-        ecg.artifacts_pos, ecg.artifacts_vals = ecg.get_artifacts()
-        ecg.rr_intervals, ecg.rr_annotations = ecg.get_rrs()
-        ecg.update_poincare()
-        ecg.update_results_dict()
-        ecg.change += 1
+        ecg.mark_changed()
 
         return success_response({
             'changed': True,
@@ -437,7 +415,7 @@ def remove_peak():
 
 @ecg_bp.route('/ecg/save', methods=['POST'])
 def save_ecg():
-    """Save annotations to JSON file"""
+    """Save annotations to the results file"""
     try:
         ecg = get_ecg()
         ecg.update_results_dict()
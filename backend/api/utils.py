@@ -1,4 +1,6 @@
-from flask import jsonify
+import json
+import struct
+from flask import jsonify, request, Response
 import numpy as np
 
 
@@ -29,3 +31,79 @@ def numpy_to_list(obj):
     elif isinstance(obj, list):
         return [numpy_to_list(item) for item in obj]
     return obj
+
+
+# ============================================================================
+# BINARY ARRAY TRANSPORT
+# ============================================================================
+#
+# Layout of a binary response (all little-endian):
+#   uint32 header length | JSON header | padding to 8 bytes | array buffers, each starting at a multiple of 8
+# The header is the response with every array replaced by {"$array": index}, plus "arrays": a list of
+# {"dtype", "offset", "length", "shape"} entries (offset in bytes from the start of the response). The buffers hold
+# the arrays flattened (C order), "shape" is the shape they had.
+
+BINARY_MIMETYPE = 'application/x-signalweaver-arrays'
+BINARY_DTYPES = {'f': {4: '<f4', 8: '<f8'}, 'i': '<i4', 'u': '<i4', 'b': '<u1'}
+
+
+def wants_binary():
+    """Check whether the client asked for binary arrays (?format=binary or the Accept header)"""
+    if request.args.get('format') == 'binary':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', BINARY_MIMETYPE]) == BINARY_MIMETYPE
+
+
+def binary_dtype(array):
+    """
+    Typed array dtype for a numpy array - floats keep their precision, integers become int32 (float64 if they do not
+    fit in it), booleans uint8
+    """
+    dtype = BINARY_DTYPES.get(array.dtype.kind, '<f8')
+    if array.dtype.kind in 'iu' and array.size and array.dtype.itemsize >= 4:
+        info = np.iinfo(np.int32)
+        if array.min() < info.min or array.max() > info.max:
+            return '<f8'
+    return dtype.get(array.dtype.itemsize, '<f8') if isinstance(dtype, dict) else dtype
+
+
+def pack_arrays(data):
+    """Serialize data (dicts, lists, scalars, numpy arrays) to the binary layout described above"""
+    arrays, shapes = [], []
+
+    def placeholders(obj):
+        if isinstance(obj, np.ndarray):
+            arrays.append(np.ascontiguousarray(obj.ravel(), dtype=binary_dtype(obj)))
+            shapes.append(list(obj.shape))
+            return {'$array': len(arrays) - 1}
+        if isinstance(obj, dict):
+            return {key: placeholders(value) for key, value in obj.items()}
+        if isinstance(obj, list):
+            return [placeholders(item) for item in obj]
+        return numpy_to_list(obj)
+
+    data = placeholders(data)
+    # the offsets depend on the length of the header, which holds them - the header is padded to a length
+    # reserved in advance, and the reservation is increased until it fits
+    reserved = 60  # so that the arrays start at a multiple of 8
+    while True:
+        offset = 4 + reserved
+        descriptions = []
+        for array, shape in zip(arrays, shapes):
+            descriptions.append({'dtype': array.dtype.str[1:], 'offset': offset, 'length': len(array), 'shape': shape})
+            offset += array.nbytes + (-array.nbytes % 8)
+        header = json.dumps({'data': data, 'arrays': descriptions}).encode('utf-8')
+        if len(header) <= reserved:
+            break
+        reserved = len(header) + 64 + (-(len(header) + 4) % 8)
+    chunks = [struct.pack('<I', reserved), header.ljust(reserved)]
+    for array in arrays:
+        chunks.extend([array.tobytes(), b'\0' * (-array.nbytes % 8)])
+    return b''.join(chunks)
+
+
+def array_response(data):
+    """Successful response with numpy arrays - binary if the client asked for it, JSON lists otherwise"""
+    if wants_binary():
+        return Response(pack_arrays(data), mimetype=BINARY_MIMETYPE)
+    return success_response(numpy_to_list(data))
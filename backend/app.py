@@ -12,5 +12,9 @@ CORS(app, supports_credentials=True)
 from api.ecg_routes import ecg_bp
 app.register_blueprint(ecg_bp, url_prefix='/api')
 
+# the records used by a request are released when it is done (and saved, if they were dropped from the cache meanwhile)
+from signalweaver.ecgs.manager import release_ecgs
+app.teardown_request(release_ecgs)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
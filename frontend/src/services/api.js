@@ -1,4 +1,5 @@
 import axios from 'axios'
+import { BINARY_MIMETYPE, decodeArrays } from './arrays'
 
 const api = axios.create({
   baseURL: '/api',
@@ -8,6 +9,19 @@ const api = axios.create({
   }
 })
 
+// GET returning arrays - asks for the binary form, falls back to JSON if the server sends JSON (e.g. errors)
+async function getArrays(url, params = {}) {
+  const response = await api.get(url, {
+    params,
+    responseType: 'arraybuffer',
+    headers: { Accept: `${BINARY_MIMETYPE}, application/json;q=0.9` }
+  })
+  if ((response.headers['content-type'] || '').startsWith(BINARY_MIMETYPE)) {
+    return decodeArrays(response.data)
+  }
+  return JSON.parse(new TextDecoder().decode(response.data))
+}
+
 export default {
   // File operations
   async listFiles() {
@@ -26,18 +40,17 @@ export default {
   },
 
   // ECG data
-  async getTrace(position = null, windowLength = null) {
+  async getTrace(position = null, windowLength = null, pixels = null) {
     const params = {}
     if (position !== null) params.position = position
     if (windowLength !== null) params.window_length = windowLength
+    if (pixels !== null) params.pixels = pixels
 
-    const response = await api.get('/ecg/trace', { params })
-    return response.data
+    return getArrays('/ecg/trace', params)
   },
 
   async getPoincare() {
-    const response = await api.get('/ecg/poincare')
-    return response.data
+    return getArrays('/ecg/poincare')
   },
 
   // Manipulation
@@ -0,0 +1,18 @@
+// Binary array transport (see backend/api/utils.py): uint32 header length, JSON header, then the arrays as
+// little-endian typed-array buffers. The header holds the response with every array replaced by {"$array": index}.
+// The typed arrays are flat - the shape of an array sent with more than one dimension is in header.arrays.
+export const BINARY_MIMETYPE = 'application/x-signalweaver-arrays'
+const TYPED_ARRAYS = { f4: Float32Array, f8: Float64Array, i4: Int32Array, u1: Uint8Array }
+
+export function decodeArrays(buffer) {
+  const headerLength = new DataView(buffer).getUint32(0, true)
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)))
+  const arrays = header.arrays.map(({ dtype, offset, length }) => new TYPED_ARRAYS[dtype](buffer, offset, length))
+  const restore = (obj) => {
+    if (Array.isArray(obj)) return obj.map(restore)
+    if (obj === null || typeof obj !== 'object') return obj
+    if ('$array' in obj) return arrays[obj.$array]
+    return Object.fromEntries(Object.entries(obj).map(([key, value]) => [key, restore(value)]))
+  }
+  return { success: true, data: restore(header.data) }
+}
@@ -25,6 +25,7 @@ export const useECGStore = defineStore('ecg', {
     // Window configuration
     windowLength: 300,  // Default to 5 minutes (matches backend default for long recordings)
     position: 0,
+    plotWidth: null,  // Width of the ECG plot in pixels - the backend sends about one min/max pair per pixel
 
     // Available window options (matching backend)
     windowOptions: [
@@ -99,7 +100,8 @@ export const useECGStore = defineStore('ecg', {
     async fetchTrace() {
       this.loadingTrace = true
       try {
-        const result = await api.getTrace(this.position, this.windowLength)
+        const result = await api.getTrace(this.position, this.windowLength,
+          Math.round((this.plotWidth || window.innerWidth) * (window.devicePixelRatio || 1)))
         if (result.success) {
           this.traceData = result.data
         }
@@ -2,6 +2,10 @@ import numpy as np
 from numpy import mean, var, sqrt, where
 from . helper_functions import  shave_ends
 
+# the descriptors in the order PoincareSums.descriptors returns them
+DESCRIPTORS = ['SD1', 'SD2', 'SDNN', 'SD1d', 'C1d', 'SD1a', 'C1a', 'SD1I', 'SD2d', 'C2d', 'SD2a', 'C2a', 'SD2I', 'SDNNd',
+               'Cd', 'SDNNa', 'Ca']
+
 class Poincare:
     def __init__(self, signal):
         # signal is object of Signal class
@@ -9,12 +13,10 @@ class Poincare:
         # the indices above are the indices of the PP points within the whole, unfiltered RR-intervals time series
         # this is because they can be used to navigate the RR-intervals time series on the basis of PP click
         # descriptors will be capital, functions lower case
-        self.SD1 = self.sd1()
-        self.SD2 = self.sd2()
-        self.SDNN = self.sdnn()
-        self.SD1d, self.C1d, self.SD1a, self.C1a, self.SD1I = self.short_term_asymmetry()
-        self.SD2d, self.C2d, self.SD2a, self.C2a, self.SD2I = self.long_term_asymmetry()
-        self.SDNNd, self.Cd, self.SDNNa, self.Ca = self.total_asymmetry()
+        # all the descriptors come from the sums of the pairs, made in one pass over them - the same sums are updated
+        # after a local change (see replace_pairs) and can be merged with those of other segments or recordings
+        self.sums = PoincareSums(self.xi, self.xii)
+        self.set_descriptors()
 
     def prepare_pp(self, signal):
         """
@@ -33,24 +35,20 @@ class Poincare:
 
         signal_local = shave_ends(signal.signal, signal.annotation)
         annotation_local = shave_ends(signal.annotation, signal.annotation)
-        positions_local = shave_ends(np.arange(0,len(signal_local)), signal.annotation)
-        bad_beats = where(annotation_local == 16)[0]
-        bad_beats_minus_one = bad_beats - 1
-        all_bad_beats = np.concatenate((bad_beats, bad_beats_minus_one))
-
-        xi = signal_local[0:(len(signal_local) - 1)]
-        xii = signal_local[1:len(signal_local)]
-        # now removing all bad beats from xi and xii, according to the above paper
-        xi = np.delete(xi, all_bad_beats)
-        xii = np.delete(xii, all_bad_beats)
-
-        xi_indices = positions_local[0:(len(signal_local) - 1)]
-        xi_indices = np.delete(xi_indices, all_bad_beats)
-        xii_indices = positions_local[1:len(signal_local)]  # just for consistency
-        xii_indices = np.delete(xii_indices, all_bad_beats)
+        positions_local = shave_ends(np.arange(0, len(signal.signal)), signal.annotation)
+        # a pair is removed if either of its beats is bad, according to the above paper
+        good_beats = annotation_local != 16
+        good_pairs = good_beats[:-1] & good_beats[1:]
+        xi = signal_local[:-1][good_pairs]
+        xii = signal_local[1:][good_pairs]
+        xi_indices = positions_local[:-1][good_pairs]
+        xii_indices = positions_local[1:][good_pairs]  # just for consistency
 
         return xi, xii, xi_indices, xii_indices
 
+    # the descriptors calculated directly from their definitions - the constructor takes them from PoincareSums, these
+    # are what the sums are checked against
+
     def sd1(self):
         try:
             result = sqrt(var(self.xii - self.xi)/2)
@@ -146,4 +144,107 @@ class Poincare:
         if failed:
             return None, None, None, None
         else:
-            return(SDNNd, Cd, SDNNa, Ca)
\ No newline at end of file
+            return(SDNNd, Cd, SDNNa, Ca)
+
+    def replace_pairs(self, start, stop, xi, xii, xi_indices, index_shift=0):
+        """
+        replaces the pairs start:stop of the plot with new ones and updates the descriptors from the running sums,
+        instead of building the plot again - this is for local changes of the RR intervals (a beat inserted, removed
+        or annotated)
+        :param start: the first pair replaced
+        :param stop: the pair after the last one replaced
+        :param xi: the new pairs - RR_i
+        :param xii: the new pairs - RR_i+1
+        :param xi_indices: the indices of the new RR_i in the RR intervals time series
+        :param index_shift: by how much the RR intervals after the change have moved (the number of RR intervals
+        inserted minus the number of those removed)
+        :return: None
+        """
+        self.sums.remove(self.xi[start:stop], self.xii[start:stop])
+        self.sums.add(xi, xii)
+        if hasattr(self.xi, 'replace'):
+            # arrays which can be edited in place (signalweaver's gap buffers) - the indices after the change are
+            # shifted without being copied
+            for pairs, new_pairs in ((self.xi, xi), (self.xii, xii), (self.x_i_indices, xi_indices),
+                                     (self.x_ii_indices, np.asarray(xi_indices) + 1)):
+                pairs.replace(start, stop, new_pairs)
+            self.x_i_indices.shift(start + len(xi_indices), index_shift)
+            self.x_ii_indices.shift(start + len(xi_indices), index_shift)
+        else:
+            self.xi = np.concatenate((self.xi[:start], xi, self.xi[stop:]))
+            self.xii = np.concatenate((self.xii[:start], xii, self.xii[stop:]))
+            self.x_i_indices = np.concatenate((self.x_i_indices[:start], xi_indices,
+                                               self.x_i_indices[stop:] + index_shift))
+            self.x_ii_indices = self.x_i_indices + 1
+        self.set_descriptors()
+
+    def set_descriptors(self):
+        self.SD1, self.SD2, self.SDNN, self.SD1d, self.C1d, self.SD1a, self.C1a, self.SD1I, self.SD2d, self.C2d, \
+            self.SD2a, self.C2a, self.SD2I, self.SDNNd, self.Cd, self.SDNNa, self.Ca = self.sums.descriptors()
+
+
+class PoincareSums:
+    """
+    the sums all the descriptors of the Poincare plot are calculated from - the pairs are kept as their difference
+    d = RR_i+1 - RR_i and sum s = RR_i+1 + RR_i, split by the sign of d (decelerations, accelerations, no change).
+    Pairs can be added and removed, so after a local change the descriptors are updated at the cost of the change
+    """
+
+    def __init__(self, xi=(), xii=()):
+        # for d > 0, d < 0 and d == 0: the number of pairs, sum of d, sum of d**2, sum of s, sum of s**2
+        self.moments = np.zeros((3, 5))
+        self.add(xi, xii)
+
+    def add(self, xi, xii, sign=1):
+        xi, xii = np.asarray(xi, dtype=float), np.asarray(xii, dtype=float)
+        difference, total = xii - xi, xii + xi
+        # 0 - decelerations, 1 - accelerations, 2 - no change, 3 - undefined (NaN), which is left out
+        group = np.select((difference > 0, difference < 0, difference == 0), (0, 1, 2), 3)
+        for column, weights in enumerate((None, difference, difference ** 2, total, total ** 2)):
+            self.moments[:, column] += sign * np.bincount(group, weights=weights, minlength=4)[:3]
+
+    def remove(self, xi, xii):
+        self.add(xi, xii, sign=-1)
+
+    def merge(self, other):
+        """
+        the sums of the pairs of both - e.g. of the segments of a recording or of all the recordings in a project, so
+        their descriptors are calculated without going through the beats again. The pairs are those which were added,
+        so a pair made of the last beat of one segment and the first beat of the next is not there
+        :param other: PoincareSums
+        :return: new PoincareSums
+        """
+        merged = PoincareSums()
+        merged.moments = self.moments + other.moments
+        return merged
+
+    def descriptors(self):
+        """
+        the same descriptors (and with the same conventions - variances with n in the denominator) as the Poincare
+        class calculates
+        :return: SD1, SD2, SDNN, SD1d, C1d, SD1a, C1a, SD1I, SD2d, C2d, SD2a, C2a, SD2I, SDNNd, Cd, SDNNa, Ca
+        """
+        n, sum_difference, sum_difference2, sum_total, sum_total2 = self.moments.sum(axis=0)
+        n = int(round(n))
+        if n == 0:
+            return (None,) * 17
+        SD1 = sqrt(max(sum_difference2 / n - (sum_difference / n) ** 2, 0) / 2)
+        SD2 = sqrt(max(sum_total2 / n - (sum_total / n) ** 2, 0) / 2)
+        SDNN = sqrt((SD1 ** 2 + SD2 ** 2) / 2)
+        # short term - (RR_i+1 - RR_i)/sqrt(2) split by sign
+        SD1d = sqrt(self.moments[0, 2] / 2 / n)
+        SD1a = sqrt(self.moments[1, 2] / 2 / n)
+        SD1I = sqrt(SD1d ** 2 + SD1a ** 2)
+        C1d, C1a = (SD1d ** 2 / SD1I ** 2, SD1a ** 2 / SD1I ** 2) if SD1I > 0 else (np.nan, np.nan)
+        # long term - (RR_i+1 + RR_i - mean)/sqrt(2), where the mean is that of all the pairs, split by the sign of d;
+        # sum((s - m)**2) = sum(s**2) - 2*m*sum(s) + n*m**2 in every group
+        mean_total = sum_total / n
+        squares = (self.moments[:, 4] - 2 * mean_total * self.moments[:, 3] + self.moments[:, 0] * mean_total ** 2) / 2
+        SD2d = sqrt(max(squares[0] + squares[2] / 2, 0) / n)
+        SD2a = sqrt(max(squares[1] + squares[2] / 2, 0) / n)
+        SD2I = sqrt(SD2d ** 2 + SD2a ** 2)
+        C2d, C2a = ((SD2d / SD2I) ** 2, (SD2a / SD2I) ** 2) if SD2I > 0 else (np.nan, np.nan)
+        SDNNd = sqrt(1 / 2 * (SD1d ** 2 + SD2d ** 2))
+        SDNNa = sqrt(1 / 2 * (SD1a ** 2 + SD2a ** 2))
+        Cd, Ca = (SDNNd ** 2 / SDNN ** 2, SDNNa ** 2 / SDNN ** 2) if SDNN > 0 else (np.nan, np.nan)
+        return SD1, SD2, SDNN, SD1d, C1d, SD1a, C1a, SD1I, SD2d, C2d, SD2a, C2a, SD2I, SDNNd, Cd, SDNNa, Ca
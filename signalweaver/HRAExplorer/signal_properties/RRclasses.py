@@ -1,8 +1,9 @@
 from re import findall
 from numpy import array, where, cumsum
 from . Poincare import Poincare
-#from . runs import Runs
-#from . spectral import LombScargleSpectrum
+from . windowed import WindowedAnalysis
+from . runs import Runs
+from . spectral import LombScargleSpectrum
 
 
 class RRSignal: ### uwaga! timetrack! dodac, przetestowac, zdefiniowac wyjatek, podniesc wyjatek w spectrum gdy nie ma timetracka!
@@ -22,6 +23,7 @@ class RRSignal: ### uwaga! timetrack! dodac, przetestowac, zdefiniowac wyjatek,
         self.poincare = None
         self.runs = None
         self.LS_spectrum = None
+        self.windowed = None
 
     def read_data(self, path_to_file, column_signal, column_annot, column_sample_to_sample):
         if type(path_to_file) == list:
@@ -87,5 +89,9 @@ class RRSignal: ### uwaga! timetrack! dodac, przetestowac, zdefiniowac wyjatek,
     def set_runs(self):
         self.runs = Runs(self)
 
-    def set_LS_spectrum(self):
-        self.LS_spectrum = LombScargleSpectrum(self)
+    def set_LS_spectrum(self, max_frequency=0.5, oversampling=4, time_unit=1000):
+        self.LS_spectrum = LombScargleSpectrum(self, max_frequency=max_frequency, oversampling=oversampling,
+                                               time_unit=time_unit)
+
+    def set_windowed(self, window_length=300000, step=None):
+        self.windowed = WindowedAnalysis(self, window_length=window_length, step=step)
@@ -1,60 +1,143 @@
-from signal_properties.my_exceptions import WrongCuts
-import scipy
+from . my_exceptions import WrongCuts
 import scipy.signal as sc
 import numpy as np
 
+# the standard HRV bands in Hz - ULF, VLF, LF and HF
+HRV_BANDS = [0, 0.003, 0.04, 0.15, 0.4]
+
+
+def extirpolate(positions, values, n_grid, order=6):
+    """
+    spreads the values at positions (in grid steps, not integer) over the nearest order points of a periodic grid
+    with the weights of the Lagrange interpolation, so that sum(grid * f(arange(n_grid))) is close to
+    sum(values * f(positions)) for any smooth f - this is the "extirpolation" of Press, Rybicki, Astrophysical Journal
+    338, 277-280 (1989)
+    :param positions: the positions, 0 <= positions < n_grid
+    :param values: the values (real or complex)
+    :param n_grid: the number of the points of the grid
+    :param order: the number of the grid points every value is spread over
+    :return: the grid
+    """
+    first = np.floor(positions).astype(int) - (order - 1) // 2
+    offsets = positions - first
+    nodes = np.arange(order)
+    grid = np.zeros(n_grid, dtype=np.result_type(values, float))
+    for node in nodes:
+        others = nodes[nodes != node]
+        weighted = values * (np.prod(offsets[:, np.newaxis] - others, axis=1) / np.prod(node - others))
+        indices = (first + node) % n_grid
+        grid += np.bincount(indices, weights=weighted.real, minlength=n_grid)
+        if np.iscomplexobj(weighted):
+            grid += 1j * np.bincount(indices, weights=weighted.imag, minlength=n_grid)
+    return grid
+
+
+def trigonometric_sums(time_track, values, df, n_frequencies, oversampling=8, order=6):
+    """
+    sum(values * sin(2 pi f time_track)) and sum(values * cos(2 pi f time_track)) for f = df, 2 df, ..., n_frequencies df
+    with one FFT - the values are extirpolated onto a regular grid of times first
+    :param oversampling: the number of the grid points per period of the highest frequency (about)
+    :return: the sums of sines, the sums of cosines
+    """
+    n_grid = 2 ** int(np.ceil(np.log2(max(oversampling * n_frequencies, 2 * order))))
+    start = time_track[0]
+    # one period of df is the whole grid
+    positions = ((time_track - start) * df * n_grid) % n_grid
+    sums = np.fft.ifft(extirpolate(positions, values, n_grid, order))[1:n_frequencies + 1] * n_grid
+    # the times were counted from the start
+    sums *= np.exp(2j * np.pi * df * np.arange(1, n_frequencies + 1) * start)
+    return sums.imag, sums.real
+
+
+def fast_lomb_scargle(time_track, values, df, n_frequencies):
+    """
+    the Lomb-Scargle periodogram at the frequencies df, 2 df, ..., n_frequencies df - the sums over the beats are made
+    for all the frequencies at once by trigonometric_sums, so it takes O(N log N) instead of O(N * n_frequencies), Press,
+    Rybicki (1989)
+    :param time_track: the times of the samples
+    :param values: the values, centered
+    :return: the periodogram with the scaling of scipy.signal.lombscargle (A**2 * N / 4 for a sinusoid of amplitude A)
+    """
+    sines, cosines = trigonometric_sums(time_track, values, df, n_frequencies)
+    # the same sums for the doubled frequencies, of ones - the time shift tau of the Lomb-Scargle periodogram
+    double_sines, double_cosines = trigonometric_sums(time_track, np.ones(len(time_track)), 2 * df, n_frequencies)
+    # tan(2 omega tau) = sum(sin(2 omega t)) / sum(cos(2 omega t))
+    omega_tau = np.arctan2(double_sines, double_cosines) / 2
+    hypotenuse = np.hypot(double_sines, double_cosines)
+    cos_tau, sin_tau = np.cos(omega_tau), np.sin(omega_tau)
+    # sum(values * cos(omega (t - tau))), sum(values * sin(omega (t - tau))) and the sums of the squares of the cosines
+    # and the sines - sum(cos(2 omega (t - tau))) is the hypotenuse
+    values_cos = cosines * cos_tau + sines * sin_tau
+    values_sin = sines * cos_tau - cosines * sin_tau
+    cos_squares = (len(time_track) + hypotenuse) / 2
+    sin_squares = (len(time_track) - hypotenuse) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        periodogram = (values_cos ** 2 / cos_squares + np.where(sin_squares > 0, values_sin ** 2 / sin_squares, 0)) / 2
+    return periodogram
+
 
 class LombScargleSpectrum:
-    def __init__(self, signal):
+    def __init__(self, signal, max_frequency=0.5, oversampling=4, time_unit=1000, fast=True):
+        """
+        :param signal: object of the RRSignal class
+        :param max_frequency: the highest frequency of the spectrum, in Hz - the HRV bands end at 0.4 Hz
+        :param oversampling: the frequencies are 1 / (oversampling * the length of the recording) apart
+        :param time_unit: the number of the units of the time track in a second (1000 - the time track is in ms)
+        :param fast: the Press-Rybicki algorithm - fast=False calculates the sums directly (scipy)
+        """
+        self.time_unit = time_unit
         self.filtered_signal, self.filtered_time_track = self.filter_and_timetrack(signal)
-        self.periodogram, self.frequency = self.build_spectrum()
-        # self.bands = self.get_bands(cuts=[0, 0.003, 0.04, 0.15, 0.4], df=self.frequency[1]-self.frequency[0]) # this
-        # is basically the result which is expected in HRV - depending on the length of the recording the first two
-        # entries may be combined to VLF in short recordings
+        self.periodogram, self.frequency = self.build_spectrum(max_frequency, oversampling, fast)
+        # this is basically the result which is expected in HRV - depending on the length of the recording the first
+        # two entries may be combined to VLF in short recordings
+        self.bands = self.get_bands(cuts=HRV_BANDS)
 
     def filter_and_timetrack(self, signal):
         # this function prepares data for Lomb-Scargle - i.e. filtered cumulative sum of time,   filtered signal
-        bad_beats = scipy.where(signal.annotation != 0)[0]
-        filtered_timetrack = scipy.delete(signal.timetrack, bad_beats)
-        filtered_signal = scipy.delete(signal.signal, bad_beats)
-        return filtered_signal, filtered_timetrack
+        time_track = signal.timetrack if len(signal.timetrack) == len(signal.signal) else np.cumsum(signal.signal)
+        good_beats = np.asarray(signal.annotation) == 0
+        return np.asarray(signal.signal, dtype=float)[good_beats], np.asarray(time_track, dtype=float)[good_beats]
 
-    def build_spectrum(self):
-        frequency = scipy.linspace(0.01, 2*scipy.pi, len(self.filtered_time_track))
-        # here the assumption is that the frequencies are below 1Hz
-        # which obviously may not be true
-        periodogram = scisignal.lombscargle(self.filtered_time_track, self.filtered_signal, frequency) / len(self.filtered_time_track) * 4 * self.filtered_time_track[len(self.filtered_time_track)-1] / (2*scipy.pi) / 2
-        return periodogram, frequency
+    def build_spectrum(self, max_frequency, oversampling, fast):
+        """
+        the spectrum from the lowest frequency the recording can show up to max_frequency - only the frequencies in the
+        HRV bands, instead of as many as there are beats
+        :return: the power spectral density (one-sided, so that its integral over the frequencies is the variance, e.g.
+        in ms^2/Hz) and the frequencies in Hz
+        """
+        n_beats = len(self.filtered_time_track)
+        duration = (self.filtered_time_track[-1] - self.filtered_time_track[0]) / self.time_unit if n_beats > 1 else 0
+        if duration <= 0:
+            return np.zeros(0), np.zeros(0)
+        df = 1 / (oversampling * duration)
+        n_frequencies = int(max_frequency / df)
+        frequency = df * np.arange(1, n_frequencies + 1)
+        time_track = self.filtered_time_track / self.time_unit
+        centered = self.filtered_signal - np.mean(self.filtered_signal)
+        if fast:
+            periodogram = fast_lomb_scargle(time_track, centered, df, n_frequencies)
+        else:
+            periodogram = sc.lombscargle(time_track, centered, 2 * np.pi * frequency)
+        # a sinusoid of amplitude A gives a peak of A**2 * N / 4, about 1 / duration wide, and its variance is A**2 / 2
+        return periodogram * 2 * duration / n_beats, frequency
 
-    def get_bands(self, cuts, df):
+    def get_bands(self, cuts, df=None):
+        """
+        the power in the bands cuts[0] - cuts[1], cuts[1] - cuts[2] ...
+        :param cuts: the edges of the bands, in the units of self.frequency
+        :param df: the integration measure, the spacing of the frequencies by default
+        :return: array with the power in every band
+        """
         self.test_cuts(cuts)
-        # cuts is a list holding the frequency bands of interest
-        # df is the integration measure
-        first = cuts[0]
-        power_in_bands = []
-        for second in cuts[1:]:
-            # no interpolation since th frequencies are closely spaced in self.frequency (see the build_spectrum method)
-            first_index = scipy.where(self.frequency >= first)[0]
-            second_index = scipy.where(self.frequency >= second)[0]
-            # print(first_index, second_index, self.frequency[0])
-            if first_index[0] == second_index[0]:
-                # here, if there is no power in the first band, and there is some in the following one,
-                # this condition must hold
-                power_in_bands.append(0.0)
-                first = second # go to the next band
-            elif len(second_index > 0): # if there is any power in the band above the current band
-                power_in_bands.append(sum(self.periodogram[first_index[-1]:second_index[0]]))
-                first = second
-            elif len(first_index) >= 1: # so, there is no power in the band above - is there any power
-                power_in_bands.append(sum(self.periodogram[first_index[0]:first_index[-1]]))
-                break
-            else:
-                break
-        print("dupa", power_in_bands * df)
-        return scipy.array(power_in_bands) * df
+        if df is None:
+            df = self.frequency[1] - self.frequency[0] if len(self.frequency) > 1 else 0
+        # the frequency f belongs to the band first <= f < second
+        edges = np.searchsorted(self.frequency, cuts)
+        cumulative_power = np.concatenate(([0], np.cumsum(self.periodogram)))
+        return np.diff(cumulative_power[edges]) * df
 
     def test_cuts(self, cuts):
-        if len(cuts) != len(scipy.unique(cuts)) or (cuts != sorted(cuts)):
+        if len(cuts) != len(np.unique(cuts)) or list(cuts) != sorted(cuts):
             raise WrongCuts
 
 
@@ -72,9 +155,9 @@ class FFTSpectrum:
     def filter_and_timetrack(signal):
         # this function prepares data for Lomb-Scargle and FFT periodograms - i.e. filtered cumulative sum of time,
         # filtered signal
-        bad_beats = scipy.where(signal.annotation != 0)[0]
-        filtered_timetrack = scipy.delete(signal.timetrack, bad_beats)
-        filtered_signal = scipy.delete(signal.signal, bad_beats)
+        bad_beats = np.where(signal.annotation != 0)[0]
+        filtered_timetrack = np.delete(signal.timetrack, bad_beats)
+        filtered_signal = np.delete(signal.signal, bad_beats)
         return filtered_signal, filtered_timetrack
 
     @staticmethod
@@ -1,12 +1,24 @@
 import unittest
+import os
+import numpy as np
 from numpy import round
-from signal_properties.RRclasses import Signal
+from .. RRclasses import RRSignal
+from .. Poincare import Poincare, PoincareSums
+
+RR1 = os.path.join(os.path.dirname(__file__), '..', 'RR1.csv')
+
+
+def random_signal(n_beats=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    rr_intervals = np.round(800 + 50 * rng.standard_normal(n_beats))
+    annotations = np.where(rng.random(n_beats) < 0.1, rng.integers(1, 4, n_beats), 0)
+    return RRSignal([rr_intervals, annotations], annotation_filter=(1, 2, 3))
 
 
 class TestPoincare(unittest.TestCase):
 
     def setUp(self):
-        self.signal_real1 = Signal("RR1.csv", 1, 2, annotation_filter=(2,))
+        self.signal_real1 = RRSignal(RR1, 0, 1, annotation_filter=(2,))
         self.signal_real1.set_poincare()
 
     def test_first_signal_SD1(self):
@@ -42,5 +54,49 @@ class TestPoincare(unittest.TestCase):
         self.assertTrue(round(self.signal_real1.poincare.SDNNa, 2) == 47.81)
         self.assertTrue(round(self.signal_real1.poincare.Ca, 2) == 0.52)
 
+
+class TestPoincareSums(unittest.TestCase):
+
+    def test_definitions(self):
+        # the sums give the same as the descriptors calculated from their definitions
+        poincare = Poincare(random_signal())
+        poincare.SD1, poincare.SD2 = poincare.sd1(), poincare.sd2()
+        poincare.SDNN = poincare.sdnn()
+        expected = [poincare.SD1, poincare.SD2, poincare.SDNN]
+        short_term, long_term = poincare.short_term_asymmetry(), poincare.long_term_asymmetry()
+        expected += list(short_term) + list(long_term)
+        poincare.SD1d, poincare.SD1a, poincare.SD2d, poincare.SD2a = short_term[0], short_term[2], long_term[0], \
+            long_term[2]
+        expected += list(poincare.total_asymmetry())
+        np.testing.assert_allclose(poincare.sums.descriptors(), expected, rtol=1e-9)
+
+    def test_pairs(self):
+        # the pairs with a bad beat are removed the way they were with np.delete
+        signal = random_signal(seed=1)
+        poincare = Poincare(signal)
+        # the ends are shaved to the first and the last normal beat
+        start, stop = np.where(signal.annotation == 0)[0][[0, -1]]
+        bad_beats = np.where(signal.annotation[start:stop + 1] == 16)[0]
+        kept = np.delete(np.arange(stop - start), np.concatenate((bad_beats, bad_beats - 1)))
+        self.assertTrue(np.array_equal(poincare.x_i_indices, kept + start))
+        self.assertTrue(np.array_equal(poincare.xi, signal.signal[kept + start]))
+        self.assertTrue(np.array_equal(poincare.xii, signal.signal[kept + start + 1]))
+
+    def test_merge(self):
+        poincare = Poincare(random_signal(seed=2))
+        merged = PoincareSums()
+        for start in range(0, len(poincare.xi), 700):
+            merged = merged.merge(PoincareSums(poincare.xi[start:start + 700], poincare.xii[start:start + 700]))
+        np.testing.assert_allclose(merged.descriptors(), poincare.sums.descriptors(), rtol=1e-9)
+        # and the descriptors of two recordings together
+        other = Poincare(random_signal(seed=3))
+        together = PoincareSums(np.concatenate((poincare.xi, other.xi)), np.concatenate((poincare.xii, other.xii)))
+        np.testing.assert_allclose(poincare.sums.merge(other.sums).descriptors(), together.descriptors(), rtol=1e-9)
+
+    def test_empty(self):
+        self.assertEqual(PoincareSums().descriptors(), (None,) * 17)
+        self.assertEqual(PoincareSums().merge(PoincareSums()).descriptors(), (None,) * 17)
+
+
 if __name__ == '__main__':
     unittest.main()
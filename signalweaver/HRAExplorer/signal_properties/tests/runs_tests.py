@@ -1,20 +1,21 @@
 import unittest
-from signal_properties.RRclasses import Signal
-from signal_properties.my_exceptions import WrongSignal
+import numpy as np
+from .. RRclasses import RRSignal
+from .. my_exceptions import WrongSignal
 
 # I learned something - each test calls setup
 
 class TestRuns(unittest.TestCase):
     def setUp(self):
-        self.signal1 = Signal([[0, 2, 3, 4, 5], [0, 0, 0, 0, 0]]) # one decelerating run of length 4
-        self.signal2 = Signal([[0, 2, 3, 4, 5, 4, 3, 2, 1], [0]*9]) # should be one dec run of lenght 4 and one acc of length 4
-        self.signal3 = Signal([[4, 3, 2, 3, 2, 3, 2, 3, 2], [0]*9]) # 1 accelerating run of length 2 [3,2], then a
+        self.signal1 = RRSignal([[0, 2, 3, 4, 5], [0, 0, 0, 0, 0]]) # one decelerating run of length 4
+        self.signal2 = RRSignal([[0, 2, 3, 4, 5, 4, 3, 2, 1], [0]*9]) # should be one dec run of lenght 4 and one acc of length 4
+        self.signal3 = RRSignal([[4, 3, 2, 3, 2, 3, 2, 3, 2], [0]*9]) # 1 accelerating run of length 2 [3,2], then a
         # decelerating run [3], then an accelerating run [2], then a decelerating run [3], then an accelerating run [2]
         # then a decelerating run [3], then an accelerating run - so, 1 accelerating run of length 2, 3 accelerating
         # runs of length 1 and 3 decelerating runs of length 1
-        self.signal4 = Signal([[1, 2, 3, 3, 3, 2, 1], [0, 0, 0, 0, 0, 0, 0]])
-        self.signal5 = Signal([[1, 2, 3, 4, 3, 2, 1], [0, 0, 0, 1, 0, 0, 0]])
-        self.signal6 = Signal([[10, 9, 8, 7, 6, 6, 6, 6, 5, 4, 3, 4, 5, 6], [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1]])
+        self.signal4 = RRSignal([[1, 2, 3, 3, 3, 2, 1], [0, 0, 0, 0, 0, 0, 0]])
+        self.signal5 = RRSignal([[1, 2, 3, 4, 3, 2, 1], [0, 0, 0, 1, 0, 0, 0]])
+        self.signal6 = RRSignal([[10, 9, 8, 7, 6, 6, 6, 6, 5, 4, 3, 4, 5, 6], [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1]])
         self.signal1.set_runs()
         self.signal2.set_runs()
         self.signal3.set_runs()
@@ -25,7 +26,7 @@ class TestRuns(unittest.TestCase):
         # a deceleration run of length 2 => dec_runs = [0, 1], acc_runs = [0, 0, 2], neutral_runs = [0, 1]
 
 
-        #self.signal4 = Signal([[0,3,2,3,2,3,2,3,2], [0]*10]) # 4 accelerating runs of length 2
+        #self.signal4 = RRSignal([[0,3,2,3,2,3,2,3,2], [0]*10]) # 4 accelerating runs of length 2
 
     # uncomment to test some internal methods - you will also need to uncomment them in the constructor
     # def test_segmentation(self): # uncomment to test the segmentation - also, in the constructor of the Runs class uncomment self.sinus_segments = self.split_on_annot(signal)
@@ -36,8 +37,10 @@ class TestRuns(unittest.TestCase):
     #     self.assertTrue(allclose(self.signal3.runs.sinus_segments, [array([3.3, 3.2, 3.8]),  array([3.3, 0.5, 3.3])]))
 
     def test_count_runs_exception(self):
-        signal = Signal([[3,2], [0,3]])
+        signal = RRSignal([[3,2], [0,3]])
         self.assertRaises(WrongSignal, signal.set_runs) # this is how constructor of a class should be tested for exceptions!
+        signal = RRSignal([[3], [0]])
+        self.assertRaises(WrongSignal, signal.set_runs)
 
     def test_runs_simple(self):
         # in the tests below we do not actually need .all(), because we are comparing regular lists - in the case of
@@ -68,5 +71,23 @@ class TestRuns(unittest.TestCase):
         self.assertTrue(self.signal6.runs.acc_runs == [0, 0, 2])
         self.assertTrue(self.signal6.runs.neutral_runs == [0, 1])
 
+    def test_long(self):
+        rng = np.random.default_rng(0)
+        rr_intervals = np.round(80 + 5 * rng.standard_normal(100000))
+        annotations = np.zeros(100000, dtype=int)
+        # at least two sinus beats between the annotated ones - a segment of a single beat is WrongSignal
+        annotated = np.cumsum(rng.integers(3, 200, 1000))
+        annotations[annotated[annotated < 99990]] = 1
+        signal = RRSignal([rr_intervals, annotations])
+        signal.set_runs()
+        runs = signal.runs.dec_runs, signal.runs.acc_runs, signal.runs.neutral_runs
+        # every difference between two sinus beats is in exactly one run
+        differences = np.sum((annotations[1:] == 0) & (annotations[:-1] == 0))
+        self.assertEqual(sum(count * (length + 1) for counts in runs for length, count in enumerate(counts)),
+                         differences)
+        for counts in runs:
+            self.assertTrue(all(type(count) is int for count in counts))
+            self.assertTrue(counts[-1] > 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import numpy as np
+from .. RRclasses import RRSignal
+from .. Poincare import Poincare, DESCRIPTORS
+from .. runs import find_runs
+
+
+def random_signal(n_beats=4000, seed=0, annotation_filter=(1, 2, 3)):
+    rng = np.random.default_rng(seed)
+    # rounded to 10 ms, so that there are some runs with no change
+    rr_intervals = np.round(80 + 6 * rng.standard_normal(n_beats)) * 10
+    annotations = np.where(rng.random(n_beats) < 0.03, rng.integers(1, 4, n_beats), 0)
+    return RRSignal([rr_intervals, annotations], annotation_filter=annotation_filter)
+
+
+def count_runs(signal, annotation):
+    # the runs the way Runs counts them - split on the annotated beats, the first beat of every piece is the reference
+    counts = {direction: {} for direction in ('dec', 'acc', 'neutral')}
+    last, length = None, 0
+    for index in range(1, len(signal) + 1):
+        if index < len(signal) and annotation[index] == 0 and annotation[index - 1] == 0:
+            difference = signal[index] - signal[index - 1]
+            current = 'dec' if difference > 0 else 'acc' if difference < 0 else 'neutral'
+        else:
+            current = None
+        if current != last or current is None:
+            if last is not None:
+                counts[last][length] = counts[last].get(length, 0) + 1
+            length = 0
+        last, length = current, length + 1
+    return counts
+
+
+class TestWindowedAnalysis(unittest.TestCase):
+
+    def assertSameAsWindows(self, signal, window_length, step):
+        signal.set_windowed(window_length, step)
+        table = signal.windowed.table
+        self.assertTrue(len(table) > 1)
+        for start, row in table.iterrows():
+            first, after_last = np.searchsorted(signal.timetrack, [start, start + window_length])
+            self.assertEqual(row['beats'], after_last - first)
+            window = RRSignal([signal.signal[first:after_last].copy(), signal.annotation[first:after_last].copy()])
+            poincare = Poincare(window)
+            self.assertEqual(row['pairs'], len(poincare.xi))
+            for descriptor in DESCRIPTORS:
+                self.assertAlmostEqual(row[descriptor], getattr(poincare, descriptor), places=6, msg=descriptor)
+            expected = count_runs(window.signal, window.annotation)
+            for column in table.columns[2 + len(DESCRIPTORS):]:
+                direction, length = column.rstrip('0123456789'), int(column.lstrip('decutrlan'))
+                self.assertEqual(row[column], expected[direction].get(length, 0), column)
+
+    def test_sliding(self):
+        self.assertSameAsWindows(random_signal(), 300000, 30000)
+
+    def test_next_to_each_other(self):
+        signal = random_signal(seed=1)
+        self.assertSameAsWindows(signal, 300000, None)
+        self.assertEqual(signal.windowed.table['beats'].sum(), len(signal.signal))
+
+    def test_gaps(self):
+        self.assertSameAsWindows(random_signal(seed=2), 60000, 100000)
+
+    def test_unfiltered_annotations(self):
+        # the beats annotated 3 are not filtered - the pairs with them are kept, except at the edges of the windows,
+        # which are shaved to the first and the last sinus beat as in Poincare
+        signal = random_signal(seed=3, annotation_filter=(1, 2))
+        self.assertTrue(np.any(signal.annotation == 3))
+        self.assertSameAsWindows(signal, 20000, 7000)
+
+    def test_find_runs(self):
+        signal = np.array([800, 810, 820, 820, 820, 810, 800, 790, 800, 810, 810])
+        annotation = np.array([0, 0, 0, 0, 0, 0, 16, 0, 0, 0, 0])
+        starts, ends, directions = find_runs(signal, annotation)
+        self.assertEqual(list(starts), [1, 3, 5, 8, 10])
+        self.assertEqual(list(ends), [3, 5, 6, 10, 11])
+        self.assertEqual(list(directions), [0, 2, 1, 0, 2])
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from . Poincare import PoincareSums, DESCRIPTORS
+from . runs import find_runs
+
+RUN_DIRECTIONS = ("dec", "acc", "neutral")
+
+
+class WindowedAnalysis:
+    """
+    the Poincare plot descriptors and the monotonic runs in windows sliding over the recording (e.g. 5 minute windows
+    over a 24 hour Holter), updated as the beats enter and leave the window instead of being calculated again for
+    every window
+    """
+
+    def __init__(self, signal, window_length=300000, step=None):
+        """
+        :param signal: object of the RRSignal class, the window i covers the RR intervals which end between
+        start + i * step and start + i * step + window_length on its time track (the cumulative sum of the RR
+        intervals if the signal has no time track)
+        :param window_length: the length of the window, in the units of the time track (ms for the HRAExplorer files)
+        :param step: by how much the window moves, the default is window_length - windows next to each other
+        """
+        self.window_length = window_length
+        self.step = window_length if step is None else step
+        self.table = self.slide(signal)
+
+    def window_limits(self, signal):
+        """
+        :return: the starts of the windows and the first and the after-last RR interval in each
+        """
+        time_track = signal.timetrack if len(signal.timetrack) == len(signal.signal) else np.cumsum(signal.signal)
+        if len(time_track) == 0:
+            return np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        # the recording starts where the first RR interval starts
+        window_starts = np.arange(time_track[0] - signal.signal[0], time_track[-1], self.step)
+        first = np.searchsorted(time_track, window_starts)
+        after_last = np.searchsorted(time_track, window_starts + self.window_length)
+        return window_starts, first, after_last
+
+    def slide(self, signal):
+        """
+        goes through the windows - the Poincare pairs and the runs which have entered the window since the previous one
+        are added and those which have left are removed. The pairs are those of the Poincare class calculated for the
+        RR intervals in the window - the window is shaved to its first and last sinus beat (see shave_ends) and a pair
+        with a filtered beat, annotated 16, is left out. The runs are those of the Runs class calculated for the RR
+        intervals in the window - the runs cut by the edges of the window are counted with the part inside
+        :return: pandas DataFrame indexed by the start of the window, with the number of the RR intervals and
+        the Poincare pairs, the Poincare descriptors and the number of the runs of every direction and length
+        """
+        rr_intervals, annotation = np.asarray(signal.signal, dtype=float), np.asarray(signal.annotation)
+        window_starts, first, after_last = self.window_limits(signal)
+        good_beats = annotation != 16
+        good_pairs = good_beats[:-1] & good_beats[1:]
+        # the pairs from the first to the last sinus beat of the window (the pairs are identified by their first beat)
+        sinus_beats = np.append(np.flatnonzero(annotation == 0), len(annotation))
+        pairs_starts = sinus_beats[np.searchsorted(sinus_beats[:-1], first)]
+        pairs_stops = np.maximum(sinus_beats[np.maximum(np.searchsorted(sinus_beats[:-1], after_last) - 1, 0)],
+                                 pairs_starts)
+        run_starts, run_ends, run_directions = find_runs(rr_intervals, annotation)
+        run_lengths = run_ends - run_starts
+        longest = int(run_lengths.max()) if len(run_lengths) else 0
+
+        sums, pair_range = PoincareSums(), (0, 0)
+        run_counts, run_range = np.zeros((3, longest), dtype=int), (0, 0)
+        rows = []
+        for beats_start, beats_stop, pairs_start, pairs_stop in zip(first, after_last, pairs_starts, pairs_stops):
+            if pairs_start >= pair_range[1]:
+                # nothing in common with the previous window
+                sums = PoincareSums(*self.pairs(rr_intervals, good_pairs, pairs_start, pairs_stop))
+            else:
+                sums.remove(*self.pairs(rr_intervals, good_pairs, pair_range[0], pairs_start))
+                sums.add(*self.pairs(rr_intervals, good_pairs, pair_range[1], pairs_stop))
+            pair_range = (pairs_start, pairs_stop)
+            # the differences beats_start + 1:beats_stop, and the runs entirely within them
+            differences_start, differences_stop = beats_start + 1, max(beats_stop, beats_start + 1)
+            runs_start = np.searchsorted(run_starts, differences_start)
+            runs_stop = max(np.searchsorted(run_ends, differences_stop, side='right'), runs_start)
+            if runs_start >= run_range[1]:
+                run_counts[:] = 0
+                self.count_runs(run_counts, run_directions, run_lengths, runs_start, runs_stop, 1)
+            else:
+                self.count_runs(run_counts, run_directions, run_lengths, run_range[0], runs_start, -1)
+                self.count_runs(run_counts, run_directions, run_lengths, run_range[1], runs_stop, 1)
+            run_range = (runs_start, runs_stop)
+            window_counts = run_counts.copy()
+            # the runs cut by the edges of the window
+            for run in (runs_start - 1, runs_stop):
+                if 0 <= run < len(run_starts):
+                    length = min(run_ends[run], differences_stop) - max(run_starts[run], differences_start)
+                    if length > 0:
+                        window_counts[run_directions[run], length - 1] += 1
+            rows.append([beats_stop - beats_start, int(round(sums.moments[:, 0].sum()))] + list(sums.descriptors()) +
+                        list(window_counts.ravel()))
+
+        columns = ["beats", "pairs"] + DESCRIPTORS + [direction + str(length + 1) for direction in RUN_DIRECTIONS
+                                                       for length in range(longest)]
+        table = pd.DataFrame(rows, columns=columns, index=pd.Index(window_starts, name="start"))
+        return table.astype({column: float for column in DESCRIPTORS})
+
+    @staticmethod
+    def pairs(rr_intervals, good_pairs, start, stop):
+        selected = good_pairs[start:stop]
+        return rr_intervals[start:stop][selected], rr_intervals[start + 1:stop + 1][selected]
+
+    @staticmethod
+    def count_runs(run_counts, run_directions, run_lengths, start, stop, sign):
+        np.add.at(run_counts, (run_directions[start:stop], run_lengths[start:stop] - 1), sign)
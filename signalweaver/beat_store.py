@@ -0,0 +1,282 @@
+"""
+the R-waves being edited, and what is derived from them (the beats of every kind, the RR intervals, the Poincare
+pairs), kept in gap buffers - arrays with free room (the gap) where they are edited, so that an edit fills or widens the
+gap instead of allocating and copying a new array. The rest of the code gets plain NumPy arrays, views of the buffers
+with the gap moved to their end (see GapArray.view) - an edit moves the items after it in place, and the buffers only
+grow when the gap has been used up
+"""
+import weakref
+import numpy as np
+
+# the buffers of the gap arrays, by id - to recognize the views of them (see in_gap_buffer)
+BUFFERS = weakref.WeakValueDictionary()
+
+
+def in_gap_buffer(array):
+    """
+    :param array: anything
+    :return: whether it is a view of the buffer of a GapArray - such a view changes when the GapArray is edited
+    """
+    base = array.base if isinstance(array, np.ndarray) else None
+    return base is not None and BUFFERS.get(id(base)) is base
+
+
+class GapArray(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    a sorted or unsorted 1D array in a gap buffer. Indexing with an integer or a slice and searchsorted only look at the
+    items asked for; everything else (arithmetic, comparisons, NumPy functions, boolean masks) works on a flat copy,
+    as np.asarray(gap_array) gives it
+    """
+
+    def __init__(self, items, slack=1024):
+        """
+        :param items: the items, 1D
+        :param slack: the size of the gap - the number of items which can be inserted before the buffer has to grow
+        """
+        items = np.asarray(items)
+        self.buffer = np.empty(len(items) + slack, dtype=items.dtype)
+        self.buffer[:len(items)] = items
+        BUFFERS[id(self.buffer)] = self.buffer
+        self.gap_start, self.gap_stop = len(items), len(self.buffer)
+        self.offset = 0  # added to every item after the gap (see shift)
+
+    def __len__(self):
+        return len(self.buffer) - self.gap_stop + self.gap_start
+
+    @property
+    def dtype(self):
+        return self.buffer.dtype
+
+    @property
+    def shape(self):
+        return len(self),
+
+    @property
+    def size(self):
+        return len(self)
+
+    ndim = 1
+
+    def __repr__(self):
+        return 'GapArray({!r})'.format(np.asarray(self))
+
+    def __array__(self, dtype=None, copy=None):
+        flat = np.concatenate((self.buffer[:self.gap_start], self.after_gap(self.gap_stop, len(self.buffer))))
+        return flat if dtype is None else flat.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(item) if isinstance(item, GapArray) else item for item in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __iter__(self):
+        return iter(np.asarray(self))
+
+    def copy(self):
+        return np.asarray(self)
+
+    def tolist(self):
+        return np.asarray(self).tolist()
+
+    def astype(self, dtype):
+        return np.asarray(self).astype(dtype)
+
+    def after_gap(self, start, stop):
+        # buffer[start:stop], with start and stop after the gap, as the items they hold
+        return self.buffer[start:stop] + self.offset if self.offset else self.buffer[start:stop]
+
+    def position(self, index):
+        # the place of the item index in the buffer
+        if not -len(self) <= index < len(self):
+            raise IndexError("index {} is out of bounds for size {}".format(index, len(self)))
+        index %= len(self)
+        return index if index < self.gap_start else index + self.gap_stop - self.gap_start
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            position = self.position(key)
+            return self.buffer[position] if position < self.gap_start else self.buffer[position] + self.offset
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(len(self))
+            stop = max(start, stop)
+            gap = self.gap_stop - self.gap_start
+            return np.concatenate((self.buffer[start:min(stop, self.gap_start)],
+                                   self.after_gap(max(start, self.gap_start) + gap, max(stop, self.gap_start) + gap)))
+        return np.asarray(self)[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, (int, np.integer)):
+            position = self.position(key)
+            self.buffer[position] = value if position < self.gap_start else value - self.offset
+        else:
+            # with the gap at the end the items are buffer[:len(self)]
+            self.move_gap(len(self))
+            self.buffer[:self.gap_start][key] = value
+
+    def searchsorted(self, value, side='left', sorter=None):
+        """
+        np.searchsorted on the items, which have to be sorted - both sides of the gap are searched, so nothing is
+        copied
+        :param sorter: not used, the items are sorted (np.searchsorted always passes it)
+        """
+        return np.searchsorted(self.buffer[:self.gap_start], value, side=side) + \
+            np.searchsorted(self.buffer[self.gap_stop:], np.subtract(value, self.offset), side=side)
+
+    def move_gap(self, index):
+        """
+        moves the gap to before the item index - the items between the gap and index go to its other side
+        """
+        if index < self.gap_start:
+            moved = self.buffer[index:self.gap_start]
+            if self.offset:
+                moved -= self.offset
+            self.buffer[self.gap_stop - len(moved):self.gap_stop] = moved
+            self.gap_start, self.gap_stop = index, self.gap_stop - len(moved)
+        elif index > self.gap_start:
+            moved = self.after_gap(self.gap_stop, self.gap_stop + index - self.gap_start)
+            self.buffer[self.gap_start:index] = moved
+            self.gap_start, self.gap_stop = index, self.gap_stop + len(moved)
+        if self.gap_stop == len(self.buffer):
+            self.offset = 0  # there is nothing after the gap
+
+    def replace(self, start, stop, items):
+        """
+        replaces the items start:stop with items (of any number - inserting is replacing none, removing is replacing
+        with none)
+        """
+        if not 0 <= start <= stop <= len(self):
+            raise IndexError("items {}:{} are out of bounds for size {}".format(start, stop, len(self)))
+        items = np.asarray(items)
+        self.move_gap(start)
+        self.gap_stop += stop - start
+        if self.gap_stop - self.gap_start < len(items):
+            # the gap is too small - a larger buffer, with the gap as large as the items
+            room = max(len(items), len(self.buffer))
+            buffer = np.empty(len(self.buffer) + room, dtype=self.buffer.dtype)
+            buffer[:self.gap_start] = self.buffer[:self.gap_start]
+            buffer[self.gap_stop + room:] = self.buffer[self.gap_stop:]
+            self.buffer, self.gap_stop = buffer, self.gap_stop + room
+            BUFFERS[id(self.buffer)] = self.buffer
+        self.buffer[self.gap_start:self.gap_start + len(items)] = items
+        self.gap_start += len(items)
+
+    def insert(self, index, item):
+        self.replace(index, index, [item])
+
+    def delete(self, index):
+        self.replace(index, index + 1, [])
+
+    def shift(self, start, amount):
+        """
+        adds amount to the items start: - e.g. to the indices after the place where items were inserted. The items are
+        not changed, the gap is moved to start and the amount added to the offset of the items after it
+        """
+        self.move_gap(start)
+        self.offset += amount
+
+    def view(self):
+        """
+        :return: the items as a NumPy array - a view of the buffer, with the gap moved to its end. The view is
+        changed by the next edit, which moves the items after the edit in place
+        """
+        self.move_gap(len(self))
+        return self.buffer[:self.gap_start]
+
+
+class EditBuffers:
+    """
+    the gap buffers the arrays of a record (and of its RR signal and Poincare plot) are edited in - the objects hold
+    plain arrays, views of the buffers handed out after every edit
+    """
+
+    def __init__(self):
+        self.buffers = {}  # (type of the object, attribute) -> [GapArray, the view handed out]
+
+    def edit(self, owner, attribute):
+        """
+        :return: the GapArray to edit owner.attribute in - a new one, copied from the array, if the array is not the
+        view last handed out for it (the array has been replaced, e.g. calculated again)
+        """
+        key = (type(owner), attribute)
+        array = getattr(owner, attribute)
+        buffer, view = self.buffers.get(key, (None, None))
+        if view is not array:
+            buffer = GapArray(array)
+        self.buffers[key] = [buffer, None]
+        return buffer
+
+    def publish(self, owner, attribute):
+        """
+        sets owner.attribute to the view of the buffer it was edited in
+        """
+        entry = self.buffers[(type(owner), attribute)]
+        entry[1] = entry[0].view()
+        setattr(owner, attribute, entry[1])
+
+
+class BeatStore:
+
+    def __init__(self, positions, values, annotations, slack=1024):
+        """
+        :param positions: the positions (times) of the R-waves, sorted
+        :param values: the values of the ECG at the R-waves
+        :param annotations: the annotations of the R-waves
+        :param slack: the number of beats which can be inserted before the buffers have to grow
+        """
+        self.columns = tuple(GapArray(column, slack) for column in (positions, values, annotations))
+        self.views = None
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    @property
+    def positions(self):
+        return self.columns[0]
+
+    @property
+    def values(self):
+        return self.columns[1]
+
+    @property
+    def annotations(self):
+        return self.columns[2]
+
+    def arrays(self):
+        """
+        :return: the positions, values and annotations as NumPy arrays - views of the columns, changed by the next edit
+        """
+        self.views = tuple(column.view() for column in self.columns)
+        return self.views
+
+    def backs(self, positions, values, annotations):
+        """
+        checks whether the arrays are the ones last handed out by the store - if they are not, the R-waves have been
+        replaced (loaded, detected again) and the store is out of date
+        """
+        return self.views is not None and all(array is view for array, view in zip((positions, values, annotations),
+                                                                                    self.views))
+
+    def find(self, time, side='left'):
+        """
+        :param time: time
+        :param side: see np.searchsorted - 'left' gives the first beat at or after time, 'right' the first after it
+        :return: the index of the beat
+        """
+        return int(self.positions.searchsorted(time, side=side))
+
+    def insert(self, index, position, value, annotation):
+        """
+        inserts a beat before the beat index
+        """
+        if not 0 <= index <= len(self):
+            raise IndexError("index {} is out of bounds for {} beats".format(index, len(self)))
+        for column, item in zip(self.columns, (position, value, annotation)):
+            column.insert(index, item)
+
+    def delete(self, index):
+        """
+        removes the beat index
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("index {} is out of bounds for {} beats".format(index, len(self)))
+        for column in self.columns:
+            column.delete(index)
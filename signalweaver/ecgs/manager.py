@@ -1,32 +1,256 @@
-from flask import session
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from flask import session, g, has_request_context
+from ..beat_store import in_gap_buffer
 
 
 INITIAL_ECG_NAME = None
 
-ECGS = {}
+MAX_RECORDS = 8  # records kept in memory at the same time
+MAX_MEMORY = 2 * 1024 ** 3  # bytes - the recordings themselves are memory-mapped and are not counted
+# if set, the results for the inverted ECG are calculated in the background after loading, so that inverting is
+# instant - at the cost of a second detection for every record opened, so it is off by default
+BOTH_POLARITIES = False
 
 
-def get_ecg(reload=False):
+def footprint(ecg, seen=None):
+    """
+    estimates the memory taken by a record - all the arrays it holds (the results for both polarities, the
+    pyramid...), each counted once. Memory-mapped arrays are not counted, the OS can drop their pages at any time. For
+    the edited arrays, views of gap buffers (see beat_store), the whole buffer is counted
+    :param ecg: the record
+    :param seen: the ids of the arrays already counted (e.g. for the record of another session sharing them), which
+    are not counted again - updated with those of this record
+    :return: size in bytes
+    """
+    seen, size = set() if seen is None else seen, 0
+    candidates = list(vars(ecg).values())
+    for results in getattr(ecg, 'full_data', None) or []:
+        # only what has been read - looking at the values of a lazily read results would read all of them
+        candidates.extend(getattr(results, 'in_memory', results).values())
+    pyramid = getattr(ecg, 'pyramid', None)
+    if pyramid is not None:
+        candidates.extend(array for _, minima, maxima in pyramid.levels for array in (minima, maxima))
+    for candidate in candidates:
+        if in_gap_buffer(candidate):
+            candidate = candidate.base
+        if isinstance(candidate, np.ndarray) and not isinstance(candidate, np.memmap) and id(candidate) not in seen:
+            seen.add(id(candidate))
+            size += candidate.nbytes
+    return size
+
+
+def flush(ecg):
+    """
+    saves the results of a record dropped from the cache, if there are changes which have not been saved yet, and
+    closes it - it saves nothing and stops waiting for the results for the other polarity (see ECG.close)
+    """
+    if ecg.change != ecg.saved_change:
+        ecg.update_results_dict()
+        ecg.save_processed_data()
+    ecg.close()
+
+
+class ECGCache:
+    """
+    the records loaded by the users, least recently used first - every user (session) has their own record, as the
+    position of the viewing window is kept in it, and the records of one recording share their results (see
+    TraceECGSignal.share). When there are more than max_records records, or they take more than max_memory, the least
+    recently used ones are dropped (and their changes saved). A record still used by a request when it is dropped is
+    saved when the request releases it, so that the changes the request makes are saved too
+    """
+
+    def __init__(self, max_records=MAX_RECORDS, max_memory=MAX_MEMORY):
+        self.max_records = max_records
+        self.max_memory = max_memory
+        self.records = OrderedDict()
+        self.in_use = {}  # record -> the number of requests using it
+        self.dropped = set()  # the records dropped while in use, saved when released
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def get(self, key, use=False):
+        """
+        :param use: if set, the record is used until it is released (see release)
+        """
+        with self.lock:
+            ecg = self.records.get(key)
+            if ecg is not None:
+                self.records.move_to_end(key)
+                if use:
+                    self.acquire(ecg)
+            return ecg
+
+    def find(self, name):
+        """
+        :return: a record of the recording name opened in another session (the keys are (name, session id)), also one
+        which has been dropped but is still used - None if there is none
+        """
+        with self.lock:
+            for key, ecg in reversed(self.records.items()):
+                if key[0] == name:
+                    return ecg
+            return next((ecg for ecg in self.dropped if ecg.file_path == name), None)
+
+    def put(self, key, ecg, use=False):
+        """
+        adds the record and drops the least recently used ones if needed
+        :param use: see get
+        """
+        with self.lock:
+            self.records[key] = ecg
+            self.records.move_to_end(key)
+            if use:
+                self.acquire(ecg)
+        self.shrink()
+        return ecg
+
+    def acquire(self, ecg):
+        with self.lock:
+            self.in_use[ecg] = self.in_use.get(ecg, 0) + 1
+
+    def release(self, ecg):
+        """
+        the request is done with the record - if it was dropped in the meantime and no other request uses it, it is
+        saved and closed now
+        """
+        with self.lock:
+            self.in_use[ecg] -= 1
+            if self.in_use[ecg] > 0:
+                return
+            del self.in_use[ecg]
+            if ecg not in self.dropped:
+                return
+            self.dropped.remove(ecg)
+        flush(ecg)
+
+    def drop(self, evicted):
+        # saving takes a while - it is done after the cache has been released, and only for the records not in use
+        with self.lock:
+            unused = [ecg for ecg in evicted if ecg not in self.in_use]
+            self.dropped.update(ecg for ecg in evicted if ecg in self.in_use)
+        for ecg in unused:
+            flush(ecg)
+
+    def pop(self, key):
+        """
+        drops the record, its changes are saved
+        """
+        with self.lock:
+            ecg = self.records.pop(key, None)
+        if ecg is not None:
+            self.drop([ecg])
+        return ecg
+
+    def shrink(self):
+        """
+        drops the least recently used records until the limits are kept - the most recent record always stays. The
+        records grow while they are used (e.g. the pyramid is built on the first long window), so this is also worth
+        calling when nothing has been added
+        """
+        evicted = []
+        with self.lock:
+            while len(self.records) > self.max_records:
+                evicted.append(self.records.popitem(last=False)[1])
+            # the arrays shared by several records are counted for the most recent one
+            seen = set()
+            sizes = [footprint(ecg, seen) for ecg in reversed(self.records.values())][::-1]
+            while len(self.records) > 1 and sum(sizes) > self.max_memory:
+                evicted.append(self.records.popitem(last=False)[1])
+                sizes.pop(0)
+        self.drop(evicted)
+
+    def clear(self):
+        with self.lock:
+            evicted = list(self.records.values())
+            self.records.clear()
+        self.drop(evicted)
+
+
+ECGS = ECGCache()
+# loading a record can take long, so it is done outside of the cache lock - these locks (one per recording, kept while
+# someone is loading it) only keep two requests from loading the same recording at the same time
+LOADING_LOCKS = {}  # name -> (lock, the number of requests holding or waiting for it)
+LOADING_LOCKS_LOCK = threading.Lock()
+
+
+@contextmanager
+def loading(name):
+    with LOADING_LOCKS_LOCK:
+        loading_lock, n_waiting = LOADING_LOCKS.get(name, (threading.Lock(), 0))
+        LOADING_LOCKS[name] = (loading_lock, n_waiting + 1)
     try:
-        name = session['ecg_name']
+        with loading_lock:
+            yield
+    finally:
+        with LOADING_LOCKS_LOCK:
+            n_waiting = LOADING_LOCKS[name][1] - 1
+            if n_waiting == 0:
+                del LOADING_LOCKS[name]  # nobody else is loading the recording
+            else:
+                LOADING_LOCKS[name] = (loading_lock, n_waiting)
+
+
+def current_key():
+    try:
+        return session['ecg_name'], session.get('session_id')
     except (RuntimeError, KeyError):
-        global INITIAL_ECG_NAME
-        name = INITIAL_ECG_NAME
+        return INITIAL_ECG_NAME, None
+
+
+def get_ecg(reload=False):
+    """
+    the record of the current session - loaded, or shared with another session which has the recording open. Within a
+    request the record is used until the request is done (see release_ecgs)
+    """
+    name, session_id = current_key()
 
     assert name, "Not ecg name found !"
 
-    ecg = ECGS.get(name)
-    if not ecg or reload:
-        from signalweaver.traces.trace_rep import TraceECGSignal
-        ecg = TraceECGSignal(name)  # this is global an constant for now
-        ECGS.clear()
-        ECGS[name] = ecg
+    key = (name, session_id)
+    use = has_request_context()
+    if reload:
+        ECGS.pop(key)  # the changes are saved before the record is read again
+    ecg = ECGS.get(key, use)
+    if ecg is None:
+        with loading(name):
+            ecg = ECGS.get(key, use)
+            if ecg is None:
+                other = ECGS.find(name)
+                if other is not None:
+                    ecg = ECGS.put(key, other.share(), use)
+                else:
+                    from signalweaver.traces.trace_rep import TraceECGSignal
+                    ecg = ECGS.put(key, TraceECGSignal(name, both_polarities=BOTH_POLARITIES), use)
+    else:
+        ECGS.shrink()
+    if use:
+        g.setdefault('ecgs_in_use', []).append(ecg)
+    ecg.take_shared_results()  # the changes made in the other sessions
     return ecg
 
 
+def release_ecgs(exception=None):
+    """
+    to be called when a request is done (see backend/app.py) - the records it used are released, and those dropped
+    from the cache in the meantime are saved
+    """
+    for ecg in g.pop('ecgs_in_use', []):
+        ECGS.release(ecg)
+
+
 def add_ecg(name):
     try:
         session['ecg_name'] = name
+        session.setdefault('session_id', uuid.uuid4().hex)
     except RuntimeError:
         global INITIAL_ECG_NAME
         INITIAL_ECG_NAME = name
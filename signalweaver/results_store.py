@@ -0,0 +1,215 @@
+"""
+the on-disk cache of the detection results - one uncompressed .npz archive per recording, holding every array of
+ECG.full_data under '<slot>/<key>', slot 0 being the normal and slot 1 the inverted ECG. The arrays are only read
+when they are first used
+"""
+import os
+import json
+import atexit
+import threading
+import uuid
+import weakref
+from collections.abc import MutableMapping
+import numpy as np
+
+RESULTS_VERSION = 1
+
+# the results still reading from an archive, by its path - they are read into memory and the archive closed before it
+# is replaced (see close_archives)
+OPEN_ARCHIVES = {}
+OPEN_ARCHIVES_LOCK = threading.Lock()
+
+
+class LazyResults(MutableMapping):
+    """
+    the results for one slot (normal or inverted ECG) - behaves like the dictionary it replaces, but an array is read
+    from the archive on first access
+    """
+
+    def __init__(self, archive=None, slot=0, lock=None):
+        """
+        :param archive: the NpzFile, or None for results which are not on disk
+        :param slot: 0 or 1
+        :param lock: guards the archive, shared by the slots reading from it
+        """
+        self.archive = archive
+        self.lock = threading.Lock() if lock is None else lock
+        self.prefix = '{}/'.format(slot)
+        self.on_disk = [] if archive is None else [name[len(self.prefix):] for name in archive.files
+                                                     if name.startswith(self.prefix)]
+        self.in_memory = {}
+
+    def __getitem__(self, key):
+        if key not in self.in_memory:
+            if key not in self.on_disk:
+                raise KeyError(key)
+            with self.lock:
+                if key not in self.in_memory:
+                    self.in_memory[key] = self.archive[self.prefix + key]
+        return self.in_memory[key]
+
+    def __setitem__(self, key, value):
+        self.in_memory[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.in_memory.pop(key, None)
+        if key in self.on_disk:
+            self.on_disk.remove(key)
+
+    def __iter__(self):
+        yield from self.on_disk
+        yield from (key for key in self.in_memory if key not in self.on_disk)
+
+    def __len__(self):
+        return len(set(self.on_disk) | set(self.in_memory))
+
+    def __contains__(self, key):
+        return key in self.in_memory or key in self.on_disk
+
+    def read_all(self):
+        """
+        reads the arrays not read yet, after that the archive is not needed
+        """
+        with self.lock:
+            for key in self.on_disk:
+                if key not in self.in_memory:
+                    self.in_memory[key] = self.archive[self.prefix + key]
+
+    def close(self):
+        """
+        closes the archive - the arrays not read by read_all before are lost
+        """
+        with self.lock:
+            if self.archive is not None:
+                self.archive.close()
+            self.archive = None
+            self.on_disk = [key for key in self.on_disk if key in self.in_memory]
+
+
+def load_results(results_file):
+    """
+    opens the archive with the results - nothing but the names of the arrays is read here
+    :param results_file: path to the .npz file
+    :return: [normal, inverted] - the two slots of ECG.full_data
+    """
+    # under the lock, so that the archive is not opened while save_results is replacing it
+    with OPEN_ARCHIVES_LOCK:
+        archive = np.load(results_file)
+        version = int(archive['version']) if 'version' in archive.files else 0
+        if version != RESULTS_VERSION:
+            archive.close()
+            raise ValueError("{} holds results in version {}, expected {}".format(results_file, version,
+                                                                                   RESULTS_VERSION))
+        lock = threading.Lock()
+        full_data = [LazyResults(archive, slot, lock) for slot in (0, 1)]
+        # weak references, results dropped without being saved are not kept alive (their archives are closed when
+        # they are collected) - and those already collected are dropped here
+        readers = [reader for reader in OPEN_ARCHIVES.get(os.path.abspath(results_file), []) if reader() is not None]
+        OPEN_ARCHIVES[os.path.abspath(results_file)] = readers + [weakref.ref(results) for results in full_data]
+    return full_data
+
+
+def close_archives(results_file):
+    """
+    reads into memory all the results still reading from the archive and closes it - an open file cannot be replaced
+    on Windows. Called with OPEN_ARCHIVES_LOCK held
+    :param results_file: path to the .npz file
+    :return: None
+    """
+    readers = [reader() for reader in OPEN_ARCHIVES.pop(os.path.abspath(results_file), [])]
+    readers = [results for results in readers if results is not None]
+    # both slots read from one archive, so all the arrays are read before it is closed
+    for results in readers:
+        results.read_all()
+    for results in readers:
+        results.close()
+
+
+def save_results(results_file, full_data):
+    """
+    writes both slots of ECG.full_data to the archive - empty results (None) are not written
+    :param results_file: path to the .npz file
+    :param full_data: [normal, inverted] - dictionaries (or LazyResults) of arrays
+    :return: None
+    """
+    arrays = {'version': np.array(RESULTS_VERSION)}
+    for slot in (0, 1):
+        for data_key, data_item in full_data[slot].items():
+            if data_item is not None:
+                arrays['{}/{}'.format(slot, data_key)] = np.asarray(data_item)
+    # the archive is written under a temporary name (unique, two copies of a record may be saved at the same time)
+    # and renamed, so it is never left half-written
+    temporary_file = '{}.{}.tmp'.format(results_file, uuid.uuid4().hex)
+    with open(temporary_file, 'wb') as data_file:
+        np.savez(data_file, **arrays)
+        data_file.flush()
+        os.fsync(data_file.fileno())
+    with OPEN_ARCHIVES_LOCK:
+        close_archives(results_file)
+        os.replace(temporary_file, results_file)
+
+
+class DebouncedWriter:
+    """
+    runs the writes in the background, a while after they were asked for - a write asked for again before it has run
+    is postponed, so a burst of changes (clicking through the recording, annotating beat after beat) ends in a single
+    write. The pending writes are run when the interpreter exits
+    """
+
+    def __init__(self, delay=2.0):
+        self.delay = delay
+        self.pending = {}  # key -> (timer, write)
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def schedule(self, key, write):
+        """
+        :param key: what is written (e.g. the record), a newer write replaces the pending one under the same key
+        :param write: function with no arguments doing the write
+        :return: None
+        """
+        timer = threading.Timer(self.delay, self.run, args=(key,))
+        timer.daemon = True
+        with self.lock:
+            if key in self.pending:
+                self.pending[key][0].cancel()
+            self.pending[key] = (timer, write)
+        timer.start()
+
+    def cancel(self, key):
+        with self.lock:
+            timer, _ = self.pending.pop(key, (None, None))
+        if timer is not None:
+            timer.cancel()
+
+    def run(self, key):
+        with self.lock:
+            _, write = self.pending.pop(key, (None, None))
+        if write is not None:
+            write()
+
+    def flush(self):
+        """
+        runs all the pending writes now
+        """
+        with self.lock:
+            pending, self.pending = list(self.pending.values()), {}
+        for timer, write in pending:
+            timer.cancel()
+            write()
+
+
+WRITER = DebouncedWriter()
+
+
+def load_json_results(json_file):
+    """
+    reads the results from the old .json sidecar
+    :param json_file: path to the .json file
+    :return: [normal, inverted] - dictionaries of arrays
+    """
+    with open(json_file, 'r') as data_file:
+        full_data = json.load(data_file)
+    return [{data_key: np.array(data_item) for data_key, data_item in full_data[slot].items()} for slot in (0, 1)]
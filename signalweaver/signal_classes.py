@@ -1,14 +1,128 @@
 import os
+import copy
+import threading
 import numpy as np
 import pandas as pd
-import json
-from datetime import datetime
-from . signal_processing.ecg_processing import detect_r_waves, detect_artifacts, detect_supraventriculars, \
-                                               detect_ventriculars
+from . signal_processing.ecg_processing import detect_r_waves, detect_r_waves_in_blocks, detect_artifacts, \
+                                               detect_supraventriculars, detect_ventriculars, mirrored
+from . signal_processing.parallel_detection import detect_r_waves_parallel, detect_artifacts_parallel
+from . results_store import load_results, save_results, load_json_results
+from . signal_store import store_path, is_fresh, write_store, open_store
+from . beat_store import EditBuffers
 # Now loading the HRA modules
 from . HRAExplorer.signal_properties.RRclasses import RRSignal
 
 
+# the background calculations of the results for the other polarity (see ECG.calculate_other_polarity_later) - one
+# per recording and polarity, however many ECGs of the recording are waiting for it
+OTHER_POLARITY_JOBS = {}
+OTHER_POLARITY_LOCK = threading.Lock()
+
+DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S.%f"
+DATETIME_SEPARATORS = {2: '/', 5: '/', 10: ' ', 13: ':', 16: ':', 19: '.'}  # positions of the separators above
+
+
+def fixed_layout(characters):
+    """
+    checks whether all the dates have the separators of DATETIME_FORMAT at the same positions and digits in between
+    :param characters: the dates as a byte matrix, one date per row
+    :return: True if the dates can be read at fixed positions
+    """
+    if characters.shape[1] < 20:
+        return False
+    separators = np.frombuffer(''.join(DATETIME_SEPARATORS.values()).encode(), dtype=np.uint8)
+    numeric = characters[:, np.delete(np.arange(20), list(DATETIME_SEPARATORS))]
+    return bool((characters[:, list(DATETIME_SEPARATORS)] == separators).all() and
+                ((numeric >= ord('0')) & (numeric <= ord('9'))).all())
+
+
+def parse_datetime_track(time_column):
+    """
+    vectorized version of datetime.strptime(_, DATETIME_FORMAT) over the whole column - the strings are turned into a
+    fixed-width byte matrix and the fields are read column by column (everything up to the dot is at fixed positions,
+    the fraction may have any number of digits). The result is counted from the full date, so a recording which
+    crosses midnight keeps going forward. Columns without the fixed layout (e.g. no leading zeros) are left to pandas
+    :param time_column: the column with the dates
+    :return: the time track in seconds from the first sample
+    """
+    raw = np.asarray(time_column, dtype='S32')
+    characters = raw.view(np.uint8).reshape(len(raw), -1)
+    if not fixed_layout(characters):
+        dates = pd.to_datetime(pd.Series(time_column), format=DATETIME_FORMAT).to_numpy()
+        dates = dates.astype('datetime64[us]').astype(np.int64)
+        return (dates - dates[0]) / 1e6
+
+    def field(first, last):
+        value = np.zeros(len(characters), dtype=np.int64)
+        for position in range(first, last):
+            value = value * 10 + (characters[:, position] - ord('0'))
+        return value
+
+    day, month, year = field(0, 2), field(3, 5), field(6, 10)
+    days = ((year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (month - 1)).astype('datetime64[D]') + \
+        (day - 1)
+    whole_seconds = days.astype(np.int64) * 24 * 60 * 60 + field(11, 13) * 60 * 60 + field(14, 16) * 60 + \
+        field(17, 19)
+    # the fraction is read in whole nanoseconds, so that e.g. 5 ms is exactly 0.005 s
+    nanoseconds = whole_seconds * 10 ** 9
+    for position in range(20, min(characters.shape[1], 29)):
+        digit = characters[:, position].astype(np.int64) - ord('0')
+        # the padding and any trailing characters are not digits
+        nanoseconds += np.where(np.logical_and(digit >= 0, digit <= 9), digit, 0) * 10 ** (28 - position)
+    return (nanoseconds - nanoseconds[0]) / 1e9
+
+
+def rr_annotations_from(annotations):
+    """
+    annotates the RR intervals on the basis of the annotations of the R-waves (see ECG.get_rrs) - the annotation of an
+    interval depends only on the R-waves at its ends and the one before it, which is what ECG.update_after_edit relies
+    on
+    :param annotations: the annotations of the R-waves
+    :return: the annotations of the RR intervals
+    """
+    rr_annotations = np.copy(annotations[1:])
+    for idx in (1, 2):
+        avs_positions = np.where(rr_annotations == idx)[0]  # 1 is ventricular, 2 supra v -need to add ventriculars
+        # and sup AFTER 1 in r-waves now seeing if the last RR is V - should not add anything higher than that
+        avs_positions = avs_positions[avs_positions < len(rr_annotations) - 1]
+        rr_annotations[avs_positions + 1] = idx
+    return rr_annotations
+
+
+class PolarityJob:
+    """
+    the results for one polarity of a recording, calculated in a background thread by a twin of the ECG which asked
+    for them - they go to all the ECGs waiting for them when they are ready, and are dropped if none is waiting
+    """
+
+    def __init__(self, key, twin):
+        self.key = key
+        self.waiting = []  # the ECGs the results are for
+        self.thread = threading.Thread(target=self.run, args=(twin,), daemon=True)
+
+    def run(self, twin):
+        try:
+            ECG.calculate_results(twin)
+        finally:
+            # a job which failed is removed too, so that the results can be asked for again - and nothing is delivered
+            with OTHER_POLARITY_LOCK:
+                del OTHER_POLARITY_JOBS[self.key]
+                waiting, self.waiting = self.waiting, []
+        idx = 1 if twin.inverted else 0
+        for number, ecg in enumerate(waiting):
+            # every ECG gets its own arrays, they are edited in place
+            results = twin.full_data[idx] if number == 0 else {data_key: None if data_item is None else
+                                                                 np.copy(data_item) for data_key, data_item in
+                                                                 twin.full_data[idx].items()}
+            ecg.other_polarity_ready(idx, results)
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def join(self):
+        self.thread.join()
+
+
 class Signal:
 
     def __init__(self, file_path):
@@ -19,33 +133,55 @@ class Signal:
         self.name = self.get_file_name()
 
     def get_data(self):
+        """
+        the recording is opened from its binary store (see signal_store) - if there is none yet, or the CSV is newer,
+        the CSV is read and converted first. A recording which cannot be stored (not uniformly sampled, read-only
+        folder) is kept in memory, as read from the CSV
+        :return: time track and signal values
+        """
+        store_file = store_path(self.file_path)
+        if is_fresh(store_file, self.file_path):
+            try:
+                return open_store(store_file)
+            except ValueError:  # a store in an old version - convert again
+                pass
+        time_track, signal_values = self.read_csv()
+        try:
+            write_store(store_file, time_track, signal_values)
+        except (OSError, ValueError):
+            return time_track, signal_values
+        return open_store(store_file)
+
+    def read_csv(self):
         local_data = pd.read_csv(self.file_path)
         # assume the time is in the second / milisecond format
         time_track = local_data.iloc[:, 0]
         if " " in str(time_track[0]):
-            # this is the OTHER format I got from Jyotpal - a possible bottleneck
-            time_track = [datetime.strptime(_, "%d/%m/%Y %H:%M:%S.%f") for _ in local_data.iloc[:, 0]]
-            time_track = np.array([_.hour*60*60 + _.minute * 60 + _.second + _.microsecond / 1000000 for _ in time_track])
-            time_track = time_track - time_track[0] #TUTU
+            # this is the OTHER format I got from Jyotpal
+            time_track = parse_datetime_track(time_track)
             signal_values = np.array(local_data.iloc[:, 1]) / (2 ** 8) # 8-bit ADAC?
         else:
-            time_track = np.array(time_track)
+            time_track = pd.to_numeric(time_track).to_numpy(dtype=np.float64)
             signal_values = np.array(local_data.iloc[:, 1])
         return time_track, signal_values
 
     def get_sampling_period(self):
-        return np.diff(self.time_track)[0]
+        return self.time_track[1] - self.time_track[0]
 
     def get_file_name(self):
         return os.path.split(self.file_path)[1]
 
 class ECG(Signal):
 
-    def __init__(self, file_path, inverted=False):
+    def __init__(self, file_path, inverted=False, block_length=None, n_jobs=1, template_cost='fast',
+                 both_polarities=False):
         super().__init__(file_path)
         # constructing json filename
         self.loaded = False  # were the results loaded or calculated
         self.inverted = inverted
+        self.block_length = block_length  # in seconds - if set, R-waves are detected block by block (long recordings)
+        self.n_jobs = n_jobs  # if more than 1, the detection is run in a pool of processes (None - all cores)
+        self.template_cost = template_cost  # how much work goes into the QRS template, see TEMPLATE_COSTS
         self.r_waves_all_pos, self.r_waves_all_vals = None, None
         self.annotations = None
         self.ventriculars_pos, self.ventriculars_vals = None, None
@@ -54,16 +190,20 @@ class ECG(Signal):
         self.rr_filter = (0.3, 1.75)
         self.rr_intervals, self.rr_annotations = None, None
         self.RRSignal = None
+        self.edit_buffers = EditBuffers()  # the buffers the derived arrays are edited in, see update_after_edit
         self.full_data = [dict(), dict()]  # this list holds results for normal [0] and inverted [1] ECG
+        self.other_polarity = None  # the job calculating the results for the other polarity, see below
+        self.closed = False  # see close
+        self.signal_mean = None  # the inverted ECG is mirrored around it, see oriented
 
-        json_file = self.jsonify()
         try:
-            data_file = open(json_file, 'r')
-            self.get_preprocessed_data(data_file)
+            self.get_preprocessed_data()
             self.loaded = True
 
         except FileNotFoundError:
             self.calculate_results()
+        if both_polarities:
+            self.calculate_other_polarity_later()
 
     def jsonify(self):
         json_file = self.file_path.split('.')
@@ -71,13 +211,85 @@ class ECG(Signal):
         json_file = ''.join(json_file)
         return(json_file)
 
+    def npzify(self):
+        npz_file = self.file_path.split('.')
+        npz_file[-1] = '.npz'
+        npz_file = ''.join(npz_file)
+        return(npz_file)
+
+    def has_results(self, idx):
+        return bool(self.full_data[idx]) and not any(_ is None for _ in self.full_data[idx].values())
+
+    def oriented(self, values):
+        """
+        the samples as they are seen with the current polarity - the inverted ECG is mirrored around the mean of the
+        recording. The recording itself is never changed, so inverting costs nothing, only what is read (a window, a
+        few samples) is flipped
+        :param values: samples of the recording (e.g. a slice of signal_values)
+        :return: the samples, flipped if the ECG is inverted
+        """
+        return mirrored(values, self.mirror())
+
+    def mirror(self):
+        """
+        :return: the mean of the recording the inverted ECG is mirrored around, None if the ECG is not inverted
+        """
+        if not self.inverted:
+            return None
+        if self.signal_mean is None:
+            self.signal_mean = np.mean(self.signal_values)
+        return self.signal_mean
+
+    def calculate_other_polarity_later(self):
+        """
+        calculates the results for the inverted ECG (or the normal one, if this one is inverted) in a background
+        thread, so that inverting the ECG later is instant. The calculation is done by a shallow copy of this ECG - it
+        shares the recording, the time track and the settings, and gets its own results. If the results for the
+        recording are already being calculated (for the ECG of another session), this ECG waits for the same ones
+        :return: None
+        """
+        idx = 0 if self.inverted else 1
+        if self.has_results(idx) or self.closed:
+            return
+        key = (os.path.abspath(self.file_path), bool(idx))
+        with OTHER_POLARITY_LOCK:
+            job = OTHER_POLARITY_JOBS.get(key)
+            if job is None:
+                twin = copy.copy(self)
+                twin.inverted = bool(idx)
+                twin.full_data = [dict(), dict()]
+                job = OTHER_POLARITY_JOBS[key] = PolarityJob(key, twin)
+                job.thread.start()
+            if self not in job.waiting:
+                job.waiting.append(self)
+        self.other_polarity = job
+
+    def other_polarity_ready(self, idx, results):
+        # called (from the background thread) with the results for the other polarity
+        self.full_data[idx] = results
+        self.other_polarity_calculated()
+
+    def other_polarity_calculated(self):
+        pass
+
+    def close(self):
+        """
+        the ECG is not going to be used any more (e.g. it has been dropped from the cache) - it stops waiting for the
+        results for the other polarity, which are dropped if no other ECG waits for them
+        :return: None
+        """
+        self.closed = True
+        with OTHER_POLARITY_LOCK:
+            if self.other_polarity is not None and self in self.other_polarity.waiting:
+                self.other_polarity.waiting.remove(self)
+
     def invert_ecg(self):
+        if self.other_polarity is not None:
+            self.other_polarity.join()  # the results for the other polarity might be on the way
         self.inverted = np.invert(self.inverted)
-        mean_ecg_value = np.mean(self.signal_values)
-        self.signal_values = -1 * (self.signal_values - mean_ecg_value) + mean_ecg_value
         # and now repeating the constructor with the inverted ECG
         idx = 1 if self.inverted else 0
-        if any(_ is None for _ in self.full_data[idx].values()) or not self.full_data[idx]:
+        if not self.has_results(idx):
             self.calculate_results()
             self.update_results_dict()
         else:
@@ -85,7 +297,7 @@ class ECG(Signal):
 
     def calculate_results(self):
         # unpacking a numpy array below
-        self.r_waves_all_pos, self.r_waves_all_vals = detect_r_waves(self.time_track, self.signal_values).T
+        self.r_waves_all_pos, self.r_waves_all_vals = self.detect_r_waves().T
         self.annotations = self.annotate_r_waves()
         self.ventriculars_pos, self.ventriculars_vals = self.get_ventriculars()
         self.supraventriculars_pos, self.supraventriculars_vals = self.get_supraventriculars()
@@ -94,17 +306,18 @@ class ECG(Signal):
         self.update_poincare()
         self.update_results_dict()
 
-    def get_preprocessed_data(self, data_file):
+    def get_preprocessed_data(self):
         """
-        This function gets data from .json file, loads it to a dictionary and then fills the various results
-        :param data_file: the file opened by the constructor
+        This function gets data from the .npz file and then fills the various results - the arrays are read from the
+        file on first use, so the results for the other polarity are not read until the ECG is inverted. If there is
+        only the old .json file, it is read and converted to .npz
         :return: None
         """
-        self.full_data = json.load(data_file)
-
-        for idx in (0, 1):  # get both, regular and inverted
-            for data_key in self.full_data[idx]:
-                self.full_data[idx][data_key] = np.array(self.full_data[idx].get(data_key))
+        try:
+            self.full_data = load_results(self.npzify())
+        except FileNotFoundError:
+            self.full_data = load_json_results(self.jsonify())
+            save_results(self.npzify(), self.full_data)
         # you need to start with something, so start with the non-inverted ecg - either load the results, or calculate
         # them
         idx = 1 if self.inverted else 0
@@ -139,6 +352,82 @@ class ECG(Signal):
             self.RRSignal = RRSignal([self.rr_intervals, self.rr_annotations], annotation_filter=(1, 2, 3))
             self.RRSignal.set_poincare()
 
+    def update_after_edit(self, start, n_removed, n_inserted):
+        """
+        updates everything derived from the R-waves and their annotations (the ventricular, supraventricular and
+        artifact beats, the RR intervals and the Poincare plot) after a local edit, only around the edited place -
+        R-waves start:start + n_removed were replaced by n_inserted new ones (annotating a beat is 1 for 1, inserting
+        0 for 1, removing 1 for 0). The arrays are edited in gap buffers (see beat_store.EditBuffers), copied to them
+        the first time they are edited, and stay NumPy arrays - views of the buffers - so an edit costs neither a
+        recalculation nor a new array
+        :param start: the index of the first edited R-wave
+        :param n_removed: the number of R-waves removed
+        :param n_inserted: the number of R-waves inserted in their place
+        :return: None
+        """
+        stop = start + n_inserted  # the edited R-waves in the new arrays
+        if self.RRSignal is None or self.RRSignal.poincare is None or len(self.r_waves_all_pos) < 3:
+            # nothing to update - or too little to bother
+            self.ventriculars_pos, self.ventriculars_vals = self.get_ventriculars()
+            self.supraventriculars_pos, self.supraventriculars_vals = self.get_supraventriculars()
+            self.artifacts_pos, self.artifacts_vals = self.get_artifacts()
+            self.rr_intervals, self.rr_annotations = self.get_rrs()
+            self.update_poincare()
+            self.update_results_dict()
+            return
+
+        # the beats of every kind - the edited ones lie between the R-waves just before and just after the edit
+        before = self.r_waves_all_pos[start - 1] if start > 0 else -np.inf
+        after = self.r_waves_all_pos[stop] if stop < len(self.r_waves_all_pos) else np.inf
+        edited_annotations = self.annotations[start:stop]
+        buffers = self.edit_buffers
+        for kind, annotation in (('ventriculars', 1), ('supraventriculars', 2), ('artifacts', 3)):
+            positions, values = buffers.edit(self, kind + '_pos'), buffers.edit(self, kind + '_vals')
+            low, high = positions.searchsorted(before, 'right'), positions.searchsorted(after, 'left')
+            positions.replace(low, high, self.r_waves_all_pos[start:stop][edited_annotations == annotation])
+            values.replace(low, high, self.r_waves_all_vals[start:stop][edited_annotations == annotation])
+            buffers.publish(self, kind + '_pos')
+            buffers.publish(self, kind + '_vals')
+
+        # the RR intervals - the interval i (between R-waves i and i + 1) depends on the R-waves i - 1 to i + 1, so
+        # the intervals from start - 1 to start + n_removed (in the old numbering) have to be calculated again
+        shift = n_inserted - n_removed
+        n_rr = len(self.r_waves_all_pos) - 1
+        rr_start = max(start - 2, 0)
+        rr_tail = max(len(self.rr_intervals) - (start + n_removed + 2), 0)  # the intervals after the edit that stay
+        rr_stop, old_rr_stop = n_rr - rr_tail, len(self.rr_intervals) - rr_tail
+        context = max(rr_start - 2, 0)  # the annotations of the first two intervals need two before them
+        new_rr_intervals = np.diff(self.r_waves_all_pos[rr_start:rr_stop + 1])
+        new_rr_annotations = rr_annotations_from(self.annotations[context:rr_stop + 1])[rr_start - context:]
+        buffers.edit(self, 'rr_intervals').replace(rr_start, old_rr_stop, new_rr_intervals)
+        buffers.edit(self, 'rr_annotations').replace(rr_start, old_rr_stop, new_rr_annotations)
+        buffers.publish(self, 'rr_intervals')
+        buffers.publish(self, 'rr_annotations')
+
+        # the Poincare plot - the pair i is made of the intervals i and i + 1, both of which have to be good
+        rr_signal = self.RRSignal
+        bad = np.isin(new_rr_annotations, rr_signal.annotation_filter) | (new_rr_intervals < rr_signal.square_filter[0]) | \
+            (new_rr_intervals > rr_signal.square_filter[1])
+        buffers.edit(rr_signal, 'signal').replace(rr_start, old_rr_stop, new_rr_intervals)
+        buffers.edit(rr_signal, 'annotation').replace(rr_start, old_rr_stop, np.where(bad, 16, new_rr_annotations))
+        buffers.publish(rr_signal, 'signal')
+        buffers.publish(rr_signal, 'annotation')
+        pair_start = max(rr_start - 1, 0)
+        rr_around = rr_signal.signal[pair_start:min(rr_stop + 1, n_rr)]
+        good = rr_signal.annotation[pair_start:min(rr_stop + 1, n_rr)] != 16
+        pairs = np.where(good[:-1] & good[1:])[0]  # counted from pair_start
+        poincare = rr_signal.poincare
+        # the plot edits the buffers themselves (see Poincare.replace_pairs) and gets their views back
+        for attribute in ('xi', 'xii', 'x_i_indices', 'x_ii_indices'):
+            setattr(poincare, attribute, buffers.edit(poincare, attribute))
+        # the old pairs pair_start:old_rr_stop are replaced
+        poincare.replace_pairs(poincare.x_i_indices.searchsorted(pair_start),
+                               poincare.x_i_indices.searchsorted(old_rr_stop), rr_around[pairs],
+                               rr_around[pairs + 1], pair_start + pairs, index_shift=shift)
+        for attribute in ('xi', 'xii', 'x_i_indices', 'x_ii_indices'):
+            buffers.publish(poincare, attribute)
+        self.update_results_dict()
+
     def update_results_dict(self):
         """
         This method puts the results in memory to results dictionary - it can e.g. update the results which are already
@@ -159,18 +448,18 @@ class ECG(Signal):
             self.full_data[idx][data_key] = data_item
 
     def save_processed_data(self):
-        json_file = self.jsonify()
-
-        results = [dict(), dict()]
-        for idx in (0, 1):
-            for data_key in self.full_data[idx]:
-                results[idx][data_key] = self.full_data[idx][data_key].tolist()
-
-        with open(json_file, 'w') as data_file:
-            json.dump(results, data_file)
+        save_results(self.npzify(), self.full_data)
 
     def detect_r_waves(self):
-        return detect_r_waves(self.time_track, self.signal_values)
+        # the blocks (segments) of the inverted ECG are flipped as they are read, the recording is not copied
+        if self.n_jobs != 1:
+            return detect_r_waves_parallel(self.time_track, self.signal_values, n_jobs=self.n_jobs,
+                                           segment_length=self.block_length or 10 * 60,
+                                           template_cost=self.template_cost, mirror=self.mirror())
+        if self.block_length is None:
+            return detect_r_waves(self.time_track, self.oriented(self.signal_values), template_cost=self.template_cost)
+        return detect_r_waves_in_blocks(self.time_track, self.signal_values, block_length=self.block_length,
+                                        template_cost=self.template_cost, mirror=self.mirror())
 
     def annotate_r_waves(self):
         '''
@@ -190,6 +479,11 @@ class ECG(Signal):
         return annotations
 
     def detect_artifacts(self):
+        # the artifacts are found from the noise (standard deviations) between the R-waves, which is the same for both
+        # polarities, so the recording is used as it is
+        if len(self.r_waves_all_pos) > 0 and self.n_jobs != 1:
+            return detect_artifacts_parallel(self.r_waves_all_pos, self.time_track, self.signal_values,
+                                             n_jobs=self.n_jobs)
         if len(self.r_waves_all_pos) > 0:
             return detect_artifacts(self.r_waves_all_pos, self.time_track, self.signal_values)
         else:
@@ -217,22 +511,26 @@ class ECG(Signal):
         :return: rr values and rr annotations
         """
 
-        rr_intervals = np.diff(self.r_waves_all_pos)
-        rr_annotations = np.copy(self.annotations[1:])
-
-        # annotating artifacts on the basis of filters
-
-        for idx in (1, 2):
-            avs_positions = np.where(rr_annotations == idx)[0]  # 1 is ventricular, 2 supra v -need to add ventriculars
-            # and sup AFTER 1 in r-waves now seeing if the last RR is V - should not add anything higher than that
-            end_of_rr = np.where(avs_positions == len(rr_annotations))[0]
-            avs_positions = np.delete(avs_positions, end_of_rr)
-            rr_annotations[avs_positions + 1] = idx
-        return rr_intervals, rr_annotations
+        return np.diff(self.r_waves_all_pos), rr_annotations_from(self.annotations)
 
     def get_rr_annotations(self):
         pass
 
+    def get_classified_beats(self, kind):
+        """
+        the positions and values of the beats of one kind - they are kept in the attributes (e.g. ventriculars_pos),
+        which are updated after every edit (see update_after_edit), so they are only calculated here if they are
+        missing, e.g. from results saved without them
+        :param kind: 'ventriculars', 'supraventriculars' or 'artifacts'
+        :return: positions, values
+        """
+        positions, values = getattr(self, kind + '_pos'), getattr(self, kind + '_vals')
+        if positions is None or values is None:
+            positions, values = getattr(self, 'get_' + kind)()
+            setattr(self, kind + '_pos', positions)
+            setattr(self, kind + '_vals', values)
+        return positions, values
+
     def get_ventriculars(self):
         return self.r_waves_all_pos[self.annotations == 1], self.r_waves_all_vals[self.annotations == 1]
 
@@ -1,106 +1,147 @@
 # import peakutils- t be reused
 import warnings
 import numpy as np
+from scipy import signal as sc_signal
 from mne.preprocessing import ecg
 
 old_err = np.seterr(divide='raise')
 
 
-def find_max_qrs(qrs_pos, ecg_line, dist = 100):
-    if qrs_pos - dist > 0:
-        return np.argmax(ecg_line[qrs_pos - dist: qrs_pos + dist]) + (qrs_pos - dist)
-    else:
-        return np.argmax(ecg_line[: qrs_pos + dist])
+def find_max_qrs(qrs_pos, ecg_line, dist=100, peaks_per_block=4096):
+    """
+    moves the detected QRS complexes to the maximum of the ECG within dist samples - all at once, the windows are read
+    as rows of a matrix (peaks_per_block of them at a time, to keep the matrix small). The window is
+    [qrs_pos - dist, qrs_pos + dist), or [0, qrs_pos + dist) close to the beginning
+    :param qrs_pos: the positions (sample indices) of the QRS complexes - an array, or a single position
+    :param ecg_line: the ECG
+    :param dist: half the width of the window
+    :param peaks_per_block: how many windows are read at a time
+    :return: the positions of the maxima (an array, or a single position)
+    """
+    positions = np.atleast_1d(np.asarray(qrs_pos, dtype=np.int64))
+    ecg_line = np.asarray(ecg_line)
+    lows = np.where(positions - dist > 0, positions - dist, 0)
+    highs = np.minimum(positions + dist, len(ecg_line))
+    offsets = np.arange(2 * dist)
+    maxima = np.empty(len(positions), dtype=np.int64)
+    for first in range(0, len(positions), peaks_per_block):
+        block_lows, block_highs = lows[first:first + peaks_per_block], highs[first:first + peaks_per_block]
+        indices = block_lows[:, None] + offsets
+        windows = ecg_line[np.minimum(indices, len(ecg_line) - 1)].astype(np.float64)
+        windows[indices >= block_highs[:, None]] = -np.inf  # outside the window
+        maxima[first:first + peaks_per_block] = block_lows + np.argmax(windows, axis=1)
+    return maxima if np.ndim(qrs_pos) else maxima[0]
 
 
 def clean_peaks(qrs_complexes, dist=20):
     # resolving the quirks of the qrs detector used - it tends to put qrs complexes on top of one another, i.e. detect
     # a few complexes at the same place - what I want to do is replace a "run" of similar qrs's by a single, median v.
-    # of them
-    new_peaks = []  # this list will hold the filtered qrs complexes
-    accumulator = []  # this list will hold peaks which are close to one another
-    push = True
-    for idx in range(0, len(qrs_complexes)-1):
-        if qrs_complexes[idx+1] - qrs_complexes[idx] < dist:
-            accumulator.append(qrs_complexes[idx])
-            push = False
-        elif not push:  # this will be the last of close-by qrs complexes
-            accumulator.append(qrs_complexes[idx])
-            new_peaks.append(int(np.median(accumulator)))
-            push = True
-            accumulator = []
-        else:
-            assert (len(accumulator) == 0), "the accumulator length is not 0!"
-            assert push, "pop is not True!"
-            new_peaks.append(qrs_complexes[idx])
-
-    # now for the last qrs
-    if len(accumulator) == 0:
-        new_peaks.append(qrs_complexes[idx+1])
-    else:
-        accumulator.append(qrs_complexes[idx+1])
-        new_peaks.append(int(np.median(accumulator)))
-    return np.array(new_peaks)
-
-
-def get_template(qrs_voltage, qrs_position, template_length=101, n_sample=8, hi_corr=0.8):
+    # of them. A run ends where the next qrs is at least dist further
+    qrs_complexes = np.asarray(qrs_complexes)
+    if len(qrs_complexes) < 2:
+        return qrs_complexes.copy()
+    run_starts = np.concatenate(([0], np.where(np.diff(qrs_complexes) >= dist)[0] + 1))
+    run_lengths = np.diff(np.concatenate((run_starts, [len(qrs_complexes)])))
+    new_peaks = qrs_complexes[run_starts].copy()  # the runs of one qrs stay as they are
+    long_runs = run_lengths > 1
+    if long_runs.any():
+        # the medians of the runs - the qrs's are sorted within every run, and the middle one (or the mean of the two
+        # middle ones, cut to an integer) taken
+        run_ids = np.repeat(np.arange(len(run_starts)), run_lengths)
+        in_order = qrs_complexes[np.lexsort((qrs_complexes, run_ids))]
+        lower_middle = in_order[run_starts + (run_lengths - 1) // 2]
+        upper_middle = in_order[run_starts + run_lengths // 2]
+        medians = ((lower_middle.astype(np.float64) + upper_middle) / 2).astype(np.int64)
+        new_peaks[long_runs] = medians[long_runs]
+    return new_peaks
+
+
+# how much work goes into the QRS template - the number of QRS complexes drawn and how they are averaged. More
+# complexes and the median cost more (the correlation matrix grows with the square of the sample), but give a cleaner
+# template on noisy recordings
+TEMPLATE_COSTS = {'fast': {'n_sample': 8, 'method': 'mean'},
+                  'balanced': {'n_sample': 32, 'method': 'median'},
+                  'robust': {'n_sample': 128, 'method': 'median'}}
+
+
+def get_template(qrs_voltage, qrs_position, template_length=101, n_sample=8, hi_corr=0.8, method='mean'):
     """
     this function calculates the template qrs which later on will be convolved with the voltage to identify outstanding
-    qrs complexes
+    qrs complexes - n_sample qrs's are drawn, the ones which are highly correlated with at least one other are kept and
+    averaged
     :param qrs_voltage: the ECG
     :param qrs_position: found positions of QRSs
     :param template_length: an odd number which indicates the length of the template - odd so that the R is in the middle
-    :param n_sample: how many qrs's will be drawn from all to form a template
+    :param n_sample: how many qrs's will be drawn from all to form a template (None - all of them, this is only
+    reasonable for short recordings)
     :param hi_corr the cut-off for correlation to be considered high
-    :return:
+    :param method: 'mean' or 'median' - how the kept qrs's are averaged, the median is not thrown off by a few bad ones
+    :return: the template, or np.array([-1]) if there is nothing to build it from
     """
+    qrs_voltage = np.asarray(qrs_voltage)
+    half_length = int((template_length - 1) / 2)
+    qrs_position = np.asarray(qrs_position)[2:]
+    # only the qrs's with the whole template window within the ECG
+    qrs_position = qrs_position[np.logical_and(qrs_position >= half_length,
+                                               qrs_position + half_length < len(qrs_voltage))]
     np.random.seed(777)
     try:
-        random_qrs = np.random.choice(qrs_position[2:], n_sample, replace=False)
+        random_qrs = qrs_position if n_sample is None else np.random.choice(qrs_position, n_sample, replace=False)
     except ValueError:
         return np.array([-1])
-    # this dictionary will hold the correlations between the templates
-    correlations = {}
-    for idx in range(n_sample):
-        for idy in range(idx, n_sample):
-            if idx != idy:
-                correlations[(idx, idy)] = np.corrcoef(
-                    qrs_voltage[random_qrs[idx] - int((template_length - 1) / 2):random_qrs[idx] + int((template_length - 1) / 2) + 1],
-                    qrs_voltage[random_qrs[idy] - int((template_length - 1) / 2):random_qrs[idy] + int((template_length - 1) / 2) + 1]
-                )[0, 1]
-
+    if len(random_qrs) < 2:
+        return np.array([-1])
+    # all the drawn qrs's as rows - a view of the ECG, read at the drawn positions
+    windows = np.lib.stride_tricks.sliding_window_view(qrs_voltage, 2 * half_length + 1)[random_qrs - half_length]
+    with np.errstate(divide='ignore', invalid='ignore'):  # a flat qrs does not correlate with anything
+        correlations = np.corrcoef(windows)
     # now selecting the template - dropping the QRSs whose correlation is too small
-    high_correlations = []  # this list holds correlations which are "high"
-    for corre in correlations:
-        if correlations[corre] > hi_corr:
-            high_correlations.extend(corre)
-    high_correlations = list(set(high_correlations))
-
-    # calculating template
-    template = np.zeros(template_length)
-    for idx in random_qrs[high_correlations]:
-        template += qrs_voltage[idx - int((template_length - 1) / 2):idx + int((template_length - 1) / 2) + 1]
-    template = template / n_sample
-
-    # for idx in range(n_sample):
-    #     plt.subplot(3, 3, idx+1)
-    #     plt.plot(qrs_voltage[random_qrs[idx] - int((template_length-1)/2):random_qrs[idx] + int((template_length-1)/2) + 1])
-    # plt.subplot(3, 3, 9)
-    # plt.plot(template, color='red')
-    # plt.show()
-    return template
-
-
-def correlation_machine(vector, template):
-    extended_vector = np.concatenate([vector, template * 0])
-    rolling_correlations = []
-    for idx in range(0, len(vector)):
-        # h..jowo zaimplementowana korelacja w corrcoef
-        try:
-            rolling_correlations.append(np.corrcoef(template, extended_vector[idx:idx+len(template)])[0, 1])
-        except FloatingPointError as e:
-            rolling_correlations.append(0)
-    return np.array(rolling_correlations)
+    np.fill_diagonal(correlations, 0)
+    high_correlations = (correlations > hi_corr).any(axis=1)
+    if not high_correlations.any():
+        return np.array([-1])
+    if method == 'median':
+        return np.median(windows[high_correlations], axis=0)
+    return np.mean(windows[high_correlations], axis=0)
+
+
+def correlation_machine(vector, template, chunk_size=2 ** 16):
+    """
+    rolling Pearson correlation between the template and the vector - the value at idx is the correlation of the
+    template with vector[idx:idx + len(template)], the vector being padded with zeros at the end, so that the result is
+    as long as the vector (this is what calling np.corrcoef at every position used to give). The numerators are
+    calculated as a correlation with the centered template and the window variances from cumulative sums, chunk by
+    chunk, so that the temporaries never grow beyond chunk_size samples
+    :param vector: the ECG
+    :param template: the QRS template
+    :param chunk_size: how many correlations are calculated at a time
+    :return: the vector of correlations, 0 where the segment (or the template) is flat
+    """
+    vector = np.asarray(vector)
+    template_length = len(template)
+    centered_template = np.asarray(template, dtype=np.float64) - np.mean(template)
+    template_norm = np.sqrt(np.sum(centered_template ** 2))
+    rolling_correlations = np.zeros(len(vector))
+    if template_norm == 0:
+        return rolling_correlations
+    for start in range(0, len(vector), chunk_size):
+        stop = min(start + chunk_size, len(vector))
+        segment = np.zeros(stop - start + template_length - 1)
+        available = vector[start:stop + template_length - 1]
+        segment[:len(available)] = available
+        # the correlation does not depend on the offset, and centering keeps the cumulative sums accurate
+        segment -= np.mean(segment)
+        numerators = sc_signal.correlate(segment, centered_template, mode='valid')
+        sums = np.concatenate(([0.0], np.cumsum(segment)))
+        squares = np.concatenate(([0.0], np.cumsum(segment ** 2)))
+        window_sums = sums[template_length:] - sums[:-template_length]
+        window_squares = squares[template_length:] - squares[:-template_length]
+        centered_squares = window_squares - window_sums ** 2 / template_length
+        # flat segments - the cumulative sums leave round-off noise instead of exact zeros
+        not_flat = centered_squares > 8 * np.finfo(np.float64).eps * squares[-1]
+        denominators = template_norm * np.sqrt(np.where(not_flat, centered_squares, 1.0))
+        rolling_correlations[start:stop] = np.clip(np.where(not_flat, numerators / denominators, 0.0), -1.0, 1.0)
+    return rolling_correlations
 
 
 def find_correlated_peaks(correlations_vector, voltage, template, threshold=0.75, search_width=10):
@@ -118,28 +159,42 @@ def find_correlated_peaks(correlations_vector, voltage, template, threshold=0.75
     """
     template_length = len(template)
     template_ptp = np.ptp(template)
-    boo = np.array(correlations_vector >= threshold)  # finding indices which are over the threshold
-    indices = np.nonzero(boo[1:] != boo[:-1])[0] + 1  # finding indices of segments with only True or only False
-    index_vector = np.arange(len(correlations_vector))
-    regions = np.split(index_vector, indices)  # splitting correlations into true/false regions on threshold condition
-    regions_over_thr = np.array(regions[0::2] if boo[0] else regions[1::2])  # selecting only "true" regions
-    regions_over_thr += int(np.floor(template_length/2) + 1)  # moving half a template
-    peaks = []
-    # segment holds actual indices, not values - see above
-    for segment in regions_over_thr:
-        extended_segment = np.concatenate(
-            [np.arange(segment[0] - search_width, segment[0]), segment, np.arange(segment[-1] + 1, segment[-1] + search_width + 1)]
-        )
-        peak_position = np.argmax(voltage[extended_segment]) + segment[0] - search_width
-        # now I check whether the shape is not to low or too large
-        if np.isnan(np.ptp(voltage[extended_segment])):
-            print(voltage[extended_segment], segment)
-        if 1/2*template_ptp < np.ptp(voltage[extended_segment]) < 2 * template_ptp:
-            peaks.append(peak_position)
-    return np.array(peaks)  # + int(np.floor(template_length/2) + 1)
-
-
-def detect_r_waves(time_track, voltage, frequency=200):
+    voltage = np.asarray(voltage)
+    boo = np.asarray(correlations_vector) >= threshold  # finding indices which are over the threshold
+    if len(boo) == 0:
+        return np.array([], dtype=np.int64)
+    # the edges of the segments with only True or only False - the "true" ones are every other segment
+    edges = np.concatenate(([0], np.nonzero(boo[1:] != boo[:-1])[0] + 1, [len(boo)]))
+    first_over = 0 if boo[0] else 1
+    starts, stops = edges[first_over:-1:2], edges[first_over + 1::2]
+    # the regions over the threshold are moved by half a template and widened by search_width on both sides - a QRS at
+    # the very beginning or end of the ECG (or of a block of it) cannot be searched beyond it
+    shift = int(np.floor(template_length/2) + 1)
+    lows = np.maximum(starts + shift - search_width, 0)
+    highs = np.minimum(stops + shift + search_width, len(voltage))
+    not_empty = lows < highs
+    lows, highs = lows[not_empty], highs[not_empty]
+    if len(lows) == 0:
+        return np.array([], dtype=np.int64)
+    # all the widened regions one after another in a flat vector - the maxima and minima of the regions are then
+    # reductions over consecutive slices of it
+    lengths = highs - lows
+    flat_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    n_flat = flat_starts[-1] + lengths[-1]
+    flat_indices = np.repeat(lows - flat_starts, lengths) + np.arange(n_flat)
+    values = voltage[flat_indices].astype(np.float64)
+    maxima = np.maximum.reduceat(values, flat_starts)
+    minima = np.minimum.reduceat(values, flat_starts)
+    # the first maximum in every region (a NaN region has none, but it does not pass the amplitude check below)
+    first_maxima = np.minimum.reduceat(np.where(values == np.repeat(maxima, lengths), np.arange(n_flat), n_flat),
+                                       flat_starts)
+    peak_positions = flat_indices[np.minimum(first_maxima, n_flat - 1)]
+    # now I check whether the shape is not to low or too large
+    amplitudes = maxima - minima
+    return peak_positions[np.logical_and(1/2*template_ptp < amplitudes, amplitudes < 2 * template_ptp)]
+
+
+def detect_r_waves(time_track, voltage, frequency=200, template_cost='fast'):
     # current_position = 0
     # step = 1000
     # global_peaks = []
@@ -162,18 +217,107 @@ def detect_r_waves(time_track, voltage, frequency=200):
     #
     #     current_position = current_position + step
     # adding 'start' here to keep track of the time
+    global_peaks = find_r_waves(voltage, frequency, template_cost)
+    return np.transpose(np.array([time_track[global_peaks], np.asarray(voltage)[global_peaks]]))
+
+
+def find_r_waves(voltage, frequency=200, template_cost='fast'):
+    """
+    the detection proper - the QRS detector, the template and the template correlation are all run on voltage
+    :param voltage: the ECG
+    :param frequency: the sampling frequency
+    :param template_cost: how much work goes into the template, see TEMPLATE_COSTS
+    :return: the indices of the R-waves in voltage
+    """
+    # the stored samples are float32 (and possibly memory-mapped), the filters in the QRS detector want float64
+    voltage = np.asarray(voltage, dtype=np.float64)
     global_peaks = ecg.qrs_detector(frequency, ecg=voltage, thresh_value=0.3,
                                     h_freq=99, l_freq=1, filter_length=200 * 3)
-    global_peaks = np.array([find_max_qrs(_, voltage) for _ in global_peaks])
+    if len(global_peaks) < 2:
+        return np.array([], dtype=int)
+    global_peaks = find_max_qrs(np.asarray(global_peaks), voltage)
     global_peaks = clean_peaks(global_peaks)
-    template = get_template(voltage, global_peaks, template_length=int(frequency / 4 + 1))
+    template = get_template(voltage, global_peaks, template_length=int(frequency / 4 + 1),
+                            **TEMPLATE_COSTS[template_cost])
     if all(template == np.array([-1])):
-        return np.transpose(np.array([np.array([]), np.array([])]))
+        return np.array([], dtype=int)
     correlations = correlation_machine(voltage, template)
-    global_peaks = find_correlated_peaks(correlations, voltage=voltage, template=template)
-    peaks_values = [voltage[i] for i in global_peaks]
-    peaks_positions = [time_track[i] for i in global_peaks]
-    return np.transpose(np.array([np.array(peaks_positions), np.array(peaks_values)]))
+    return find_correlated_peaks(correlations, voltage=voltage, template=template).astype(int)
+
+
+def mirrored(voltage, mean=None):
+    """
+    the ECG mirrored around mean - this is how the inverted ECG is seen (see ECG.oriented)
+    :param voltage: the ECG, or a part of it
+    :param mean: the mean of the whole recording, None - the ECG is not inverted
+    :return: the mirrored ECG, or voltage itself if mean is None
+    """
+    if mean is None:
+        return voltage
+    return -1 * (voltage - mean) + mean
+
+
+def split_into_blocks(n_samples, block_size, margin):
+    """
+    splits a recording into consecutive blocks, each widened by a margin on both sides
+    :param n_samples: the length of the recording
+    :param block_size: the length of a block proper in samples
+    :param margin: the number of samples added on both sides of a block
+    :return: list of (low, start, stop, high) - block proper is [start, stop), the widened block is [low, high)
+    """
+    blocks = []
+    start = 0
+    while start < n_samples:
+        stop = start + block_size
+        if n_samples - stop < margin:  # a tail shorter than the margin is not worth a block of its own
+            stop = n_samples
+        blocks.append((max(start - margin, 0), start, stop, min(stop + margin, n_samples)))
+        start = stop
+    return blocks
+
+
+def stitch_block_peaks(blocks, blocks_peaks, min_distance):
+    """
+    joins the peaks found in the widened blocks - only the peaks falling into the block proper are kept, and a peak
+    closer than min_distance to the last peak of the previous block is the same QRS found twice
+    :param blocks: the blocks, as returned by split_into_blocks
+    :param blocks_peaks: iterable with the peak indices (in the whole recording) for every widened block
+    :param min_distance: the minimal distance between two peaks in samples
+    :return: the indices of the peaks in the whole recording
+    """
+    global_peaks = []
+    last_peak = -min_distance
+    for (low, start, stop, high), block_peaks in zip(blocks, blocks_peaks):
+        block_peaks = block_peaks[np.logical_and(block_peaks >= start, block_peaks < stop)]
+        block_peaks = block_peaks[block_peaks - last_peak >= min_distance]
+        if len(block_peaks) > 0:
+            global_peaks.append(block_peaks)
+            last_peak = block_peaks[-1]
+    return np.concatenate(global_peaks) if global_peaks else np.array([], dtype=int)
+
+
+def detect_r_waves_in_blocks(time_track, voltage, frequency=200, block_length=30 * 60, overlap=10,
+                             template_cost='fast', mirror=None):
+    """
+    streaming version of detect_r_waves for multi-hour recordings - the ECG is processed in blocks of block_length
+    seconds, each one widened by overlap seconds on both sides, so that the filters and the correlation do not see
+    the cut, and the blocks are stitched with stitch_block_peaks. The blocks are processed one at a time, so all
+    temporaries are proportional to the block, not the recording
+    :param time_track: the time track
+    :param voltage: the ECG
+    :param frequency: the sampling frequency
+    :param block_length: the length of a block in seconds
+    :param overlap: the margin added on both sides of a block in seconds
+    :param template_cost: see find_r_waves
+    :param mirror: the mean to mirror the ECG around (see mirrored) - the inverted ECG is flipped block by block, as the
+    blocks are read
+    :return: the same as detect_r_waves - an array of R-wave positions and values
+    """
+    blocks = split_into_blocks(len(voltage), int(block_length * frequency), int(overlap * frequency))
+    blocks_peaks = (find_r_waves(mirrored(voltage[low:high], mirror), frequency, template_cost) + low
+                    for low, _, _, high in blocks)
+    global_peaks = stitch_block_peaks(blocks, blocks_peaks, min_distance=int(0.1 * frequency))
+    return np.transpose(np.array([time_track[global_peaks], mirrored(np.asarray(voltage)[global_peaks], mirror)]))
 
 
 def detect_ventriculars(r_waves_positions, r_waves_values):
@@ -219,22 +363,56 @@ def noise_profile(r_waves, time, signal, reasonable_rr, n_sample=100, half_templ
     random_rr = r_waves[random_r_pos] - r_waves[random_r_pos - 1]
 
     reasonable_r_pos_log = np.logical_and(random_rr > reasonable_rr[0], random_rr < reasonable_rr[1])
-    reasonable_r_pos = random_r_pos[reasonable_r_pos_log]
+    reasonable_r_pos = np.sort(random_r_pos[reasonable_r_pos_log])  # in order, so that the blocks are compact
 
-    noise_between_rr = []
-    for r in reasonable_r_pos:
-        peak_position = np.where(time >= r_waves[r])[0][0]
-        prev_peak_position = np.where(time >= r_waves[r-1])[0][0]
-        # get segment and reject the beginning and end of the segment (it will comprise the QRS, P and Q
-        sig_segment = signal[prev_peak_position + half_template_length:peak_position - half_template_length]
-        noise_level = np.std(sig_segment)
-        noise_between_rr.append(noise_level)
+    noise_between_rr = between_beats_std(r_waves[reasonable_r_pos - 1], r_waves[reasonable_r_pos], time, signal,
+                                         half_template_length)
 
     # reject the extreme values of the noise using iqr and also widening it by 30%
     noise_range = np.percentile(noise_between_rr, [25, 75]) * np.array((0.7, 1.3))
     return noise_range[1]
 
 
+def between_beats_std(previous_r_waves, r_waves, time_track, signal, half_template_length=50,
+                      beats_per_block=4096):
+    """
+    the standard deviation of the signal between pairs of R-waves, leaving out half_template_length samples after the
+    first and before the second R-wave (the QRS, P and T) - the R-waves are turned into sample indices by binary
+    search and the standard deviations are calculated from running sums of the signal and its squares. The running
+    sums are made for beats_per_block pairs at a time, over the part of the signal they span (less memory than the
+    whole recording, and the sums stay small, so they are precise)
+    :param previous_r_waves: the positions (times) of the first R-waves of the pairs
+    :param r_waves: the positions of the second R-waves
+    :param time_track: the time track
+    :param signal: the ECG
+    :param half_template_length: the number of samples left out at both ends
+    :param beats_per_block: the number of pairs the running sums are made for at a time
+    :return: array of the standard deviations, nan where nothing is left between the R-waves
+    """
+    n_samples = len(signal)
+    # the track's own searchsorted - a UniformTimeTrack calculates the indices instead of making the whole track
+    starts = np.minimum(time_track.searchsorted(previous_r_waves) + half_template_length, n_samples)
+    stops = np.clip(time_track.searchsorted(r_waves) - half_template_length, 0, n_samples)
+    result = np.full(len(starts), np.nan)
+    for first in range(0, len(starts), beats_per_block):
+        block_starts, block_stops = starts[first:first + beats_per_block], stops[first:first + beats_per_block]
+        lengths = block_stops - block_starts
+        not_empty = np.where(lengths > 0)[0]
+        if not_empty.size == 0:
+            continue
+        low, high = block_starts[not_empty].min(), block_stops[not_empty].max()
+        segment = np.asarray(signal[low:high], dtype=np.float64)
+        segment = segment - segment.mean()
+        sums = np.concatenate(([0.0], np.cumsum(segment)))
+        squares = np.concatenate(([0.0], np.cumsum(segment ** 2)))
+        block_starts, block_stops, lengths = block_starts[not_empty] - low, block_stops[not_empty] - low, \
+            lengths[not_empty]
+        means = (sums[block_stops] - sums[block_starts]) / lengths
+        variances = (squares[block_stops] - squares[block_starts]) / lengths - means ** 2
+        result[first + not_empty] = np.sqrt(np.maximum(variances, 0))
+    return result
+
+
 def noise(r_waves, time_track, signal, half_template_length=50):
     """
     function for calculating noise between r-peaks
@@ -242,36 +420,67 @@ def noise(r_waves, time_track, signal, half_template_length=50):
     :param time_track:
     :param signal:
     :param half_template_length:
-    :return:
+    :return: the noise between every two consecutive R-waves (see between_beats_std)
+    """
+    r_waves = np.asarray(r_waves)
+    return between_beats_std(r_waves[:-1], r_waves[1:], time_track, signal, half_template_length)
+
+
+def classify_artifacts(rr_intervals, noise_for_all, current_noise_profile, rr_filter=(0.3, 1.75)):
     """
-    rr_noise = [] # this list holds the resulting noise
-    for idx in range(1, len(r_waves)):
-        peak_position = np.where(time_track >= r_waves[idx])[0][0]
-        prev_peak_position = np.where(time_track >= r_waves[idx - 1])[0][0]
-        sig_segment = signal[prev_peak_position + half_template_length:peak_position - half_template_length]
-        noise_level = np.std(sig_segment)
-        rr_noise.append(noise_level)
-    return rr_noise
+    the classification rule of detect_artifacts, on whole arrays - an RR interval is an artifact if it is outside the
+    RR filter, if it is a bit too short or too long and the noise is above twice the noise profile, or if the noise
+    is above four times the noise profile
+    :param rr_intervals: the RR intervals
+    :param noise_for_all: the noise within every interval (see noise)
+    :param current_noise_profile: the noise profile (see noise_profile) - a number, or an array with one per interval
+    :param rr_filter: the shortest and the longest acceptable RR interval
+    :return: boolean array, True for the artifacts
+    """
+    rr_intervals, noise_for_all = np.asarray(rr_intervals), np.asarray(noise_for_all)
+    reasonable_rr = np.array(rr_filter) * np.array((2, 0.75))
+    outside_filter = np.logical_or(rr_intervals < rr_filter[0], rr_intervals > rr_filter[1])
+    unreasonable = np.logical_or(rr_intervals < reasonable_rr[0], rr_intervals > reasonable_rr[1])
+    return outside_filter | (unreasonable & (noise_for_all > current_noise_profile * 2)) | \
+        (noise_for_all > 4 * current_noise_profile)
 
 
-def detect_artifacts(r_waves_positions, time_track, signal, rr_filter=(0.3, 1.75)):
+def detect_artifacts(r_waves_positions, time_track, signal, rr_filter=(0.3, 1.75), noise_for_all=None):
     '''
     this function takes the detected R waves: this is based on the length of the interval and, if the length is a bit
-    too big, the noise profile between the R-waves is checked
+    too big, the noise profile between the R-waves is checked. The noise between the R-waves (see noise) can be passed
+    if it has already been calculated, e.g. in parallel
     '''
+    return detect_artifacts_in_batch([(r_waves_positions, time_track, signal, noise_for_all)], rr_filter)[0]
+
 
+def detect_artifacts_in_batch(records, rr_filter=(0.3, 1.75)):
+    """
+    detect_artifacts for many records at once, e.g. to annotate a whole project again with another RR filter, without
+    detecting the R-waves again - the noise profile is calculated for every record, and then all the intervals of all
+    the records are classified together
+    :param records: (r_waves_positions, time_track, signal) or (r_waves_positions, time_track, signal, noise_for_all)
+    for every record - the noise between the R-waves does not depend on the RR filter, so it can be kept and passed
+    again (None - calculate it)
+    :param rr_filter: see classify_artifacts
+    :return: list with the positions of the artifacts (the same as detect_artifacts) for every record
+    """
     reasonable_rr = np.array(rr_filter) * np.array((2, 0.75))
-    current_noise_profile = noise_profile(r_waves_positions, time_track, signal, reasonable_rr)
-    noise_for_all = noise(r_waves_positions, time_track, signal)
-    artifact_positions = []
-
-    for idx in range(1, len(r_waves_positions)):
-        current_rr = r_waves_positions[idx] - r_waves_positions[idx - 1]
-        if np.logical_or(current_rr < rr_filter[0], current_rr > rr_filter[1]):
-            artifact_positions.append(idx)
-        elif np.logical_or(current_rr < reasonable_rr[0], current_rr > reasonable_rr[1]) and noise_for_all[
-            idx - 1] > current_noise_profile * 2:
-            artifact_positions.append(idx)
-        elif noise_for_all[idx - 1] > 4 * current_noise_profile:
-            artifact_positions.append(idx)
-    return artifact_positions
\ No newline at end of file
+    rr_intervals, noises, profiles = [], [], []
+    for record in records:
+        r_waves_positions, time_track, signal = record[:3]
+        noise_for_all = record[3] if len(record) > 3 else None
+        r_waves_positions = np.asarray(r_waves_positions)
+        if noise_for_all is None:
+            noise_for_all = noise(r_waves_positions, time_track, signal)
+        rr_intervals.append(np.diff(r_waves_positions))
+        noises.append(np.asarray(noise_for_all, dtype=np.float64))
+        profiles.append(noise_profile(r_waves_positions, time_track, signal, reasonable_rr))
+    if not rr_intervals:
+        return []
+    lengths = [len(record_rr) for record_rr in rr_intervals]
+    artifacts = classify_artifacts(np.concatenate(rr_intervals), np.concatenate(noises), np.repeat(profiles, lengths),
+                                   rr_filter)
+    # the artifact is the R-wave ending the interval
+    return [(np.where(record_artifacts)[0] + 1).tolist() for record_artifacts in
+            np.split(artifacts, np.cumsum(lengths)[:-1])]
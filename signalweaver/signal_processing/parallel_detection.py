@@ -0,0 +1,102 @@
+"""
+process-pool versions of the detection steps - the recording is put in shared memory once, and the workers only
+receive its name and the boundaries of their segment, so nothing long is pickled
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+from .ecg_processing import find_r_waves, noise, detect_artifacts, split_into_blocks, stitch_block_peaks, mirrored
+
+
+@contextmanager
+def shared_copy(vector):
+    """
+    copies vector to a new shared memory block, which is removed on exit
+    :param vector: the array to share
+    :return: (name, shape, dtype) - what a worker needs to attach to the copy
+    """
+    vector = np.asarray(vector)
+    memory = shared_memory.SharedMemory(create=True, size=max(vector.nbytes, 1))
+    try:
+        np.ndarray(vector.shape, dtype=vector.dtype, buffer=memory.buf)[:] = vector
+        yield memory.name, vector.shape, vector.dtype.str
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+@contextmanager
+def attached(shared):
+    """
+    the worker side of shared_copy
+    :param shared: (name, shape, dtype) as yielded by shared_copy
+    :return: the array living in the shared memory block
+    """
+    name, shape, dtype = shared
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        yield np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+    finally:
+        memory.close()
+
+
+def _find_r_waves_in_segment(shared_voltage, low, high, frequency, template_cost, mirror):
+    with attached(shared_voltage) as voltage:
+        return find_r_waves(mirrored(voltage[low:high], mirror), frequency, template_cost) + low
+
+
+def _noise_in_segment(shared_time_track, shared_signal, r_waves):
+    with attached(shared_time_track) as time_track, attached(shared_signal) as signal:
+        return noise(r_waves, time_track, signal)
+
+
+def detect_r_waves_parallel(time_track, voltage, frequency=200, n_jobs=None, segment_length=10 * 60, overlap=10,
+                            template_cost='fast', mirror=None):
+    """
+    parallel version of detect_r_waves - the ECG is cut into overlapping segments (like in detect_r_waves_in_blocks),
+    the segments are processed by a pool of n_jobs processes and stitched together
+    :param time_track: the time track
+    :param voltage: the ECG
+    :param frequency: the sampling frequency
+    :param n_jobs: the number of processes, all cores if None
+    :param segment_length: the length of a segment in seconds - there should be a few segments per process
+    :param overlap: the margin added on both sides of a segment in seconds
+    :param template_cost: see find_r_waves
+    :param mirror: see detect_r_waves_in_blocks - the workers flip their segments of the inverted ECG
+    :return: the same as detect_r_waves - an array of R-wave positions and values
+    """
+    blocks = split_into_blocks(len(voltage), int(segment_length * frequency), int(overlap * frequency))
+    with shared_copy(voltage) as shared_voltage, ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        blocks_peaks = list(pool.map(_find_r_waves_in_segment, [shared_voltage] * len(blocks),
+                                     [low for low, _, _, _ in blocks], [high for _, _, _, high in blocks],
+                                     [frequency] * len(blocks), [template_cost] * len(blocks),
+                                     [mirror] * len(blocks)))
+    global_peaks = stitch_block_peaks(blocks, blocks_peaks, min_distance=int(0.1 * frequency))
+    return np.transpose(np.array([time_track[global_peaks], mirrored(np.asarray(voltage)[global_peaks], mirror)]))
+
+
+def detect_artifacts_parallel(r_waves_positions, time_track, signal, rr_filter=(0.3, 1.75), n_jobs=None,
+                              beats_per_job=5000):
+    """
+    parallel version of detect_artifacts - the noise between the R-waves, which is the costly part, is calculated by
+    a pool of n_jobs processes, beats_per_job consecutive beats at a time (every chunk repeats the last beat of the
+    previous one, so no interval is lost at the edges). The noise profile is a small random sample and the
+    classification is cheap, so these stay in this process
+    :param r_waves_positions: the positions of the R-waves
+    :param time_track: the time track
+    :param signal: the ECG
+    :param rr_filter: see detect_artifacts
+    :param n_jobs: the number of processes, all cores if None
+    :param beats_per_job: how many beats a worker gets at a time
+    :return: the same as detect_artifacts
+    """
+    chunks = [r_waves_positions[start - 1:start + beats_per_job] for start in
+              range(1, len(r_waves_positions), beats_per_job)]
+    with shared_copy(time_track) as shared_time_track, shared_copy(signal) as shared_signal, \
+            ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        noise_for_all = list(pool.map(_noise_in_segment, [shared_time_track] * len(chunks),
+                                      [shared_signal] * len(chunks), chunks))
+    noise_for_all = np.concatenate(noise_for_all) if noise_for_all else np.array([])
+    return detect_artifacts(r_waves_positions, time_track, signal, rr_filter=rr_filter, noise_for_all=noise_for_all)
@@ -0,0 +1,123 @@
+"""
+the binary store of the raw recording - the CSV is converted once into a single file holding a small JSON header
+(start time, sampling period, number of samples) followed by the samples as float32. Opening the store only reads the
+header; the samples are memory-mapped and paged in by the OS as the windows are viewed, and the time track, which is
+uniformly sampled, is calculated on demand instead of being kept in memory
+"""
+import os
+import json
+import numpy as np
+
+STORE_VERSION = 1
+HEADER_SIZE = 256
+SAMPLE_DTYPE = np.float32
+
+
+class UniformTimeTrack:
+    """
+    stands in for the time track array of a uniformly sampled recording - the values are calculated from the start
+    time and the sampling period only where they are asked for
+    """
+
+    def __init__(self, start, sampling_period, n_samples):
+        self.start = start
+        self.sampling_period = sampling_period
+        self.n_samples = n_samples
+
+    def __len__(self):
+        return self.n_samples
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.start + np.arange(*item.indices(self.n_samples)) * self.sampling_period
+        if np.ndim(item) == 0:
+            index = int(item)
+            if not -self.n_samples <= index < self.n_samples:
+                raise IndexError("index {} is out of bounds for the time track of {}".format(index, self.n_samples))
+            return self.start + (index % self.n_samples) * self.sampling_period
+        item = np.asarray(item)
+        if item.dtype.kind in 'iu':
+            if item.size and not (-self.n_samples <= item.min() and item.max() < self.n_samples):
+                raise IndexError("index out of bounds for the time track of {}".format(self.n_samples))
+            return self.start + (item % self.n_samples) * self.sampling_period
+        return self.start + np.arange(self.n_samples)[item] * self.sampling_period
+
+    def __array__(self, dtype=None, copy=None):
+        # the whole time track - only for code which really needs the array
+        return self[:].astype(dtype) if dtype is not None else self[:]
+
+    def __ge__(self, other):
+        return self[:] >= other
+
+    def __gt__(self, other):
+        return self[:] > other
+
+    def __le__(self, other):
+        return self[:] <= other
+
+    def __lt__(self, other):
+        return self[:] < other
+
+    def searchsorted(self, value, side='left', sorter=None):
+        """
+        the same as np.searchsorted on the time track, by arithmetic
+        :param value: time (or array of times)
+        :param side: see np.searchsorted
+        :param sorter: np.searchsorted always passes it - the track is increasing, so the only sorter it can have is
+        the identity, and it is not needed
+        :return: the index (or indices)
+        """
+        position = (np.asarray(value, dtype=np.float64) - self.start) / self.sampling_period
+        # the rounding keeps times calculated from the track itself at their own index
+        position = np.round(position, 6)
+        index = np.ceil(position) if side == 'left' else np.floor(position) + 1
+        return np.clip(index, 0, self.n_samples).astype(np.int64)
+
+
+def store_path(file_path):
+    return os.path.splitext(file_path)[0] + '.raw'
+
+
+def is_fresh(store_file, file_path):
+    """
+    checks whether the store exists and is newer than the CSV it was made from
+    """
+    return os.path.exists(store_file) and os.path.getmtime(store_file) >= os.path.getmtime(file_path)
+
+
+def write_store(store_file, time_track, signal_values):
+    """
+    writes the recording to the store - the file is written under a temporary name and then renamed, so a store is
+    either complete or absent
+    :param store_file: path to the store
+    :param time_track: the time track read from the CSV
+    :param signal_values: the samples read from the CSV
+    :return: None, raises ValueError if the recording is not uniformly sampled
+    """
+    time_track = np.asarray(time_track, dtype=np.float64)
+    start, sampling_period = time_track[0], time_track[1] - time_track[0]
+    if np.max(np.abs(time_track - (start + np.arange(len(time_track)) * sampling_period))) > sampling_period / 2:
+        raise ValueError("the recording is not uniformly sampled, the time track cannot be calculated")
+    header = json.dumps({'version': STORE_VERSION, 'start': float(start), 'sampling_period': float(sampling_period),
+                         'n_samples': len(time_track), 'dtype': np.dtype(SAMPLE_DTYPE).str}).encode()
+    temporary_file = store_file + '.tmp'
+    with open(temporary_file, 'wb') as data_file:
+        data_file.write(header.ljust(HEADER_SIZE - 1) + b'\n')
+        np.asarray(signal_values, dtype=SAMPLE_DTYPE).tofile(data_file)
+    os.replace(temporary_file, store_file)
+
+
+def open_store(store_file):
+    """
+    opens the store - only the header is read
+    :param store_file: path to the store
+    :return: the time track (UniformTimeTrack) and the memory-mapped samples (read-only)
+    """
+    with open(store_file, 'rb') as data_file:
+        header = json.loads(data_file.read(HEADER_SIZE))
+    if header.get('version') != STORE_VERSION:
+        raise ValueError("{} is a store in version {}, expected {}".format(store_file, header.get('version'),
+                                                                          STORE_VERSION))
+    signal_values = np.memmap(store_file, dtype=np.dtype(header['dtype']), mode='r', offset=HEADER_SIZE,
+                              shape=(header['n_samples'],))
+    return UniformTimeTrack(header['start'], header['sampling_period'], header['n_samples']), signal_values
@@ -0,0 +1,162 @@
+import unittest
+import os
+import json
+import shutil
+import struct
+import subprocess
+import tempfile
+import numpy as np
+from flask import Flask
+from backend.api.utils import pack_arrays, array_response, BINARY_MIMETYPE
+
+ARRAYS_JS = os.path.join(os.path.dirname(__file__), '..', '..', 'frontend', 'src', 'services', 'arrays.js')
+
+
+def example_data():
+    # the kinds of arrays the trace and the Poincare plot send, in nested dicts and lists, with scalars around them
+    return {'ecg': {'time': np.linspace(0, 15, 3001), 'voltage': np.sin(np.arange(3001) / 7).astype(np.float32)},
+            'peaks': [{'time': np.arange(5) * 0.8, 'indices': np.arange(5), 'kind': 'normal'},
+                      {'time': np.zeros(0), 'indices': np.zeros(0, dtype=int), 'kind': 'artifact'}],
+            'bad': np.array([True, False, True]),
+            'grid': np.arange(6, dtype=np.int16).reshape(2, 3),
+            'first_peak': np.int64(3), 'position': np.float64(0.5), 'inverted': False}
+
+
+def unpack(packed):
+    # what decodeArrays does (frontend/src/services/arrays.js), with the checks of the layout
+    header_length = struct.unpack('<I', packed[:4])[0]
+    header = json.loads(packed[4:4 + header_length].decode('utf-8'))
+    arrays = []
+    for description in header['arrays']:
+        assert description['offset'] % 8 == 0 and description['offset'] >= 4 + header_length
+        dtype = np.dtype('<' + description['dtype'])
+        arrays.append(np.frombuffer(packed, dtype=dtype, count=description['length'], offset=description['offset']))
+
+    def restore(obj):
+        if isinstance(obj, list):
+            return [restore(item) for item in obj]
+        if isinstance(obj, dict):
+            return arrays[obj['$array']] if '$array' in obj else {key: restore(value) for key, value in obj.items()}
+        return obj
+
+    return restore(header['data']), header['arrays']
+
+
+class TestPackArrays(unittest.TestCase):
+
+    def assertSameData(self, decoded, data):
+        if isinstance(data, np.ndarray):
+            self.assertEqual(len(decoded), data.size)
+            self.assertTrue(np.array_equal(np.asarray(decoded), data.ravel()))
+        elif isinstance(data, dict):
+            self.assertEqual(sorted(decoded), sorted(data))
+            for key in data:
+                self.assertSameData(decoded[key], data[key])
+        elif isinstance(data, list):
+            self.assertEqual(len(decoded), len(data))
+            for decoded_item, item in zip(decoded, data):
+                self.assertSameData(decoded_item, item)
+        else:
+            self.assertEqual(decoded, data)
+
+    def test_round_trip(self):
+        data = example_data()
+        packed = pack_arrays(data)
+        self.assertEqual(len(packed) % 8, 0)
+        decoded, descriptions = unpack(packed)
+        self.assertSameData(decoded, data)
+        # floats keep their precision, integers become int32 and booleans uint8
+        self.assertEqual(decoded['ecg']['time'].dtype, np.float64)
+        self.assertEqual(decoded['ecg']['voltage'].dtype, np.float32)
+        self.assertEqual(decoded['peaks'][0]['indices'].dtype, np.int32)
+        self.assertEqual(decoded['bad'].dtype, np.uint8)
+        self.assertEqual(decoded['grid'].dtype, np.int32)
+        # the arrays are flat, with their shapes in the header
+        self.assertEqual([description['shape'] for description in descriptions],
+                         [[3001], [3001], [5], [5], [0], [0], [3], [2, 3]])
+        # the buffers follow each other, each padded to 8 bytes
+        for description, following in zip(descriptions, descriptions[1:]):
+            size = description['length'] * np.dtype(description['dtype']).itemsize
+            self.assertEqual(following['offset'], description['offset'] + size + (-size % 8))
+
+    def test_integers_out_of_int32(self):
+        # integers which do not fit in int32 are sent as float64 instead of wrapping around
+        data = {'large': np.array([2 ** 33 + 5, -3]), 'unsigned': np.array([4000000000, 1], dtype=np.uint32),
+                'negative': np.array([-2 ** 40]), 'fitting': np.array([2 ** 31 - 1, -2 ** 31])}
+        decoded, _ = unpack(pack_arrays(data))
+        self.assertSameData(decoded, data)
+        self.assertEqual(decoded['large'].dtype, np.float64)
+        self.assertEqual(decoded['unsigned'].dtype, np.float64)
+        self.assertEqual(decoded['negative'].dtype, np.float64)
+        self.assertEqual(decoded['fitting'].dtype, np.int32)
+
+    def test_long_header(self):
+        # more arrays than fit in the header reserved at first
+        data = {'array{}'.format(index): np.arange(index, dtype=np.float32) for index in range(40)}
+        decoded, descriptions = unpack(pack_arrays(data))
+        self.assertSameData(decoded, data)
+        self.assertEqual(len(descriptions), 40)
+
+    @unittest.skipIf(shutil.which('node') is None, "node is not installed")
+    def test_decode_arrays(self):
+        # the frontend decoder reads what pack_arrays writes
+        data = example_data()
+        with tempfile.TemporaryDirectory() as directory:
+            packed_file = os.path.join(directory, 'packed')
+            with open(packed_file, 'wb') as packed:
+                packed.write(pack_arrays(data))
+            script = ("import {{ readFileSync }} from 'fs'\n"
+                      "import {{ decodeArrays }} from {}\n"
+                      "const packed = readFileSync({})\n"
+                      "const buffer = packed.buffer.slice(packed.byteOffset, packed.byteOffset + packed.length)\n"
+                      "const plain = (key, value) => ArrayBuffer.isView(value) ? "
+                      "{{ type: value.constructor.name, values: Array.from(value) }} : value\n"
+                      "console.log(JSON.stringify(decodeArrays(buffer), plain))\n"
+                      ).format(json.dumps('file://' + os.path.abspath(ARRAYS_JS)), json.dumps(packed_file))
+            output = subprocess.run(['node', '--input-type=module', '-e', script], capture_output=True, text=True,
+                                    check=True).stdout
+        decoded = json.loads(output)
+        self.assertTrue(decoded['success'])
+        decoded = decoded['data']
+        self.assertEqual(decoded['ecg']['voltage']['type'], 'Float32Array')
+        self.assertTrue(np.array_equal(np.float32(decoded['ecg']['voltage']['values']), data['ecg']['voltage']))
+        self.assertEqual(decoded['ecg']['time']['type'], 'Float64Array')
+        self.assertTrue(np.array_equal(decoded['ecg']['time']['values'], data['ecg']['time']))
+        self.assertEqual(decoded['peaks'][0]['indices'], {'type': 'Int32Array', 'values': [0, 1, 2, 3, 4]})
+        self.assertEqual(decoded['peaks'][1]['time'], {'type': 'Float64Array', 'values': []})
+        self.assertEqual(decoded['bad'], {'type': 'Uint8Array', 'values': [1, 0, 1]})
+        self.assertEqual(decoded['grid']['values'], list(range(6)))
+        self.assertEqual((decoded['first_peak'], decoded['position'], decoded['inverted']), (3, 0.5, False))
+
+
+class TestArrayResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def respond(self, path='/', **headers):
+        with self.app.test_request_context(path, headers=headers):
+            return array_response(example_data())
+
+    def test_json_fallback(self):
+        for headers in ({}, {'Accept': 'application/json'},
+                        {'Accept': 'application/json, {};q=0.5'.format(BINARY_MIMETYPE)}):
+            response = self.respond(**headers)
+            self.assertEqual(response.mimetype, 'application/json', headers)
+            body = response.get_json()
+            self.assertTrue(body['success'])
+            self.assertEqual(body['data']['peaks'][0]['indices'], [0, 1, 2, 3, 4])
+            self.assertEqual(body['data']['grid'], [[0, 1, 2], [3, 4, 5]])
+            self.assertEqual(body['data']['first_peak'], 3)
+
+    def test_binary(self):
+        for path, headers in (('/?format=binary', {}),
+                              ('/', {'Accept': '{}, application/json;q=0.9'.format(BINARY_MIMETYPE)})):
+            response = self.respond(path, **headers)
+            self.assertEqual(response.mimetype, BINARY_MIMETYPE)
+            decoded, _ = unpack(response.get_data())
+            self.assertTrue(np.array_equal(decoded['ecg']['time'], example_data()['ecg']['time']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+from unittest import mock
+import numpy as np
+from signalweaver.beat_store import BeatStore, GapArray, EditBuffers, in_gap_buffer
+
+
+def random_beats(n_beats=500, seed=3):
+    rng = np.random.default_rng(seed)
+    positions = np.cumsum(0.5 + rng.random(n_beats))
+    return positions, rng.random(n_beats), rng.integers(0, 4, n_beats).astype(float)
+
+
+class TestBeatStore(unittest.TestCase):
+
+    def test_same_as_insert_and_delete(self):
+        positions, values, annotations = random_beats()
+        beats = BeatStore(positions, values, annotations, slack=4)  # small, so that the arrays have to grow
+        rng = np.random.default_rng(0)
+        for _ in range(300):
+            if rng.random() < 0.5:
+                index = rng.integers(0, len(positions))
+                positions, values, annotations = [np.delete(column, index)
+                                                  for column in (positions, values, annotations)]
+                beats.delete(index)
+            else:
+                time = rng.random() * positions[-1]
+                index = np.searchsorted(positions, time, side='right')
+                positions, values, annotations = [np.insert(column, index, item) for column, item in
+                                                  zip((positions, values, annotations), (time, 0.5, 1))]
+                self.assertEqual(beats.find(time, side='right'), index)
+                beats.insert(index, time, 0.5, 1)
+        self.assertEqual(len(beats), len(positions))
+        for expected, column in zip((positions, values, annotations), (beats.positions, beats.values,
+                                                                        beats.annotations)):
+            self.assertTrue(np.array_equal(expected, column))
+
+    def test_arrays(self):
+        expected = random_beats()
+        beats = BeatStore(*expected)
+        self.assertFalse(beats.backs(*expected))
+        arrays = beats.arrays()
+        self.assertTrue(beats.backs(*arrays))
+        # plain arrays, views of the columns
+        for array, column, items in zip(arrays, beats.columns, expected):
+            self.assertIs(type(array), np.ndarray)
+            self.assertIs(array.base, column.buffer)
+            self.assertTrue(in_gap_buffer(array))
+            self.assertTrue(np.array_equal(array, items))
+        self.assertFalse(in_gap_buffer(expected[0]))
+        beats.delete(0)
+        arrays = beats.arrays()
+        self.assertTrue(np.array_equal(arrays[0], expected[0][1:]))
+        self.assertFalse(beats.backs(arrays[0].copy(), *arrays[1:]))
+
+    def test_find(self):
+        beats = BeatStore(np.array([1.0, 2.0, 3.0]), np.zeros(3), np.zeros(3))
+        self.assertEqual(beats.find(2.0), 1)
+        self.assertEqual(beats.find(2.0, side='right'), 2)
+        self.assertEqual(beats.find(5.0), 3)
+
+    def test_out_of_bounds(self):
+        beats = BeatStore(np.array([1.0, 2.0]), np.zeros(2), np.zeros(2))
+        with self.assertRaises(IndexError):
+            beats.delete(2)
+        with self.assertRaises(IndexError):
+            beats.insert(3, 4.0, 0, 0)
+
+
+class TestEditBuffers(unittest.TestCase):
+
+    def test_edit(self):
+        class Owner:
+            pass
+        owner, buffers = Owner(), EditBuffers()
+        owner.items = np.arange(5)
+        buffers.edit(owner, 'items').delete(0)
+        buffers.publish(owner, 'items')
+        view = owner.items
+        self.assertIs(type(view), np.ndarray)
+        self.assertTrue(np.array_equal(view, [1, 2, 3, 4]))
+        # the array handed out is edited in the same buffer
+        buffers.edit(owner, 'items').insert(0, 7)
+        buffers.publish(owner, 'items')
+        self.assertIs(owner.items.base, view.base)
+        self.assertTrue(np.array_equal(owner.items, [7, 1, 2, 3, 4]))
+        # an array put in its place is copied to a new one
+        owner.items = np.arange(3)
+        buffers.edit(owner, 'items').delete(2)
+        buffers.publish(owner, 'items')
+        self.assertIsNot(owner.items.base, view.base)
+        self.assertTrue(np.array_equal(owner.items, [0, 1]))
+
+
+class TestGapArray(unittest.TestCase):
+
+    def test_same_as_array(self):
+        rng = np.random.default_rng(1)
+        expected = np.arange(300)
+        items = GapArray(expected, slack=2)  # small, so that the buffer has to grow
+        for _ in range(300):
+            start = rng.integers(0, len(expected) + 1)
+            stop = min(start + rng.integers(0, 3), len(expected))
+            new_items = rng.integers(0, 1000, rng.integers(0, 4))
+            shift = rng.integers(-2, 3)
+            expected = np.concatenate((expected[:start], new_items, expected[stop:] + shift))
+            items.replace(start, stop, new_items)
+            items.shift(start + len(new_items), shift)
+            self.assertEqual(len(items), len(expected))
+            first, last = sorted(rng.integers(-len(expected), len(expected) + 1, 2))
+            self.assertTrue(np.array_equal(items[first:last], expected[first:last]))
+            index = rng.integers(-len(expected), len(expected))
+            self.assertEqual(items[index], expected[index])
+        self.assertTrue(np.array_equal(items, expected))
+        self.assertTrue(np.array_equal(items[::2], expected[::2]))
+        self.assertTrue(np.array_equal(items == 5, expected == 5))
+        self.assertTrue(np.array_equal(items * 2, expected * 2))
+        items[3], expected[3] = -1, -1
+        items[expected > 900] = 0
+        expected[expected > 900] = 0
+        self.assertTrue(np.array_equal(items, expected))
+
+    def test_searchsorted(self):
+        rng = np.random.default_rng(2)
+        expected = np.sort(rng.integers(0, 100, 200))
+        items = GapArray(expected)
+        items.replace(50, 60, expected[50:60])
+        items.shift(100, 0)
+        values = np.arange(-1, 102)
+        with mock.patch.object(GapArray, '__array__', side_effect=AssertionError("the array was made")):
+            for side in ('left', 'right'):
+                self.assertTrue(np.array_equal(np.searchsorted(items, values, side=side),
+                                               np.searchsorted(expected, values, side=side)))
+                self.assertEqual(items.searchsorted(50, side=side), np.searchsorted(expected, 50, side=side))
+
+    def test_view(self):
+        items = GapArray(np.arange(10), slack=2)
+        items.replace(2, 3, [20, 21])
+        items.shift(4, 100)
+        view = items.view()
+        self.assertIs(type(view), np.ndarray)
+        self.assertTrue(np.array_equal(view, [0, 1, 20, 21, 103, 104, 105, 106, 107, 108, 109]))
+        # edited in place - while there is room in the buffer
+        items.delete(0)
+        self.assertIs(items.view().base, view.base)
+        self.assertTrue(np.array_equal(items.view(), [1, 20, 21, 103, 104, 105, 106, 107, 108, 109]))
+
+    def test_out_of_bounds(self):
+        items = GapArray(np.arange(3))
+        with self.assertRaises(IndexError):
+            items[3]
+        with self.assertRaises(IndexError):
+            items.replace(2, 4, [])
+        with self.assertRaises(IndexError):
+            items.replace(2, 1, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
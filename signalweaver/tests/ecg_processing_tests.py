@@ -0,0 +1,323 @@
+import unittest
+from unittest import mock
+import warnings
+import numpy as np
+from signalweaver.signal_processing.ecg_processing import correlation_machine, detect_r_waves, \
+    detect_r_waves_in_blocks, detect_artifacts, noise, noise_profile, \
+    detect_artifacts_in_batch, find_max_qrs, clean_peaks, find_correlated_peaks, \
+    get_template
+from signalweaver.signal_processing.parallel_detection import detect_r_waves_parallel, detect_artifacts_parallel
+from signalweaver.signal_store import UniformTimeTrack
+
+
+def synthetic_ecg(seconds=20, frequency=200, seed=777):
+    """
+    a crude ECG - gaussian QRS complexes and T waves every ~0.85 s plus some noise, sampled at frequency
+    """
+    random_generator = np.random.default_rng(seed)
+    time_track = np.arange(int(seconds * frequency)) / frequency
+    voltage = 0.02 * random_generator.standard_normal(len(time_track))
+    beats = np.cumsum(0.85 + 0.05 * random_generator.standard_normal(int(seconds / 0.85)))
+    for beat in beats[beats < seconds - 0.5]:
+        voltage += np.exp(-(time_track - beat) ** 2 / (2 * 0.01 ** 2))
+        voltage += 0.2 * np.exp(-(time_track - beat - 0.25) ** 2 / (2 * 0.04 ** 2))
+    return time_track, voltage
+
+
+class TestCorrelationMachine(unittest.TestCase):
+
+    def setUp(self):
+        self.time_track, self.voltage = synthetic_ecg()
+        self.voltage[1000:1200] = self.voltage[1000]  # a flat segment - zero variance windows
+        self.template = self.voltage[100:151].copy()
+
+    @staticmethod
+    def corrcoef_machine(vector, template):
+        # this is how correlation_machine used to work - np.corrcoef at every position
+        extended_vector = np.concatenate([vector, template * 0])
+        rolling_correlations = []
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for idx in range(0, len(vector)):
+                rolling_correlations.append(np.corrcoef(template, extended_vector[idx:idx + len(template)])[0, 1])
+        return np.nan_to_num(np.array(rolling_correlations))
+
+    def test_same_as_corrcoef(self):
+        expected = self.corrcoef_machine(self.voltage, self.template)
+        self.assertTrue(np.allclose(correlation_machine(self.voltage, self.template), expected, atol=1e-6))
+
+    def test_chunks(self):
+        # the chunk size must not change anything, including chunks shorter than the template
+        whole = correlation_machine(self.voltage, self.template)
+        for chunk_size in (1000, 333, 7):
+            self.assertTrue(np.allclose(correlation_machine(self.voltage, self.template, chunk_size=chunk_size),
+                                        whole, atol=1e-9))
+
+    def test_flat_segments(self):
+        correlations = correlation_machine(self.voltage, self.template)
+        self.assertTrue((correlations[1000:1150] == 0).all())
+        self.assertTrue((correlation_machine(self.voltage, self.template * 0) == 0).all())
+
+
+class TestBlockDetection(unittest.TestCase):
+
+    def setUp(self):
+        self.time_track, self.voltage = synthetic_ecg(seconds=180)
+
+    def test_blocks_same_as_whole(self):
+        whole = detect_r_waves(self.time_track, self.voltage)
+        # 40 s blocks - the block edges fall on all phases of the beats, and the last block is 20 s long
+        in_blocks = detect_r_waves_in_blocks(self.time_track, self.voltage, block_length=40)
+        self.assertTrue(len(whole) > 150)
+        self.assertTrue((whole == in_blocks).all())
+
+    def test_no_duplicates_at_edges(self):
+        for block_length in (17, 23.3, 31):
+            r_waves = detect_r_waves_in_blocks(self.time_track, self.voltage, block_length=block_length)
+            self.assertTrue((np.diff(r_waves[:, 0]) > 0.1).all())
+
+
+class TestParallelDetection(unittest.TestCase):
+
+    def setUp(self):
+        self.time_track, self.voltage = synthetic_ecg(seconds=180)
+        self.voltage[10000:11000] += np.random.default_rng(1).standard_normal(1000)  # some noise to find artifacts in
+
+    def test_parallel_same_as_blocks(self):
+        in_blocks = detect_r_waves_in_blocks(self.time_track, self.voltage, block_length=40)
+        in_parallel = detect_r_waves_parallel(self.time_track, self.voltage, n_jobs=2, segment_length=40)
+        self.assertTrue((in_blocks == in_parallel).all())
+
+    def test_parallel_artifacts(self):
+        r_waves_positions = detect_r_waves(self.time_track, self.voltage)[:, 0]
+        artifacts = detect_artifacts(r_waves_positions, self.time_track, self.voltage)
+        self.assertTrue(len(artifacts) > 0)
+        self.assertEqual(detect_artifacts_parallel(r_waves_positions, self.time_track, self.voltage, n_jobs=2,
+                                                   beats_per_job=30), artifacts)
+
+
+class TestNoise(unittest.TestCase):
+
+    def setUp(self):
+        self.time_track, self.voltage = synthetic_ecg(seconds=180)
+        self.voltage += 1000  # an offset, like in raw ADC values
+        self.r_waves = detect_r_waves(self.time_track, self.voltage)[:, 0]
+
+    def loop_noise(self, previous_r_waves, r_waves, half_template_length=50):
+        # this is how the noise used to be calculated - beat by beat
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return np.array([np.std(self.voltage[np.where(self.time_track >= previous)[0][0] + half_template_length:
+                                                 np.where(self.time_track >= current)[0][0] - half_template_length])
+                             for previous, current in zip(previous_r_waves, r_waves)])
+
+    def test_same_as_loop(self):
+        expected = self.loop_noise(self.r_waves[:-1], self.r_waves[1:])
+        # the running sums are not exact - a segment of one sample gets a tiny standard deviation instead of 0
+        self.assertTrue(np.allclose(noise(self.r_waves, self.time_track, self.voltage), expected, atol=1e-6))
+        # long windows - some of the segments are empty
+        expected = self.loop_noise(self.r_waves[:-1], self.r_waves[1:], half_template_length=90)
+        calculated = noise(self.r_waves, self.time_track, self.voltage, half_template_length=90)
+        self.assertTrue(np.isnan(calculated).any())
+        self.assertTrue(np.allclose(calculated, expected, atol=1e-6, equal_nan=True))
+
+    def test_uniform_time_track(self):
+        # with the time track of a store the R-waves are turned into samples by arithmetic, without making the track
+        time_track = UniformTimeTrack(self.time_track[0], self.time_track[1] - self.time_track[0], len(self.time_track))
+        with mock.patch.object(UniformTimeTrack, '__array__', side_effect=AssertionError("the array was made")):
+            calculated = noise(self.r_waves, time_track, self.voltage)
+        self.assertTrue(np.allclose(calculated, noise(self.r_waves, self.time_track, self.voltage), equal_nan=True))
+
+    def test_noise_profile(self):
+        reasonable_rr = np.array((0.6, 1.3125))
+        np.random.seed(777)
+        random_r_pos = np.random.choice(range(2, len(self.r_waves)), len(self.r_waves) - 3, replace=False)
+        random_rr = self.r_waves[random_r_pos] - self.r_waves[random_r_pos - 1]
+        r_pos = random_r_pos[np.logical_and(random_rr > reasonable_rr[0], random_rr < reasonable_rr[1])]
+        expected = np.percentile(self.loop_noise(self.r_waves[r_pos - 1], self.r_waves[r_pos]), 75) * 1.3
+        self.assertAlmostEqual(noise_profile(self.r_waves[:100], self.time_track, self.voltage, reasonable_rr), -1.0)
+        self.assertAlmostEqual(noise_profile(self.r_waves, self.time_track, self.voltage, reasonable_rr), expected,
+                               places=9)
+
+
+class TestArtifacts(unittest.TestCase):
+
+    def setUp(self):
+        self.time_track, self.voltage = synthetic_ecg(seconds=180)
+        self.voltage[10000:11000] += np.random.default_rng(1).standard_normal(1000)
+        self.r_waves = detect_r_waves(self.time_track, self.voltage)[:, 0]
+        self.r_waves = np.delete(self.r_waves, [40, 80, 81])  # some long intervals
+
+    @staticmethod
+    def loop_artifacts(r_waves_positions, time_track, signal, rr_filter=(0.3, 1.75)):
+        # this is how detect_artifacts used to classify the intervals - one by one
+        reasonable_rr = np.array(rr_filter) * np.array((2, 0.75))
+        current_noise_profile = noise_profile(r_waves_positions, time_track, signal, reasonable_rr)
+        noise_for_all = noise(r_waves_positions, time_track, signal)
+        artifact_positions = []
+        for idx in range(1, len(r_waves_positions)):
+            current_rr = r_waves_positions[idx] - r_waves_positions[idx - 1]
+            if np.logical_or(current_rr < rr_filter[0], current_rr > rr_filter[1]):
+                artifact_positions.append(idx)
+            elif np.logical_or(current_rr < reasonable_rr[0], current_rr > reasonable_rr[1]) and noise_for_all[
+                idx - 1] > current_noise_profile * 2:
+                artifact_positions.append(idx)
+            elif noise_for_all[idx - 1] > 4 * current_noise_profile:
+                artifact_positions.append(idx)
+        return artifact_positions
+
+    def test_same_as_loop(self):
+        for rr_filter in ((0.3, 1.75), (0.25, 1.5)):
+            expected = self.loop_artifacts(self.r_waves, self.time_track, self.voltage, rr_filter)
+            self.assertTrue(len(expected) > 0)
+            self.assertEqual(detect_artifacts(self.r_waves, self.time_track, self.voltage, rr_filter), expected)
+
+    def test_batch(self):
+        other = self.r_waves[:150]
+        noise_for_all = noise(self.r_waves, self.time_track, self.voltage)
+        records = [(self.r_waves, self.time_track, self.voltage, noise_for_all),
+                   (other, self.time_track, self.voltage), (self.r_waves[:1], self.time_track, self.voltage)]
+        for rr_filter in ((0.3, 1.75), (0.25, 1.5)):
+            self.assertEqual(detect_artifacts_in_batch(records, rr_filter),
+                             [detect_artifacts(r_waves, self.time_track, self.voltage, rr_filter)
+                              for r_waves, *_ in records])
+        self.assertEqual(detect_artifacts_in_batch([]), [])
+
+
+class TestPeakCleaning(unittest.TestCase):
+    # find_max_qrs and clean_peaks as they used to be - one peak at a time
+
+    @staticmethod
+    def loop_find_max_qrs(qrs_pos, ecg_line, dist=100):
+        if qrs_pos - dist > 0:
+            return np.argmax(ecg_line[qrs_pos - dist: qrs_pos + dist]) + (qrs_pos - dist)
+        else:
+            return np.argmax(ecg_line[: qrs_pos + dist])
+
+    @staticmethod
+    def loop_clean_peaks(qrs_complexes, dist=20):
+        new_peaks = []
+        accumulator = []
+        push = True
+        for idx in range(0, len(qrs_complexes) - 1):
+            if qrs_complexes[idx + 1] - qrs_complexes[idx] < dist:
+                accumulator.append(qrs_complexes[idx])
+                push = False
+            elif not push:
+                accumulator.append(qrs_complexes[idx])
+                new_peaks.append(int(np.median(accumulator)))
+                push = True
+                accumulator = []
+            else:
+                new_peaks.append(qrs_complexes[idx])
+        if len(accumulator) == 0:
+            new_peaks.append(qrs_complexes[idx + 1])
+        else:
+            accumulator.append(qrs_complexes[idx + 1])
+            new_peaks.append(int(np.median(accumulator)))
+        return np.array(new_peaks)
+
+    def test_find_max_qrs(self):
+        _, voltage = synthetic_ecg(seconds=60)
+        voltage[3000:3400] = 0.5  # ties - the first maximum is taken
+        rng = np.random.default_rng(2)
+        positions = np.concatenate(([0, 5, 100, 101, 3100, len(voltage) - 150, len(voltage) - 1],
+                                    rng.integers(0, len(voltage), 500)))
+        expected = np.array([self.loop_find_max_qrs(position, voltage) for position in positions])
+        self.assertTrue(np.array_equal(find_max_qrs(positions, voltage, peaks_per_block=64), expected))
+        self.assertEqual(find_max_qrs(positions[4], voltage), expected[4])
+
+    def test_clean_peaks(self):
+        rng = np.random.default_rng(3)
+        for _ in range(50):
+            # runs of close peaks, not always in order, and single ones
+            qrs_complexes = np.cumsum(rng.choice([3, 8, 19, 20, 21, 150, -5], size=rng.integers(2, 60)))
+            self.assertTrue(np.array_equal(clean_peaks(qrs_complexes), self.loop_clean_peaks(qrs_complexes)))
+        r_waves = detect_r_waves(*synthetic_ecg(seconds=60))[:, 0]  # no runs at all
+        self.assertTrue(np.array_equal(clean_peaks(np.round(r_waves * 200)), np.round(r_waves * 200)))
+
+
+class TestCorrelatedPeaks(unittest.TestCase):
+
+    @staticmethod
+    def loop_correlated_peaks(correlations_vector, voltage, template, threshold=0.75, search_width=10):
+        # this is how find_correlated_peaks used to work - region by region
+        template_length = len(template)
+        template_ptp = np.ptp(template)
+        boo = np.array(correlations_vector >= threshold)
+        indices = np.nonzero(boo[1:] != boo[:-1])[0] + 1
+        regions = np.split(np.arange(len(correlations_vector)), indices)
+        regions_over_thr = [region + int(np.floor(template_length / 2) + 1) for region in
+                            (regions[0::2] if boo[0] else regions[1::2])]
+        peaks = []
+        for segment in regions_over_thr:
+            extended_segment = np.concatenate([np.arange(segment[0] - search_width, segment[0]), segment,
+                                               np.arange(segment[-1] + 1, segment[-1] + search_width + 1)])
+            extended_segment = extended_segment[np.logical_and(extended_segment >= 0,
+                                                               extended_segment < len(voltage))]
+            if len(extended_segment) == 0:
+                continue
+            peak_position = extended_segment[np.argmax(voltage[extended_segment])]
+            if 1 / 2 * template_ptp < np.ptp(voltage[extended_segment]) < 2 * template_ptp:
+                peaks.append(peak_position)
+        return np.array(peaks, dtype=int)
+
+    def test_same_as_loop(self):
+        _, voltage = synthetic_ecg(seconds=120)
+        first_qrs = np.argmax(voltage[:200])
+        template = voltage[first_qrs - 25:first_qrs + 26].copy()
+        correlations = correlation_machine(voltage, template)
+        expected = self.loop_correlated_peaks(correlations, voltage, template)
+        self.assertTrue(len(expected) > 100)
+        self.assertTrue(np.array_equal(find_correlated_peaks(correlations, voltage, template), expected))
+
+    def test_edges_and_nans(self):
+        rng = np.random.default_rng(4)
+        template = np.array([0.0, 0.5, 1.0, 0.5, 0.0])
+        for _ in range(30):
+            voltage = rng.random(300).round(1)  # with ties
+            voltage[rng.integers(0, 300, 3)] = np.nan
+            correlations = rng.random(300)
+            correlations[rng.integers(0, 300, 5)] = np.nan
+            for threshold in (0.2, 0.75, 0.99):
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    expected = self.loop_correlated_peaks(correlations, voltage, template, threshold=threshold)
+                self.assertTrue(np.array_equal(find_correlated_peaks(correlations, voltage, template,
+                                                                     threshold=threshold), expected))
+        self.assertEqual(len(find_correlated_peaks(np.zeros(50), np.zeros(50), template)), 0)
+
+
+class TestTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.time_track, self.voltage = synthetic_ecg(seconds=120)
+        self.r_waves = np.round(detect_r_waves(self.time_track, self.voltage)[:, 0] * 200).astype(int)
+
+    def test_same_as_pairwise(self):
+        # with all the drawn QRS complexes alike, the template is their mean - as with the pairwise correlations
+        template = get_template(self.voltage, self.r_waves, template_length=51)
+        np.random.seed(777)
+        drawn = np.random.choice(self.r_waves[2:], 8, replace=False)
+        expected = np.mean([self.voltage[position - 25:position + 26] for position in drawn], axis=0)
+        self.assertTrue(np.allclose(template, expected))
+
+    def test_rejected_beats(self):
+        voltage = self.voltage.copy()
+        for position in self.r_waves[2::3]:  # every third QRS is spoiled
+            voltage[position - 25:position + 26] = np.random.default_rng(position).standard_normal(51)
+        clean = get_template(self.voltage, self.r_waves, template_length=51, n_sample=None)
+        for method in ('mean', 'median'):
+            template = get_template(voltage, self.r_waves, template_length=51, n_sample=30, method=method)
+            # the spoiled ones are dropped and the rest averaged, without shrinking the template
+            self.assertGreater(np.corrcoef(template, clean)[0, 1], 0.99)
+            self.assertAlmostEqual(np.ptp(template), np.ptp(clean), delta=0.1 * np.ptp(clean))
+
+    def test_too_few(self):
+        self.assertTrue((get_template(self.voltage, self.r_waves[:5], template_length=51) == -1).all())
+        flat = np.zeros_like(self.voltage)
+        self.assertTrue((get_template(flat, self.r_waves, template_length=51) == -1).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
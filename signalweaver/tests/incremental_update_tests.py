@@ -0,0 +1,142 @@
+import unittest
+from unittest import mock
+import numpy as np
+from signalweaver.beat_store import GapArray, EditBuffers
+from signalweaver.signal_classes import ECG
+from signalweaver.traces.trace_rep import TraceECGSignal
+
+DESCRIPTORS = ['SD1', 'SD2', 'SDNN', 'SD1d', 'C1d', 'SD1a', 'C1a', 'SD1I', 'SD2d', 'C2d', 'SD2a', 'C2a', 'SD2I', 'SDNNd',
+               'Cd', 'SDNNa', 'Ca']
+
+
+def beats_only_ecg(n_beats=2000, seed=5):
+    # an ECG with the R-waves and annotations only, the way they are after the detection
+    rng = np.random.default_rng(seed)
+    ecg = ECG.__new__(ECG)
+    ecg.inverted = False
+    ecg.full_data = [dict(), dict()]
+    ecg.edit_buffers = EditBuffers()
+    ecg.r_waves_all_pos = np.round(np.cumsum(0.8 + 0.05 * rng.standard_normal(n_beats)), 3)
+    ecg.r_waves_all_vals = rng.random(n_beats)
+    ecg.annotations = np.where(rng.random(n_beats) < 0.05, rng.integers(1, 4, n_beats), 0).astype(float)
+    recalculate(ecg)
+    return ecg
+
+
+def recalculate(ecg):
+    ecg.ventriculars_pos, ecg.ventriculars_vals = ecg.get_ventriculars()
+    ecg.supraventriculars_pos, ecg.supraventriculars_vals = ecg.get_supraventriculars()
+    ecg.artifacts_pos, ecg.artifacts_vals = ecg.get_artifacts()
+    ecg.rr_intervals, ecg.rr_annotations = ecg.get_rrs()
+    ecg.update_poincare()
+
+
+class TestIncrementalUpdate(unittest.TestCase):
+
+    def assertSameAsRecalculated(self, ecg):
+        expected = beats_only_ecg()
+        for attribute in ('r_waves_all_pos', 'r_waves_all_vals', 'annotations'):
+            setattr(expected, attribute, getattr(ecg, attribute).copy())
+        recalculate(expected)
+        for attribute in ('ventriculars_pos', 'ventriculars_vals', 'supraventriculars_pos', 'supraventriculars_vals',
+                          'artifacts_pos', 'artifacts_vals', 'rr_intervals', 'rr_annotations'):
+            self.assertTrue(np.array_equal(getattr(ecg, attribute), getattr(expected, attribute)), attribute)
+        poincare, expected_poincare = ecg.RRSignal.poincare, expected.RRSignal.poincare
+        for attribute in ('xi', 'xii', 'x_i_indices', 'x_ii_indices'):
+            self.assertTrue(np.array_equal(getattr(poincare, attribute), getattr(expected_poincare, attribute)),
+                            attribute)
+        for descriptor in DESCRIPTORS:
+            self.assertAlmostEqual(getattr(poincare, descriptor), getattr(expected_poincare, descriptor), places=9,
+                                   msg=descriptor)
+        self.assertIs(ecg.full_data[0]['rr_intervals'], ecg.rr_intervals)
+
+    def test_annotate(self):
+        ecg = beats_only_ecg()
+        rng = np.random.default_rng(0)
+        for beat in list(rng.integers(0, len(ecg.annotations), 30)) + [0, 1, len(ecg.annotations) - 1]:
+            ecg.annotations[beat] = rng.integers(0, 4)
+            ecg.update_after_edit(beat, 1, 1)
+        self.assertSameAsRecalculated(ecg)
+
+    def test_insert_and_remove(self):
+        ecg = beats_only_ecg()
+        rng = np.random.default_rng(1)
+        for _ in range(40):
+            beat = rng.integers(0, len(ecg.r_waves_all_pos) - 1)
+            if rng.random() < 0.5:
+                ecg.r_waves_all_pos = np.delete(ecg.r_waves_all_pos, beat)
+                ecg.r_waves_all_vals = np.delete(ecg.r_waves_all_vals, beat)
+                ecg.annotations = np.delete(ecg.annotations, beat)
+                ecg.update_after_edit(beat, 1, 0)
+            else:
+                position = (ecg.r_waves_all_pos[beat] + ecg.r_waves_all_pos[beat + 1]) / 2
+                ecg.r_waves_all_pos = np.insert(ecg.r_waves_all_pos, beat + 1, position)
+                ecg.r_waves_all_vals = np.insert(ecg.r_waves_all_vals, beat + 1, 0.5)
+                ecg.annotations = np.insert(ecg.annotations, beat + 1, rng.integers(0, 4))
+                ecg.update_after_edit(beat + 1, 0, 1)
+        self.assertSameAsRecalculated(ecg)
+
+    def test_edges(self):
+        ecg = beats_only_ecg()
+        for beat in (0, -1):
+            beat = beat % len(ecg.r_waves_all_pos)
+            ecg.r_waves_all_pos = np.delete(ecg.r_waves_all_pos, beat)
+            ecg.r_waves_all_vals = np.delete(ecg.r_waves_all_vals, beat)
+            ecg.annotations = np.delete(ecg.annotations, beat)
+            ecg.update_after_edit(beat, 1, 0)
+        ecg.r_waves_all_pos = np.insert(ecg.r_waves_all_pos, 0, ecg.r_waves_all_pos[0] - 0.7)
+        ecg.r_waves_all_vals = np.insert(ecg.r_waves_all_vals, 0, 0.5)
+        ecg.annotations = np.insert(ecg.annotations, 0, 1)
+        ecg.update_after_edit(0, 0, 1)
+        self.assertSameAsRecalculated(ecg)
+
+    def test_in_place(self):
+        # after the first edit the derived arrays are views of gap buffers, which the next edits change without
+        # copying them
+        ecg = beats_only_ecg()
+        ecg.annotations[100] = 1
+        ecg.update_after_edit(100, 1, 1)
+        rr_intervals, xi = ecg.rr_intervals, ecg.RRSignal.poincare.xi
+        for array in (rr_intervals, xi, ecg.artifacts_pos, ecg.RRSignal.signal, ecg.full_data[0]['rr_intervals']):
+            self.assertIs(type(array), np.ndarray)
+        with mock.patch.object(GapArray, '__array__', side_effect=AssertionError("the array was copied")):
+            for beat in (1500, 1490, 20):
+                ecg.annotations[beat] = 2
+                ecg.update_after_edit(beat, 1, 1)
+                position = (ecg.r_waves_all_pos[beat] + ecg.r_waves_all_pos[beat + 1]) / 2
+                ecg.r_waves_all_pos = np.insert(ecg.r_waves_all_pos, beat + 1, position)
+                ecg.r_waves_all_vals = np.insert(ecg.r_waves_all_vals, beat + 1, 0.5)
+                ecg.annotations = np.insert(ecg.annotations, beat + 1, 0)
+                ecg.update_after_edit(beat + 1, 0, 1)
+        self.assertIs(ecg.rr_intervals.base, rr_intervals.base)
+        self.assertIs(ecg.RRSignal.poincare.xi.base, xi.base)
+        self.assertSameAsRecalculated(ecg)
+
+
+class TestWindowQuery(unittest.TestCase):
+
+    def test_same_as_mask(self):
+        ecg = beats_only_ecg()
+        trace = TraceECGSignal.__new__(TraceECGSignal)
+        trace.window_length = 15
+        positions, values = ecg.r_waves_all_pos, ecg.r_waves_all_vals
+        for position in (-20, 0, positions[10], 100.3, positions[-1] - 5, positions[-1] + 1):
+            trace.position = position
+            condition = np.logical_and(positions >= position, positions < position + trace.window_length)
+            found_positions, found_values, first = trace.get_current_peaks_positions(positions, values, True)
+            self.assertTrue(np.array_equal(found_positions, positions[condition]))
+            self.assertTrue(np.array_equal(found_values, values[condition]))
+            self.assertEqual(first, np.where(condition)[0][0] if condition.any() else None)
+            self.assertEqual(trace.get_current_peaks_positions(positions, values)[2], 0)
+
+    def test_classified_beats(self):
+        ecg = beats_only_ecg()
+        self.assertIs(ecg.get_classified_beats('ventriculars')[0], ecg.ventriculars_pos)
+        ecg.artifacts_pos, ecg.artifacts_vals = None, None  # e.g. results saved without them
+        positions, values = ecg.get_classified_beats('artifacts')
+        self.assertTrue(np.array_equal(positions, ecg.r_waves_all_pos[ecg.annotations == 3]))
+        self.assertIs(ecg.artifacts_pos, positions)
+
+
+if __name__ == '__main__':
+    unittest.main()
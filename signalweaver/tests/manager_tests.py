@@ -0,0 +1,191 @@
+import unittest
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from flask import Flask, session
+from signalweaver.ecgs import manager
+from signalweaver.ecgs.manager import ECGCache, footprint, loading, LOADING_LOCKS, get_ecg, release_ecgs
+from signalweaver.results_store import WRITER, load_results
+
+
+def write_ecg(file_path, seconds=120, frequency=200, seed=777):
+    # a crude ECG (see polarity_tests), long enough for the noise profile
+    random_generator = np.random.default_rng(seed)
+    time_track = np.arange(int(seconds * frequency)) / frequency
+    voltage = 0.02 * random_generator.standard_normal(len(time_track))
+    for beat in np.arange(0.5, seconds - 0.5, 0.8):
+        voltage += np.exp(-(time_track - beat) ** 2 / (2 * 0.01 ** 2))
+    pd.DataFrame({'time': time_track, 'voltage': voltage}).to_csv(file_path, index=False)
+
+
+class FakeRecord:
+
+    def __init__(self, n_bytes=800):
+        self.signal_values = np.zeros(n_bytes // 8)
+        self.full_data = [{'annotations': np.zeros(10)}, {}]
+        self.change, self.saved_change = 0, 0
+        self.n_saved = 0
+        self.closed = False
+
+    def update_results_dict(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def save_processed_data(self):
+        self.n_saved += 1
+        self.saved_change = self.change
+
+
+class TestECGCache(unittest.TestCase):
+
+    def test_footprint(self):
+        record = FakeRecord(800)
+        record.annotations = record.full_data[0]['annotations']  # the same array counted once
+        self.assertEqual(footprint(record), 880)
+
+    def test_least_recently_used(self):
+        cache = ECGCache(max_records=2)
+        records = [FakeRecord() for _ in range(3)]
+        cache.put('a', records[0])
+        cache.put('b', records[1])
+        cache.get('a')
+        cache.put('c', records[2])
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_memory_limit(self):
+        cache = ECGCache(max_records=10, max_memory=3000)
+        for key in 'abcd':
+            cache.put(key, FakeRecord(800))
+        self.assertEqual(len(cache), 3)
+        self.assertNotIn('a', cache)
+        # the most recent record stays, even if it is too large alone
+        cache.put('e', FakeRecord(8000))
+        self.assertEqual(len(cache), 1)
+        self.assertIn('e', cache)
+
+    def test_flush_on_eviction(self):
+        cache = ECGCache(max_records=1)
+        changed, unchanged = FakeRecord(), FakeRecord()
+        changed.change = 3
+        cache.put('changed', changed)
+        cache.put('unchanged', unchanged)
+        cache.put('other', FakeRecord())
+        self.assertEqual(changed.n_saved, 1)
+        self.assertEqual(changed.saved_change, 3)
+        self.assertEqual(unchanged.n_saved, 0)
+        self.assertTrue(changed.closed and unchanged.closed)
+
+    def test_flush_on_release(self):
+        cache = ECGCache(max_records=1)
+        used = FakeRecord()
+        cache.put('used', used, use=True)
+        cache.put('other', FakeRecord())
+        self.assertNotIn('used', cache)
+        # dropped, but still used by a request, which changes it
+        self.assertEqual(used.n_saved, 0)
+        self.assertFalse(used.closed)
+        used.change = 2
+        cache.release(used)
+        self.assertEqual(used.n_saved, 1)
+        self.assertEqual(used.saved_change, 2)
+        self.assertTrue(used.closed)
+        self.assertEqual(cache.in_use, {})
+        self.assertEqual(cache.dropped, set())
+
+    def test_shared_counted_once(self):
+        records = [FakeRecord(800) for _ in range(2)]
+        records[1].full_data = records[0].full_data
+        seen = set()
+        self.assertEqual(footprint(records[0], seen), 880)
+        self.assertEqual(footprint(records[1], seen), 800)
+
+    def test_loading_locks_removed(self):
+        loaded = []
+
+        def load(name):
+            with loading(name):
+                loaded.append(name)
+
+        threads = [threading.Thread(target=load, args=(name,)) for name in 'abcabcabc']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loaded), 9)
+        self.assertEqual(LOADING_LOCKS, {})
+
+    def test_threads(self):
+        cache = ECGCache(max_records=5)
+
+        def use(thread):
+            for idx in range(200):
+                key = (thread, idx % 7)
+                if cache.get(key) is None:
+                    cache.put(key, FakeRecord())
+
+        threads = [threading.Thread(target=use, args=(_,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(cache), 5)
+
+
+
+class TestSharedResults(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'ecg.csv')
+        write_ecg(self.file_path)
+        self.app = Flask(__name__)
+        self.app.secret_key = 'test'
+
+    def tearDown(self):
+        manager.ECGS.clear()
+        WRITER.flush()
+        self.directory.cleanup()
+
+    def get_ecg(self, session_id):
+        with self.app.test_request_context():
+            session['ecg_name'], session['session_id'] = self.file_path, session_id
+            ecg = get_ecg()
+            release_ecgs()
+        return ecg
+
+    def test_two_sessions(self):
+        first = self.get_ecg('first')
+        second = self.get_ecg('second')
+        self.assertIsNot(first, second)
+        self.assertIs(first.full_data, second.full_data)
+        first.annotate_rr(5, 3)
+        second = self.get_ecg('second')
+        self.assertEqual(second.annotations[5], 3)
+        self.assertFalse(np.shares_memory(np.asarray(second.annotations), np.asarray(first.annotations)))
+        second.remove_rr(second.r_waves_all_pos[10])
+        first.save_processed_data()  # the changes of both sessions are saved, whichever saves
+        saved = load_results(first.npzify())[0]
+        self.assertEqual(saved['annotations'][5], 3)
+        self.assertTrue(np.array_equal(saved['r_waves_all_pos'], second.r_waves_all_pos))
+        self.assertEqual(len(saved['r_waves_all_pos']), len(first.annotations) - 1)
+
+    def test_footprint_of_edited_record(self):
+        # the edited arrays are counted too - with the room left in their buffers
+        ecg = self.get_ecg('first')
+        before = footprint(ecg)
+        self.assertTrue(before > 0)
+        ecg.annotate_rr(5, 3)
+        after = footprint(ecg)
+        self.assertTrue(after >= before + ecg.rr_intervals.base.nbytes)
+        ecg.remove_rr(ecg.r_waves_all_pos[10])
+        self.assertTrue(footprint(ecg) >= after)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 import unittest
+from unittest import mock
+import os
+import tempfile
 from signalweaver.traces.trace_rep import TraceECGSignal
+from signalweaver.results_store import WRITER
+from signalweaver.signal_store import UniformTimeTrack
 
 import json
+import numpy as np
+import pandas as pd
 
 
 class TestPoincareClicks(unittest.TestCase):
@@ -22,4 +29,55 @@ class TestPoincareClicks(unittest.TestCase):
         click_rr_1 = json.load(click_file)
         click_file.close()
         # I will stop here - need to rewrite or learn selenium
-        #self.trace_signal.
\ No newline at end of file
+        #self.trace_signal.
+
+
+class TestPoincareClickPosition(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        file_path = os.path.join(self.directory.name, 'ecg.csv')
+        time_track = np.arange(0, 20 * 60, 0.005)
+        voltage = 0.02 * np.random.default_rng(0).standard_normal(len(time_track))
+        beats = np.cumsum(0.8 + 0.04 * np.random.default_rng(1).standard_normal(1450))
+        for beat in np.round(beats[beats < time_track[-1] - 1] / 0.005).astype(int):
+            voltage[beat - 2:beat + 3] += (0.3, 0.7, 1, 0.7, 0.3)
+        pd.DataFrame({'time': time_track, 'voltage': voltage}).to_csv(file_path, index=False)
+        self.trace_signal = TraceECGSignal(file_path)
+
+    def tearDown(self):
+        WRITER.flush()
+        self.directory.cleanup()
+
+    def expected_position(self, point):
+        # the clicked time as it used to be found - summing the RR intervals up to the clicked one
+        poincare = self.trace_signal.RRSignal.poincare
+        rr_index = poincare.x_i_indices[point + 2]
+        clicked_time = self.trace_signal.r_waves_all_pos[0] + np.sum(self.trace_signal.rr_intervals[:rr_index])
+        sample = np.where(np.isclose(self.trace_signal.time_track[:], clicked_time))[0][0]
+        clicked_at = self.trace_signal.time_track[sample]
+        preceding = np.sum(poincare.xi[point + 2:point + 6])
+        if clicked_at < preceding:
+            return clicked_at
+        if sample + self.trace_signal.window_length / self.trace_signal.sampling_period >= len(
+                self.trace_signal.time_track):
+            return self.trace_signal.time_track[-1] - self.trace_signal.window_length
+        return clicked_at - preceding
+
+    def test_positions(self):
+        n_points = len(self.trace_signal.RRSignal.poincare.xi)
+        self.assertTrue(n_points > 1000)
+        for point in (1, 0, 500, n_points - 20, n_points - 3):  # (0 is where the last click is at the start)
+            self.trace_signal.set_position_on_pp_click({'points': [{'pointNumber': point}]})
+            self.assertAlmostEqual(self.trace_signal.position, self.expected_position(point), places=9)
+        # the end of the recording - the last window is shown
+        self.assertAlmostEqual(self.trace_signal.position,
+                               self.trace_signal.time_track[-1] - self.trace_signal.window_length)
+
+    def test_no_time_track_array(self):
+        # the clicked R-wave is found in the time track by arithmetic, the whole track is not made
+        self.assertIsInstance(self.trace_signal.time_track, UniformTimeTrack)
+        n_points = len(self.trace_signal.RRSignal.poincare.xi)
+        with mock.patch.object(UniformTimeTrack, '__array__', side_effect=AssertionError("the array was made")):
+            for point in (1, 500, n_points - 3):
+                self.trace_signal.set_position_on_pp_click({'points': [{'pointNumber': point}]})
@@ -0,0 +1,172 @@
+import unittest
+from unittest import mock
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from signalweaver.signal_classes import ECG
+from signalweaver.traces.trace_rep import TraceECGSignal
+from signalweaver.signal_processing import ecg_processing
+from signalweaver.signal_processing.ecg_processing import detect_r_waves, detect_r_waves_in_blocks
+from signalweaver.results_store import WRITER
+
+
+def write_ecg(file_path, seconds=120, frequency=200, seed=777):
+    # a crude ECG (see ecg_processing_tests) with a negative offset, so that the polarities differ - long enough for
+    # the noise profile (see detect_artifacts)
+    random_generator = np.random.default_rng(seed)
+    time_track = np.arange(int(seconds * frequency)) / frequency
+    voltage = 0.02 * random_generator.standard_normal(len(time_track)) - 0.3
+    beats = np.arange(0.5, seconds - 0.5, 0.8)
+    for beat in beats + 0.03 * random_generator.standard_normal(len(beats)):
+        voltage += np.exp(-(time_track - beat) ** 2 / (2 * 0.01 ** 2))
+        voltage -= 0.6 * np.exp(-(time_track - beat - 0.04) ** 2 / (2 * 0.01 ** 2))
+    pd.DataFrame({'time': time_track, 'voltage': voltage}).to_csv(file_path, index=False)
+
+
+class TestBothPolarities(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'ecg.csv')
+        write_ecg(self.file_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_as_inverting(self):
+        expected = ECG(self.file_path)
+        expected.invert_ecg()
+        ecg = ECG(self.file_path, both_polarities=True)
+        ecg.other_polarity.join()
+        self.assertTrue(ecg.has_results(1))
+        for key, value in expected.full_data[1].items():
+            self.assertTrue(np.array_equal(ecg.full_data[1][key], value), key)
+        # the normal results are untouched, and inverting just picks the ready ones
+        self.assertTrue(np.array_equal(ecg.r_waves_all_pos, expected.full_data[0]['r_waves_all_pos']))
+        ecg.invert_ecg()
+        self.assertTrue(np.array_equal(ecg.r_waves_all_pos, expected.r_waves_all_pos))
+        self.assertIs(ecg.rr_intervals, ecg.full_data[1]['rr_intervals'])
+
+    def test_invert_waits(self):
+        ecg = ECG(self.file_path, both_polarities=True)
+        ecg.invert_ecg()  # possibly before the background calculation is done
+        self.assertFalse(ecg.other_polarity.is_alive())
+        self.assertTrue(ecg.has_results(1))
+        ecg.calculate_other_polarity_later()  # nothing to do any more
+        self.assertFalse(ecg.other_polarity.is_alive())
+
+    def test_one_job_per_recording(self):
+        ecgs = [ECG(self.file_path) for _ in range(2)]
+        started = threading.Event()
+        calculate_results = ECG.calculate_results
+
+        def calculate_later(ecg):
+            started.wait()  # still running when the second ECG asks
+            calculate_results(ecg)
+
+        with mock.patch.object(ECG, 'calculate_results', calculate_later):
+            for ecg in ecgs:
+                ecg.calculate_other_polarity_later()
+            self.assertIs(ecgs[0].other_polarity, ecgs[1].other_polarity)
+            started.set()
+            ecgs[0].other_polarity.join()
+        for key, value in ecgs[0].full_data[1].items():
+            # the same results, but not the same arrays - they are edited in place
+            self.assertTrue(np.array_equal(ecgs[1].full_data[1][key], value), key)
+            self.assertFalse(np.shares_memory(ecgs[1].full_data[1][key], value), key)
+
+    def test_failed(self):
+        ecg = ECG(self.file_path)
+        with mock.patch.object(ECG, 'calculate_results', side_effect=RuntimeError("detection failed")), \
+                mock.patch.object(threading, 'excepthook') as excepthook:
+            ecg.calculate_other_polarity_later()
+            failed = ecg.other_polarity
+            failed.join()
+        self.assertIs(excepthook.call_args[0][0].exc_type, RuntimeError)
+        self.assertFalse(ecg.has_results(1))
+        # the failed job is gone, a new one is started
+        ecg.calculate_other_polarity_later()
+        self.assertIsNot(ecg.other_polarity, failed)
+        ecg.other_polarity.join()
+        self.assertTrue(ecg.has_results(1))
+
+    def test_closed(self):
+        ecg = TraceECGSignal(self.file_path, both_polarities=True)
+        job = ecg.other_polarity
+        ecg.close()
+        job.join()
+        WRITER.flush()
+        # the results were dropped, and nothing was written from the closed record
+        self.assertFalse(ecg.has_results(1))
+        self.assertFalse(os.path.exists(ecg.npzify()))
+
+
+class TestInversion(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'ecg.csv')
+        write_ecg(self.file_path)
+
+    def tearDown(self):
+        WRITER.flush()  # inverting schedules a save - it must be done before the folder is gone
+        self.directory.cleanup()
+
+    def test_recording_not_copied(self):
+        ecg = TraceECGSignal(self.file_path)
+        signal_values = ecg.signal_values
+        time, normal = ecg.get_current_window()
+        _, normal_reduced = ecg.get_current_window(pixels=50)
+        ecg.invert_ecg()
+        self.assertIs(ecg.signal_values, signal_values)
+        mean = np.mean(signal_values)
+        _, inverted = ecg.get_current_window()
+        self.assertTrue(np.array_equal(inverted, -1 * (normal - mean) + mean))
+        _, inverted_reduced = ecg.get_current_window(pixels=50)
+        self.assertTrue(np.allclose(inverted_reduced, 2 * mean - normal_reduced))
+        ecg.invert_ecg()
+        self.assertTrue(np.array_equal(ecg.get_current_window()[1], normal))
+
+    def test_toggle_not_saved(self):
+        ecg = TraceECGSignal(self.file_path)
+        ecg.invert_ecg()  # the results for the inverted ECG are calculated, and have to be saved
+        self.assertTrue(ecg.is_dirty())
+        WRITER.flush()
+        self.assertFalse(ecg.is_dirty())
+        saved_at = os.path.getmtime(ecg.npzify())
+        for _ in range(2):
+            ecg.invert_ecg()
+            self.assertFalse(ecg.is_dirty())
+        WRITER.flush()
+        self.assertEqual(os.path.getmtime(ecg.npzify()), saved_at)
+
+    def test_detection(self):
+        ecg = ECG(self.file_path)
+        ecg.invert_ecg()
+        mean = np.mean(ecg.signal_values)
+        expected = detect_r_waves(ecg.time_track, -1 * (ecg.signal_values - mean) + mean)
+        self.assertTrue(np.array_equal(ecg.r_waves_all_pos, expected[:, 0]))
+        self.assertTrue(np.array_equal(ecg.r_waves_all_vals, expected[:, 1]))
+
+    def test_detection_in_blocks(self):
+        for n_jobs in (1, 2):
+            ecg = ECG(self.file_path, block_length=40, n_jobs=n_jobs)
+            n_samples = len(ecg.signal_values)
+
+            def mirrored(voltage, mean=None):
+                # the blocks are flipped, never the whole recording
+                self.assertTrue(mean is None or len(voltage) < n_samples)
+                return -1 * (voltage - mean) + mean if mean is not None else voltage
+
+            with mock.patch.object(ecg_processing, 'mirrored', side_effect=mirrored):
+                ecg.invert_ecg()
+            mean = np.mean(ecg.signal_values)
+            expected = detect_r_waves_in_blocks(ecg.time_track, -1 * (ecg.signal_values - mean) + mean, block_length=40)
+            self.assertTrue(np.array_equal(ecg.r_waves_all_pos, expected[:, 0]), n_jobs)
+            self.assertTrue(np.array_equal(ecg.r_waves_all_vals, expected[:, 1]), n_jobs)
+
+
+if __name__ == '__main__':
+    unittest.main()
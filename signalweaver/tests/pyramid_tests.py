@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+from signalweaver.traces.pyramid import MinMaxPyramid
+
+
+class TestMinMaxPyramid(unittest.TestCase):
+
+    def setUp(self):
+        self.signal = np.random.default_rng(7).standard_normal(200 * 60 * 25)
+        self.pyramid = MinMaxPyramid(self.signal)
+
+    def test_levels(self):
+        for block_size, minima, maxima in self.pyramid.levels:
+            self.assertEqual(len(minima), -(-len(self.signal) // block_size))
+            self.assertEqual(minima[-1], self.signal[(len(minima) - 1) * block_size:].min())
+            self.assertEqual(maxima[1], self.signal[block_size:2 * block_size].max())
+
+    def test_short_window(self):
+        positions, values = self.pyramid.window(1000, 4000, 2000)
+        self.assertTrue((positions == np.arange(1000, 4000)).all())
+        self.assertTrue((values == self.signal[1000:4000]).all())
+
+    def test_window(self):
+        for start, stop, n_points in [(0, 240000, 1500), (60000, 300000, 1000), (12345, 98765, 777),
+                                      (len(self.signal) - 50000, len(self.signal), 900)]:
+            positions, values = self.pyramid.window(start, stop, n_points)
+            self.assertTrue(2 * n_points <= len(values) <= 4 * n_points + 2)
+            # the pairs are equally spaced
+            self.assertEqual(len(np.unique(np.diff(positions[:-2]))), 1)
+            block_starts = positions[0::2]
+            for block_start, block_stop, minimum, maximum in zip(block_starts[:-1], block_starts[1:],
+                                                                 values[0:-2:2], values[1:-2:2]):
+                self.assertEqual(minimum, self.signal[block_start:block_stop].min())
+                self.assertEqual(maximum, self.signal[block_start:block_stop].max())
+            # nothing from the window is lost (the blocks at the edges can reach a little outside of it)
+            self.assertLessEqual(block_starts[0], start)
+            self.assertLessEqual(values[-2], self.signal[block_starts[-1]:stop].min())
+            self.assertGreaterEqual(values[-1], self.signal[block_starts[-1]:stop].max())
+
+    def test_spike_kept(self):
+        signal = np.zeros(200 * 60 * 20)
+        signal[123457] = 5
+        positions, values = MinMaxPyramid(signal).window(0, len(signal), 1000)
+        self.assertEqual(values.max(), 5)
+        self.assertLessEqual(len(values), 4000)
+
+
+if __name__ == '__main__':
+    unittest.main()
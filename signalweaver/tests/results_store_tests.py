@@ -0,0 +1,105 @@
+import unittest
+import os
+import json
+import tempfile
+import time
+import numpy as np
+from signalweaver.results_store import load_results, save_results, load_json_results, DebouncedWriter
+
+
+class TestResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.results_file = os.path.join(self.directory.name, 'ecg.npz')
+        self.full_data = [{'r_waves_all_pos': np.array([0.5, 1.3, 2.1]), 'annotations': np.array([0., 3., 0.]),
+                           'rr_intervals': np.array([0.8, 0.8])},
+                          {}]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        save_results(self.results_file, self.full_data)
+        full_data = load_results(self.results_file)
+        self.assertEqual(sorted(full_data[0]), sorted(self.full_data[0]))
+        for data_key in self.full_data[0]:
+            self.assertTrue((full_data[0][data_key] == self.full_data[0][data_key]).all())
+        self.assertFalse(full_data[1])
+
+    def test_lazy(self):
+        save_results(self.results_file, self.full_data)
+        full_data = load_results(self.results_file)
+        self.assertEqual(len(full_data[0].in_memory), 0)
+        self.assertTrue((full_data[0].get('annotations') == self.full_data[0]['annotations']).all())
+        self.assertEqual(list(full_data[0].in_memory), ['annotations'])
+        self.assertIsNone(full_data[0].get('artifacts_pos'))
+
+    def test_overwrite_lazy_source(self):
+        # saving back to the archive the results were lazily read from
+        save_results(self.results_file, self.full_data)
+        full_data = load_results(self.results_file)
+        full_data[1]['annotations'] = np.array([1., 1.])
+        save_results(self.results_file, full_data)
+        full_data = load_results(self.results_file)
+        self.assertTrue((full_data[0]['rr_intervals'] == self.full_data[0]['rr_intervals']).all())
+        self.assertTrue((full_data[1]['annotations'] == np.array([1., 1.])).all())
+
+    def test_archive_closed_before_replacing(self):
+        # the archive read lazily by other results is closed, with its arrays read, before it is replaced - an open file
+        # cannot be replaced on Windows
+        save_results(self.results_file, self.full_data)
+        full_data = load_results(self.results_file)
+        other = load_results(self.results_file)
+        archive = other[0].archive
+        save_results(self.results_file, full_data)
+        self.assertIsNone(archive.zip)
+        self.assertIsNone(other[0].archive)
+        self.assertTrue((other[0]['annotations'] == self.full_data[0]['annotations']).all())
+        self.assertEqual(sorted(other[0]), sorted(self.full_data[0]))
+        self.assertFalse(other[1])
+
+    def test_json_migration(self):
+        json_file = os.path.join(self.directory.name, 'ecg.json')
+        with open(json_file, 'w') as data_file:
+            json.dump([{data_key: data_item.tolist() for data_key, data_item in self.full_data[0].items()}, {}],
+                      data_file)
+        full_data = load_json_results(json_file)
+        self.assertTrue((full_data[0]['r_waves_all_pos'] == self.full_data[0]['r_waves_all_pos']).all())
+        self.assertEqual(full_data[1], {})
+
+    def test_wrong_version(self):
+        np.savez(self.results_file, version=np.array(99))
+        self.assertRaises(ValueError, load_results, self.results_file)
+
+    def test_no_temporary_files_left(self):
+        save_results(self.results_file, self.full_data)
+        save_results(self.results_file, self.full_data)
+        self.assertEqual(os.listdir(self.directory.name), ['ecg.npz'])
+
+
+class TestDebouncedWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.writes = []
+
+    def test_debounce(self):
+        writer = DebouncedWriter(delay=0.2)
+        for idx in range(5):
+            writer.schedule('ecg', lambda idx=idx: self.writes.append(idx))
+        writer.schedule('other', lambda: self.writes.append('other'))
+        time.sleep(0.6)
+        self.assertEqual(sorted(self.writes, key=str), [4, 'other'])
+
+    def test_flush_and_cancel(self):
+        writer = DebouncedWriter(delay=60)
+        writer.schedule('ecg', lambda: self.writes.append('ecg'))
+        writer.schedule('other', lambda: self.writes.append('other'))
+        writer.cancel('other')
+        writer.flush()
+        self.assertEqual(self.writes, ['ecg'])
+        self.assertEqual(writer.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
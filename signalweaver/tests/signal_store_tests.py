@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from signalweaver.signal_classes import Signal
+from signalweaver.signal_store import UniformTimeTrack, write_store, open_store, store_path, is_fresh
+
+
+class TestUniformTimeTrack(unittest.TestCase):
+
+    def setUp(self):
+        self.time_track = UniformTimeTrack(1.5, 0.005, 1000)
+        self.expected = 1.5 + np.arange(1000) * 0.005
+
+    def test_indexing(self):
+        self.assertEqual(len(self.time_track), 1000)
+        self.assertAlmostEqual(self.time_track[0], 1.5)
+        self.assertAlmostEqual(self.time_track[-1], self.expected[-1])
+        self.assertTrue(np.allclose(self.time_track[10:500:7], self.expected[10:500:7]))
+        self.assertTrue(np.allclose(self.time_track[np.array([3, 30, 300])], self.expected[[3, 30, 300]]))
+        self.assertTrue(np.allclose(np.asarray(self.time_track), self.expected))
+        self.assertRaises(IndexError, self.time_track.__getitem__, 1000)
+
+    def test_searchsorted(self):
+        values = np.array([0, 1.5, 1.5025, 1.6, self.expected[-1], 10])
+        for side in ('left', 'right'):
+            self.assertTrue((np.searchsorted(self.time_track, values, side=side) ==
+                             np.searchsorted(self.expected, values, side=side)).all())
+        # times taken from the track itself land at their own index
+        self.assertTrue((self.time_track.searchsorted(self.time_track[:]) == np.arange(1000)).all())
+
+    def test_searchsorted_does_not_make_the_array(self):
+        # np.searchsorted falls back to the whole array (__array__) if the method does not take its arguments
+        values = np.array([1.5, 1.6, 3])
+        with mock.patch.object(UniformTimeTrack, '__array__', side_effect=AssertionError("the array was made")):
+            for side in ('left', 'right'):
+                self.assertTrue((np.searchsorted(self.time_track, values, side=side) ==
+                                 np.searchsorted(self.expected, values, side=side)).all())
+
+
+class TestSignalStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'ecg.csv')
+        self.store_file = store_path(self.file_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        signal_values = np.sin(np.arange(500) / 10)
+        write_store(self.store_file, np.arange(500) / 200, signal_values)
+        time_track, stored_values = open_store(self.store_file)
+        self.assertTrue(np.allclose(time_track[:], np.arange(500) / 200))
+        self.assertTrue(np.allclose(stored_values, signal_values, atol=1e-6))
+        self.assertFalse(stored_values.flags.writeable)
+
+    def test_not_uniform(self):
+        self.assertRaises(ValueError, write_store, self.store_file, np.array([0, 0.005, 0.02, 0.025]), np.zeros(4))
+        self.assertFalse(os.path.exists(self.store_file))
+
+    def test_signal_uses_store(self):
+        pd.DataFrame({'time': np.arange(400) / 200, 'voltage': np.arange(400)}).to_csv(self.file_path, index=False)
+        signal = Signal(self.file_path)
+        self.assertTrue(is_fresh(self.store_file, self.file_path))
+        self.assertIsInstance(signal.time_track, UniformTimeTrack)
+        self.assertEqual(signal.sampling_rate, 200)
+        # the store is used even if the CSV is gone
+        os.remove(self.file_path)
+        open(self.file_path, 'w').close()
+        os.utime(self.file_path, (time.time() - 60, time.time() - 60))
+        signal = Signal(self.file_path)
+        self.assertTrue((signal.signal_values == np.arange(400)).all())
+
+    def test_stale_store(self):
+        pd.DataFrame({'time': np.arange(400) / 200, 'voltage': np.arange(400)}).to_csv(self.file_path, index=False)
+        Signal(self.file_path)
+        pd.DataFrame({'time': np.arange(200) / 100, 'voltage': -np.arange(200)}).to_csv(self.file_path, index=False)
+        os.utime(self.store_file, (time.time() - 60, time.time() - 60))
+        signal = Signal(self.file_path)
+        self.assertEqual(len(signal.time_track), 200)
+        self.assertEqual(signal.sampling_rate, 100)
+        self.assertTrue((signal.signal_values == -np.arange(200)).all())
+
+    def test_not_uniform_kept_in_memory(self):
+        pd.DataFrame({'time': [0, 0.005, 0.02, 0.025], 'voltage': [1, 2, 3, 4]}).to_csv(self.file_path, index=False)
+        signal = Signal(self.file_path)
+        self.assertFalse(os.path.exists(self.store_file))
+        self.assertTrue(np.allclose(signal.time_track, [0, 0.005, 0.02, 0.025]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from signalweaver.signal_classes import Signal, parse_datetime_track, DATETIME_FORMAT
+
+
+class TestDatetimeTrack(unittest.TestCase):
+
+    def setUp(self):
+        # 200 Hz across midnight (and the end of February in a leap year)
+        self.dates = pd.Series((pd.Timestamp('2020-02-28 23:59:50') + pd.to_timedelta(np.arange(4000) * 5, unit='ms'))
+                               .strftime(DATETIME_FORMAT)).str[:-3]
+
+    def test_same_as_strptime(self):
+        dates = [datetime.strptime(_, DATETIME_FORMAT) for _ in self.dates]
+        expected = np.array([(_ - dates[0]).total_seconds() for _ in dates])
+        self.assertTrue(np.allclose(parse_datetime_track(self.dates), expected, rtol=0, atol=1e-9))
+
+    def test_midnight(self):
+        time_track = parse_datetime_track(self.dates)
+        self.assertTrue((np.diff(time_track) > 0).all())
+        self.assertAlmostEqual(time_track[-1], 19.995)
+
+    def test_fraction_digits(self):
+        time_track = parse_datetime_track(['01/01/2020 10:00:00.5', '01/01/2020 10:00:00.75',
+                                           '01/01/2020 10:00:01.125000\r'])
+        self.assertTrue(np.allclose(time_track, [0, 0.25, 0.625]))
+
+    def test_no_leading_zeros(self):
+        # not the fixed layout - this is parsed by pandas
+        time_track = parse_datetime_track(['9/01/2020 23:59:59.5', '10/01/2020 0:00:00.5'])
+        self.assertTrue(np.allclose(time_track, [0, 1]))
+
+
+class TestSignalTimeTrack(unittest.TestCase):
+
+    def test_datetime_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'ecg.csv')
+            pd.DataFrame({'time': ['31/12/2019 23:59:59.990', '31/12/2019 23:59:59.995', '01/01/2020 00:00:00.000'],
+                          'voltage': [256, 512, 768]}).to_csv(file_path, index=False)
+            signal = Signal(file_path)
+        self.assertTrue(np.allclose(signal.time_track, [0, 0.005, 0.01]))
+        self.assertTrue(np.allclose(signal.signal_values, [1, 2, 3]))
+        self.assertEqual(signal.sampling_rate, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+min/max decimation pyramid of the ECG - level k keeps the minimum and the maximum of every block of base**k samples.
+A window shown on a plot a few thousand pixels wide does not need more than a min/max pair per pixel, and drawing the
+pair keeps the QRS spikes at their full height, which plain subsampling would lose
+"""
+import numpy as np
+
+
+class MinMaxPyramid:
+
+    def __init__(self, signal, base=4):
+        """
+        the levels are built at once - every level is base times shorter than the previous one, so all of them
+        together take 2/(base - 1) of the memory of the signal
+        :param signal: the ECG (can be memory-mapped)
+        :param base: the number of blocks of a level merged into one block of the next level
+        """
+        self.signal = signal
+        self.base = base
+        self.levels = [(1, signal, signal)]  # (block size, minima, maxima) - level 0 is the signal itself
+        minima, maxima, block_size = signal, signal, 1
+        while len(minima) > base:
+            starts = np.arange(0, len(minima), base)
+            minima, maxima = np.minimum.reduceat(minima, starts), np.maximum.reduceat(maxima, starts)
+            block_size *= base
+            self.levels.append((block_size, minima, maxima))
+
+    def window(self, start, stop, n_points):
+        """
+        the window of the signal between start and stop (sample indices) reduced to about n_points min/max pairs -
+        the level with the largest blocks not larger than (stop - start)/n_points samples is used, and its blocks
+        are merged further so that there are between n_points and 2*n_points pairs. Every pair is given as two
+        points, half a block apart, so the points are equally spaced like the samples themselves
+        :param start: the first sample of the window
+        :param stop: the sample after the last one
+        :param n_points: the number of pairs wanted (the width of the plot in pixels)
+        :return: the sample indices of the points and their values. If the window is short enough it is returned as
+        it is
+        """
+        start, stop = max(start, 0), min(stop, len(self.signal))
+        samples_per_point = (stop - start) // max(n_points, 1)
+        if samples_per_point < 2:
+            return np.arange(start, stop), self.signal[start:stop]
+        level = next(level for level in reversed(self.levels) if level[0] <= samples_per_point)
+        level_block_size, level_minima, level_maxima = level
+        # the blocks of the level covering the window, merged by factor
+        factor = samples_per_point // level_block_size
+        level_stop = -(-stop // level_block_size)
+        level_blocks = np.arange(start // level_block_size, level_stop, factor)
+        minima = np.minimum.reduceat(level_minima[:level_stop], level_blocks)
+        maxima = np.maximum.reduceat(level_maxima[:level_stop], level_blocks)
+        block_starts = level_blocks * level_block_size
+        positions = np.empty(2 * len(block_starts), dtype=np.int64)
+        positions[0::2] = block_starts
+        positions[1::2] = block_starts + factor * level_block_size // 2
+        values = np.empty(2 * len(block_starts), dtype=np.result_type(minima.dtype, maxima.dtype))
+        values[0::2], values[1::2] = minima, maxima
+        # the half block point of the last, possibly incomplete, block could be past the end of the signal
+        return np.minimum(positions, len(self.signal) - 1), values
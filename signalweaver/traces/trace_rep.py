@@ -1,8 +1,13 @@
+import copy
+import threading
 import numpy as np
 
 import plotly.graph_objs as go
 
 from ..signal_classes import ECG
+from ..results_store import WRITER
+from .pyramid import MinMaxPyramid
+from ..beat_store import BeatStore, EditBuffers, in_gap_buffer
 
 POSSIBLE_WINDOWS = {'15 s': 15, '1 min': 60, '3 min': 3 * 60, '5 min': 5 * 60, '10 min': 10 * 60, '20 min': 20 * 60}
 POSSIBLE_LINE_No = {'15 s': 1, '1 min': 3, '3 min': 5, '5 min': 10, '10 min': 20, '20 min': 20}
@@ -11,22 +16,82 @@ PHYSICAL_LINE_HEIGHT = 100
 
 
 class TraceECGSignal(ECG):
-    def __init__(self, file_path):
-        super().__init__(file_path)
+    def __init__(self, file_path, block_length=None, n_jobs=1, template_cost='fast', both_polarities=False):
+        # the results can be shared with the records of other sessions (see share) - they are guarded by the lock and
+        # counted by the versions (how many times the results for either polarity have been written) from the start
+        self.save_lock = threading.RLock()
+        self.versions = [0, 0]
+        self.seen_versions = [0, 0]  # the versions of the results this record has
+        super().__init__(file_path, block_length=block_length, n_jobs=n_jobs, template_cost=template_cost)
         self.n_right_clicks = 0
         self.n_right_secondary_counter = 0
         self.n_left_clicks = 0
         self.n_left_secondary_counter = 0
         self.change = 0
+        self.saved_change = 0 if self.loaded else None  # the value of change when the results were last saved
         self.last_clicked_at = 0
         self.position = self.get_initial_position()
         self.first_peak_position = 0
         self.offset_over_trace = + 0.05  # USE THIS WHILE CHANGING VIEWING WINDOW!!!
         self.detection_window = int(0.05 / self.sampling_period)
         self.inverted = False
+        self.pyramid = None  # min/max pyramid of the ECG for long windows, see get_pyramid
+        self.beat_store = None  # the R-waves being edited, see get_beat_store
         self.window_length, self.number_of_lines, self.single_line_height = self.get_initial_window()
         # Calculate and store initial Poincare plot ranges
         self._calculate_initial_poincare_ranges()
+        if both_polarities:
+            # started here, not in ECG, when the results can already be saved
+            self.calculate_other_polarity_later()
+
+    def share(self):
+        """
+        a record of the same recording for another session - it has its own viewing window, and shares the results
+        (full_data and the lock guarding them) with this one, so that the sessions see each other's changes and save
+        the same results instead of overwriting each other's
+        :return: TraceECGSignal
+        """
+        with self.save_lock:
+            record = copy.copy(self)
+        record.seen_versions = [None, None]  # the arrays are taken from the results below, not from this record
+        record.n_right_clicks, record.n_right_secondary_counter = 0, 0
+        record.n_left_clicks, record.n_left_secondary_counter = 0, 0
+        record.change, record.saved_change = 0, 0
+        record.last_clicked_at, record.first_peak_position = 0, 0
+        record.position = record.get_initial_position()
+        record.beat_store, record.edit_buffers = None, EditBuffers()
+        record.closed = False
+        record.window_length, record.number_of_lines, record.single_line_height = record.get_initial_window()
+        record.take_shared_results()
+        return record
+
+    def take_shared_results(self):
+        """
+        takes the results for the current polarity from full_data, if the record of another session (see share) has
+        written newer ones since this record last took or wrote them
+        """
+        idx = 1 if self.inverted else 0
+        with self.save_lock:
+            if self.seen_versions[idx] != self.versions[idx] and self.has_results(idx):
+                self.get_vals_from_results_dict(idx)
+
+    def get_vals_from_results_dict(self, idx):
+        super().get_vals_from_results_dict(idx)
+        # the arrays in the gap buffers of the record which wrote the results are edited in place by it, this record
+        # gets copies
+        for attribute, value in list(vars(self).items()):
+            if in_gap_buffer(value):
+                setattr(self, attribute, value.copy())
+        self.seen_versions[idx] = self.versions[idx]
+
+    def update_results_dict(self):
+        idx = 1 if self.inverted else 0
+        with self.save_lock:
+            if self.seen_versions[idx] != self.versions[idx] and self.has_results(idx):
+                return  # the record of another session has written newer results, which this one has not taken yet
+            super().update_results_dict()
+            self.versions[idx] += 1
+            self.seen_versions[idx] = self.versions[idx]
 
     def get_initial_position(self):
         return self.time_track[0]
@@ -81,17 +146,34 @@ class TraceECGSignal(ECG):
             seconds = time_in_seconds % 60
             return f"{hours}:{minutes:02d}:{seconds:06.3f}"
 
-    def get_current_time_track(self):
-        position = self.position - self.get_initial_position()
-        return self.time_track[int(position / self.sampling_period):
-                               int((position + self.window_length) /
-                                   self.sampling_period)]
-
-    def get_current_ecg_track(self):
+    def get_current_window(self, pixels=None):
+        """
+        the time track and the ECG in the current window
+        :param pixels: the width of the plot in pixels - if given, the window is reduced (by the min/max pyramid) to
+        about one min/max pair per pixel of every line of the folded plot, so the size of the window does not matter
+        :return: time track, ECG
+        """
         position = self.position - self.get_initial_position()
-        return self.signal_values[int(position / self.sampling_period):
-                                  int((position + self.window_length) /
-                                      self.sampling_period)]
+        start = int(position / self.sampling_period)
+        stop = int((position + self.window_length) / self.sampling_period)
+        if pixels is None:
+            return self.time_track[start:stop], self.oriented(self.signal_values[start:stop])
+        # the pyramid is that of the recording - the flipped minima and maxima are the maxima and minima of the
+        # inverted ECG, so it serves both polarities
+        positions, values = self.get_pyramid().window(start, stop, pixels * self.number_of_lines)
+        return self.time_track[positions], self.oriented(values)
+
+    def get_pyramid(self):
+        # built on first use (and again if the recording has been replaced)
+        if self.pyramid is None or self.pyramid.signal is not self.signal_values:
+            self.pyramid = MinMaxPyramid(self.signal_values)
+        return self.pyramid
+
+    def get_current_time_track(self, pixels=None):
+        return self.get_current_window(pixels)[0]
+
+    def get_current_ecg_track(self, pixels=None):
+        return self.get_current_window(pixels)[1]
 
     def get_current_peaks_positions(self, positions, values, get_first_peak=False):
         """
@@ -101,14 +183,65 @@ class TraceECGSignal(ECG):
         :param get_first_peak: whether the position of the first peak is meaningful (it not always is, so set to default)
         :return: the positions and values of the peaks in the viewing window, and either the first peak position or 0
         """
-        condition = np.logical_and(
-            positions >= self.position,
-            positions < self.position + self.window_length)
-        try:
-            first_peak_position = 0 if not get_first_peak else np.where(condition == 1)[0][0]  # 1 represents True
-        except IndexError:
-            first_peak_position = None
-        return positions[condition], values[condition], first_peak_position
+        # the positions are sorted, so the peaks in the window are a slice, found by binary search
+        first, last = np.searchsorted(positions, [self.position, self.position + self.window_length])
+        if not get_first_peak:
+            first_peak_position = 0
+        else:
+            first_peak_position = int(first) if first < last else None
+        return positions[first:last], values[first:last], first_peak_position
+
+    def is_dirty(self):
+        return self.change != self.saved_change
+
+    def mark_changed(self):
+        """
+        to be called after the annotations have been changed - the results are saved a while later
+        """
+        self.change += 1
+        self.save_later()
+
+    def save_later(self):
+        """
+        saves the results in the background, if there is anything to save - the saving is postponed while the
+        changes keep coming (see DebouncedWriter). Nothing is saved from a closed ECG
+        """
+        if self.is_dirty() and not self.closed:
+            WRITER.schedule(self, self.save_if_dirty)
+
+    def save_if_dirty(self):
+        with self.save_lock:
+            if self.is_dirty() and not self.closed:
+                self.save_processed_data()
+
+    def save_processed_data(self):
+        WRITER.cancel(self)
+        with self.save_lock:
+            change = self.change
+            self.update_results_dict()
+            super().save_processed_data()
+            self.saved_change = change
+
+    def other_polarity_calculated(self):
+        with self.save_lock:
+            self.saved_change = None
+        self.save_later()
+
+    def close(self):
+        super().close()
+        WRITER.cancel(self)  # the changes have been saved when it was dropped (see ecgs.manager.flush)
+
+    def invert_ecg(self):
+        if self.other_polarity is not None:
+            self.other_polarity.join()  # the results for the other polarity might be on the way
+        calculated = not self.has_results(0 if self.inverted else 1)
+        super().invert_ecg()
+        if calculated:
+            # the results for this polarity have just been calculated - picking the ones which are there changes
+            # nothing which is saved
+            with self.save_lock:
+                self.saved_change = None
+            self.save_later()
 
     def step_right_left(self, n_clicked_right, n_clicked_left):
         """
@@ -135,8 +268,7 @@ class TraceECGSignal(ECG):
             else:
                 self.position = self.position - self.window_length
             self.n_left_clicks += 1
-        self.update_results_dict()
-        self.save_processed_data()
+        self.save_later()
         return self.position  # this is for testing purposes
 
     def set_position_on_pp_click(self, click_data_PP):
@@ -156,32 +288,31 @@ class TraceECGSignal(ECG):
         # click_data_PP remembers its current state
         if self.last_clicked_at != click_position:
             self.last_clicked_at = click_position
-            # we start counting from the position of the first r-wave, not from the first rr-interval, because
-            # the beginning is not present, unless there is an r-wave right at the beginning
-            # the following needs to be  ummed instead [r_waves_pos[0], self.rr_intervals[0:click_position]
-            # the first element in this vector is there because the part before first RR would not be represented
-            # otherwise
-            auxiliary_rr_time_track = np.cumsum(
-                np.concatenate(
-                    (np.array((self.r_waves_all_pos[0],)),
-                     self.rr_intervals[0:(self.RRSignal.poincare.x_i_indices[click_position + 2])])
-                )  # I am adding 2, because creating PP is like differentiating twice - first, R-waves are combined
-            )  # in pairs to form RR intervals, and then RR intervals are combined in pairs to form PP
-            clicked_at = np.where(
-                np.array(self.time_track) ==  # the clicked poincare plot point
-                auxiliary_rr_time_track[-1])[0][0] * self.sampling_period + self.time_track[0]  # have to add the
-            #  beginning of the time track, otherwise this method counts from zero
+            # the clicked poincare plot point - I am adding 2, because creating PP is like differentiating twice -
+            # first, R-waves are combined in pairs to form RR intervals, and then RR intervals are combined in pairs
+            # to form PP
+            clicked_at, clicked_sample = self.get_rr_position(self.RRSignal.poincare.x_i_indices[click_position + 2])
 
             # centering viewing window on the clicked point, unless this is the beginning or too close to the end
             if clicked_at < np.sum(self.RRSignal.poincare.xi[click_position + 2:click_position + 6]):
                 self.position = clicked_at
-            elif clicked_at + self.window_length / self.sampling_period >= len(self.time_track):
+            elif clicked_sample + self.window_length / self.sampling_period >= len(self.time_track):
                 self.position = self.time_track[-1] - self.window_length
             else:
                 self.position = clicked_at - np.sum(self.RRSignal.poincare.xi[click_position + 2:click_position + 6])
             #  now the clicked RR will be fourth from the left - to understand why I use 2 and 6 see
             #  the comment above
 
+    def get_rr_position(self, rr_index):
+        """
+        where an RR interval begins - the RR interval i begins at the R-wave i, so this is a lookup, and the sample is
+        found by binary search in the time track (by arithmetic, if the time track is uniform)
+        :param rr_index: the index of the RR interval
+        :return: the time of the beginning of the interval, snapped to the time track, and the index of that sample
+        """
+        sample = min(int(self.time_track.searchsorted(self.r_waves_all_pos[rr_index])), len(self.time_track) - 1)
+        return self.time_track[sample], sample
+
     def update_window_length(self, window):
         """
         checks whether the user has changed the window length and updates if appropriate
@@ -212,35 +343,64 @@ class TraceECGSignal(ECG):
         :ignore_radius: the radius within which a click will be ignored
         :return: None
         """
-        greater_rr_position = np.where(self.r_waves_all_pos > ecg_click_position)[0][0]
-        # finding the highest peak within 2*self.detection_window seconds of the click - there does not seem to be a
-        # dedicated method for this in numpy
-        clicked_index = np.where(self.time_track >= ecg_click_position)[0][0]
-        ecg_segment = self.signal_values[clicked_index - self.detection_window:
-                                         clicked_index + self.detection_window]
-        relative_local_maximum = np.argmax(ecg_segment)
-        global_local_maximum = clicked_index - self.detection_window + relative_local_maximum
-        # checking if there already is an R-wave at the clicked position
-        # if there is, returning without changing anything
-        # print(greater_rr_position)
-        # print(abs(self.r_waves_all_pos[
-        #           greater_rr_position - 1]/self.sampling_period - global_local_maximum), ignore_radius)
-        if abs(self.r_waves_all_pos[
-                   greater_rr_position - 1]/self.sampling_period - global_local_maximum) < ignore_radius or abs(self.r_waves_all_pos[
-                   greater_rr_position]/self.sampling_period - global_local_maximum) < ignore_radius:
-            # print("move along, nothing to see")
-            return False  # don't do anything
-        # inserting the r-wave
-        low = greater_rr_position - 2 if greater_rr_position - 2 > 0 else 0
-        high = greater_rr_position + 2 if greater_rr_position + 2 < len(self.r_waves_all_pos) else len(self.r_waves_all_pos)
-
-        self.r_waves_all_pos = np.insert(self.r_waves_all_pos, greater_rr_position,
-                                         self.time_track[global_local_maximum])
-        self.r_waves_all_vals = np.insert(self.r_waves_all_vals, greater_rr_position,
-                                          self.signal_values[global_local_maximum])
-        # inserting the corresponding annotation
-        self.annotations = np.insert(self.annotations, greater_rr_position, 0)
-        return True
+        # the arrays are changed in place, so not while they are being saved - and the results of another session
+        # (see share) might have to be taken first
+        with self.save_lock:
+            self.take_shared_results()
+            beats = self.get_beat_store()
+            greater_rr_position = beats.find(ecg_click_position, side='right')  # the first R-wave after the click
+            # finding the highest peak within 2*self.detection_window seconds of the click - there does not seem to be a
+            # dedicated method for this in numpy
+            clicked_index = self.time_track.searchsorted(ecg_click_position)  # the first sample at or after the click
+            ecg_segment = self.oriented(self.signal_values[clicked_index - self.detection_window:
+                                                           clicked_index + self.detection_window])
+            relative_local_maximum = np.argmax(ecg_segment)
+            global_local_maximum = clicked_index - self.detection_window + relative_local_maximum
+            # checking if there already is an R-wave at the clicked position
+            # if there is, returning without changing anything
+            # print(greater_rr_position)
+            # print(abs(self.r_waves_all_pos[
+            #           greater_rr_position - 1]/self.sampling_period - global_local_maximum), ignore_radius)
+            if abs(self.r_waves_all_pos[
+                       greater_rr_position - 1]/self.sampling_period - global_local_maximum) < ignore_radius or abs(self.r_waves_all_pos[
+                       greater_rr_position]/self.sampling_period - global_local_maximum) < ignore_radius:
+                # print("move along, nothing to see")
+                return False  # don't do anything
+            # inserting the r-wave
+            low = greater_rr_position - 2 if greater_rr_position - 2 > 0 else 0
+            high = greater_rr_position + 2 if greater_rr_position + 2 < len(self.r_waves_all_pos) else len(self.r_waves_all_pos)
+
+            # (with the corresponding annotation)
+            beats.insert(greater_rr_position, self.time_track[global_local_maximum],
+                         self.oriented(self.signal_values[global_local_maximum]), 0)
+            self.r_waves_all_pos, self.r_waves_all_vals, self.annotations = beats.arrays()
+            self.update_after_edit(greater_rr_position, 0, 1)
+            return True
+
+    def annotate_rr(self, beat, annotation):
+        """
+        this function changes the annotation of an r-wave
+        :param beat: the index of the r-wave
+        :param annotation: the new annotation (0 - normal, 1 - ventricular, 2 - supraventricular, 3 - artifact)
+        :return: None
+        """
+        with self.save_lock:
+            self.take_shared_results()
+            beats = self.get_beat_store()
+            beats.annotations[beat] = annotation
+            self.r_waves_all_pos, self.r_waves_all_vals, self.annotations = beats.arrays()
+            self.update_after_edit(beat, 1, 1)
+
+    def get_beat_store(self):
+        """
+        the store the R-waves are edited in - built again when the R-waves have been replaced (e.g. after inversion)
+        :return: BeatStore
+        """
+        if self.beat_store is None or not self.beat_store.backs(self.r_waves_all_pos, self.r_waves_all_vals,
+                                                                self.annotations):
+            self.beat_store = BeatStore(self.r_waves_all_pos, self.r_waves_all_vals, self.annotations)
+            self.r_waves_all_pos, self.r_waves_all_vals, self.annotations = self.beat_store.arrays()
+        return self.beat_store
 
     def remove_rr(self, ecg_click_position):
         """
@@ -248,10 +408,13 @@ class TraceECGSignal(ECG):
         :param ecg_click_position: ecg_click_position: clicked position in time units
         :return: None
         """
-        exact_rr_position = np.where(self.r_waves_all_pos >= ecg_click_position)[0][0]
-        self.r_waves_all_pos = np.delete(self.r_waves_all_pos, exact_rr_position)
-        self.r_waves_all_vals = np.delete(self.r_waves_all_vals, exact_rr_position)
-        self.annotations = np.delete(self.annotations, exact_rr_position)
+        with self.save_lock:
+            self.take_shared_results()
+            beats = self.get_beat_store()
+            exact_rr_position = beats.find(ecg_click_position, side='left')  # the first R-wave at or after the click
+            beats.delete(exact_rr_position)
+            self.r_waves_all_pos, self.r_waves_all_vals, self.annotations = beats.arrays()
+            self.update_after_edit(exact_rr_position, 1, 0)
 
         # now see what the next one is and, if it is 0 and the RR is too large, annotate it as artifact
         #if not (self.rr_filter[0] < self.r_waves_all_pos[exact_rr_position] - self.r_waves_all_pos[exact_rr_position-1] < self.rr_filter[1]):
@@ -398,9 +561,9 @@ class TraceECGSignal(ECG):
         ############################################################################################################
         x_r_waves, y_r_waves, self.first_peak_position = self.get_current_peaks_positions(self.r_waves_all_pos,
                                                                                           self.r_waves_all_vals, True)
-        x_ventriculars, y_ventriculars, _ = self.get_current_peaks_positions(*self.get_ventriculars())
-        x_supraventriculars, y_supraventriculars, _ = self.get_current_peaks_positions(*self.get_supraventriculars())
-        x_artifacts, y_artifacts, _ = self.get_current_peaks_positions(*self.get_artifacts())
+        x_ventriculars, y_ventriculars, _ = self.get_current_peaks_positions(*self.get_classified_beats('ventriculars'))
+        x_supraventriculars, y_supraventriculars, _ = self.get_current_peaks_positions(*self.get_classified_beats('supraventriculars'))
+        x_artifacts, y_artifacts, _ = self.get_current_peaks_positions(*self.get_classified_beats('artifacts'))
         time = self.get_current_time_track()
         ecg_trace = self.get_current_ecg_track()
         return self.fold_figure(time, ecg_trace, x_r_waves, y_r_waves, x_ventriculars, y_ventriculars,